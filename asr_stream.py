@@ -0,0 +1,159 @@
+# 流式语音识别：录音开始即边录边识别，语音结束时几乎立即拿到最终结果
+import threading
+from abc import ABC, abstractmethod
+import dashscope
+from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
+from config import Config
+
+
+class StreamingRecognizer(ABC):
+    """
+    流式识别器接口
+
+    每个识别器对象只对应一段语音：
+        recognizer.start(on_partial)   # 检测到语音开始
+        recognizer.feed(pcm_bytes)     # 每采集到一帧就送入
+        text = recognizer.finish()     # 语音结束，返回最终识别结果，出错时返回 None
+    """
+
+    def __init__(self):
+        self.partial_text = ""
+        self._on_partial = None
+
+    def start(self, on_partial=None):
+        self._on_partial = on_partial
+
+    @abstractmethod
+    def feed(self, pcm_bytes):
+        pass
+
+    @abstractmethod
+    def finish(self):
+        pass
+
+    def cancel(self):
+        """放弃本段语音的识别"""
+        pass
+
+    def _emit_partial(self, text):
+        self.partial_text = text
+        if self._on_partial:
+            self._on_partial(text)
+
+
+class _DashScopeCallback(RecognitionCallback):
+    """把 fun-asr-realtime 的识别事件转交给 DashScopeStreamingRecognizer"""
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+
+    def on_event(self, result: RecognitionResult) -> None:
+        sentence = result.get_sentence()
+        if isinstance(sentence, dict) and 'text' in sentence:
+            self.recognizer._on_sentence(sentence['text'], RecognitionResult.is_sentence_end(sentence))
+
+    def on_error(self, result: RecognitionResult) -> None:
+        print(f"流式语音识别错误: {result.message}")
+        self.recognizer.error = True
+
+
+class DashScopeStreamingRecognizer(StreamingRecognizer):
+    """基于阿里云 fun-asr-realtime 的流式识别器"""
+
+    def __init__(self, model='fun-asr-realtime', sample_rate=16000):
+        super().__init__()
+        self.model = model
+        self.sample_rate = sample_rate
+        self.error = False
+        self._recognition = None
+        self._final_sentences = []
+        self._lock = threading.Lock()
+
+    def start(self, on_partial=None):
+        super().start(on_partial)
+        dashscope.api_key = Config.API_KEY
+        self._recognition = Recognition(model=self.model,
+                                        format='pcm',
+                                        sample_rate=self.sample_rate,
+                                        callback=_DashScopeCallback(self))
+        try:
+            self._recognition.start()
+        except Exception as e:
+            print(f"启动流式语音识别失败: {e}")
+            self.error = True
+            self._recognition = None
+
+    def feed(self, pcm_bytes):
+        if self._recognition is None or self.error:
+            return
+        try:
+            self._recognition.send_audio_frame(pcm_bytes)
+        except Exception as e:
+            print(f"发送音频帧失败: {e}")
+            self.error = True
+
+    def finish(self):
+        """停止发送音频并等待服务端返回最后一句结果"""
+        if self._recognition is None:
+            return None
+        try:
+            self._recognition.stop()
+        except Exception as e:
+            print(f"结束流式语音识别失败: {e}")
+            self.error = True
+        finally:
+            self._recognition = None
+        if self.error:
+            return None
+        return self.partial_text
+
+    def cancel(self):
+        if self._recognition is not None:
+            try:
+                self._recognition.stop()
+            except Exception:
+                pass
+            self._recognition = None
+
+    def _on_sentence(self, text, is_end):
+        """partial_text 始终是到目前为止的完整识别文本：已结束的句子 + 当前句的中间结果"""
+        with self._lock:
+            if is_end:
+                self._final_sentences.append(text)
+                full_text = "".join(self._final_sentences)
+            else:
+                full_text = "".join(self._final_sentences) + text
+        self._emit_partial(full_text)
+
+
+class LocalStandInRecognizer(StreamingRecognizer):
+    """
+    离线替身识别器，不发起任何网络请求，便于离线调试整条链路
+
+    按已收到的音频时长逐步"识别"出预设文本作为部分结果，finish() 返回完整的预设文本。
+    transcript 可以是固定字符串，也可以是每段语音调用一次的无参函数。
+    """
+
+    def __init__(self, transcript="你好", sample_rate=16000, chars_per_second=4.0):
+        super().__init__()
+        self.transcript = transcript
+        self.sample_rate = sample_rate
+        self.chars_per_second = chars_per_second
+        self._target = ""
+        self._received_samples = 0
+
+    def start(self, on_partial=None):
+        super().start(on_partial)
+        self._target = self.transcript() if callable(self.transcript) else self.transcript
+        self._received_samples = 0
+
+    def feed(self, pcm_bytes):
+        self._received_samples += len(pcm_bytes) // 2
+        seconds = self._received_samples / self.sample_rate
+        chars = min(len(self._target), int(seconds * self.chars_per_second))
+        if chars > len(self.partial_text):
+            self._emit_partial(self._target[:chars])
+
+    def finish(self):
+        self.partial_text = self._target
+        return self._target
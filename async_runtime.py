@@ -0,0 +1,72 @@
+# 对话引擎共用的异步运行时：一个常驻的事件循环负责 TTS、大模型、识别与记忆的全部 I/O
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 事件循环运行在独立的后台线程中，跨轮次常驻，WebSocket、HTTP 连接池等异步资源都挂在它上面。
+# 只提供同步 SDK 的调用（识别、向量库等）放进共享线程池执行，不阻塞事件循环。
+_loop = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """获取（必要时启动）全局事件循环"""
+    global _loop, _executor
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="conversation-io")
+            _loop.set_default_executor(_executor)
+            threading.Thread(target=_loop.run_forever, name="conversation-loop", daemon=True).start()
+    return _loop
+
+
+def submit(coro):
+    """从任意线程把协程提交到事件循环，返回 concurrent.futures.Future，调用 cancel() 即可中途打断"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_sync(coro, timeout=None):
+    """同步入口：在事件循环中执行协程，并在调用线程中等待结果（不能在事件循环线程内调用）"""
+    return submit(coro).result(timeout)
+
+
+def call_soon(callback, *args):
+    """从采集、检测等线程安全地把回调投递到事件循环执行"""
+    get_loop().call_soon_threadsafe(callback, *args)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """在共享线程池中执行阻塞调用并等待结果"""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def submit_blocking(func, *args, **kwargs):
+    """从任意线程把阻塞调用交给共享线程池，不等待结果，返回 concurrent.futures.Future（例如检测线程取消识别器）"""
+    get_loop()
+    return _executor.submit(functools.partial(func, *args, **kwargs))
+
+
+def shutdown(timeout=5.0):
+    """取消仍在运行的任务并停止事件循环，程序退出时调用"""
+    global _loop, _executor
+    with _lock:
+        loop, executor = _loop, _executor
+        _loop, _executor = None, None
+    if loop is None:
+        return
+
+    async def _cancel_all():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        asyncio.run_coroutine_threadsafe(_cancel_all(), loop).result(timeout)
+    except Exception as e:
+        print(f"关闭异步运行时出错: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    executor.shutdown(wait=False)
@@ -0,0 +1,289 @@
+# 常驻的双工音频引擎：整个程序只创建一个 PyAudio，输入/输出流各打开一次，回调模式运行
+import threading
+import pyaudio
+from audio_player import resample_pcm
+from config import Config
+
+
+class AudioEngine:
+    """
+    双工音频引擎
+
+    输入流: 每采集到一个 chunk（默认 30ms）就在音频回调线程中分发给所有订阅者，
+            订阅者回调必须很快返回（通常只是放入队列）。
+    输出流: 由 set_output_source() 设置的数据源填充（通常是 PlaybackSink），没有数据源时输出静音。
+            实际播放的音频（含静音）可以通过 subscribe_playback() 取得，作为回声抑制的参考信号。
+
+    设备可以用序号或名称中的关键字指定，None 表示系统默认设备。设备不支持请求的采样率时
+    使用设备的默认采样率打开，并在回调中重采样，订阅者和数据源看到的始终是请求的采样率。
+    enable_input / enable_output 为 False 时不打开对应方向的流（例如采集进程只需要输入）。
+    """
+
+    def __init__(self, input_rate=16000, output_rate=24000, chunk=480, output_frames_per_buffer=480,
+                 input_device=None, output_device=None, channels=1, enable_input=True, enable_output=True):
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.chunk = chunk
+        self.output_frames_per_buffer = output_frames_per_buffer
+        self.input_device = input_device
+        self.output_device = output_device
+        self.channels = channels
+        self.sample_width = 2  # 16-bit
+        self.enable_input = enable_input
+        self.enable_output = enable_output
+
+        self._pyaudio = None
+        self._input_stream = None
+        self._output_stream = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._playback_subscribers = []
+        self._output_source = None
+        self._output_source_rate = output_rate
+
+        # 实际打开的设备采样率（协商结果）
+        self.device_input_rate = None
+        self.device_output_rate = None
+
+        # 统计信息
+        self.stats = {
+            "input_frames": 0,
+            "input_overflows": 0,
+            "output_underflows": 0,
+            "subscriber_errors": 0
+        }
+
+    @property
+    def is_running(self):
+        return self._pyaudio is not None
+
+    def list_devices(self):
+        """列出所有音频设备: [(序号, 名称, 最大输入声道, 最大输出声道, 默认采样率)]"""
+        p = self._pyaudio or pyaudio.PyAudio()
+        try:
+            devices = []
+            for i in range(p.get_device_count()):
+                info = p.get_device_info_by_index(i)
+                devices.append((i, info['name'], info['maxInputChannels'], info['maxOutputChannels'],
+                                int(info['defaultSampleRate'])))
+            return devices
+        finally:
+            if p is not self._pyaudio:
+                p.terminate()
+
+    def _resolve_device(self, device, is_input):
+        """把序号 / 名称关键字解析为设备序号，None 表示系统默认设备"""
+        if device is None or device == "":
+            return None
+        if isinstance(device, int) or str(device).isdigit():
+            return int(device)
+        key = 'maxInputChannels' if is_input else 'maxOutputChannels'
+        for i in range(self._pyaudio.get_device_count()):
+            info = self._pyaudio.get_device_info_by_index(i)
+            if info[key] > 0 and str(device).lower() in info['name'].lower():
+                return i
+        print(f"未找到名称包含 '{device}' 的音频设备，使用系统默认设备")
+        return None
+
+    def _negotiate_rate(self, device_index, rate, is_input):
+        """请求的采样率不受支持时退回设备默认采样率"""
+        kwargs = {"input_device": device_index, "input_channels": self.channels, "input_format": pyaudio.paInt16} \
+            if is_input else \
+            {"output_device": device_index, "output_channels": self.channels, "output_format": pyaudio.paInt16}
+        try:
+            if self._pyaudio.is_format_supported(rate, **kwargs):
+                return rate
+        except ValueError:
+            pass
+        if device_index is None:
+            info = self._pyaudio.get_default_input_device_info() if is_input \
+                else self._pyaudio.get_default_output_device_info()
+        else:
+            info = self._pyaudio.get_device_info_by_index(device_index)
+        device_rate = int(info['defaultSampleRate'])
+        print(f"音频设备不支持 {rate}Hz，改用 {device_rate}Hz 并重采样")
+        return device_rate
+
+    def start(self):
+        """打开常驻的输入、输出流；重复调用无副作用"""
+        with self._lock:
+            if self._pyaudio is not None:
+                return
+            self._pyaudio = pyaudio.PyAudio()
+            try:
+                if self.enable_input:
+                    input_index = self._resolve_device(self.input_device, True)
+                    self.device_input_rate = self._negotiate_rate(input_index, self.input_rate, True)
+                    self._input_stream = self._pyaudio.open(
+                        format=pyaudio.paInt16,
+                        channels=self.channels,
+                        rate=self.device_input_rate,
+                        input=True,
+                        frames_per_buffer=round(self.chunk * self.device_input_rate / self.input_rate),
+                        input_device_index=input_index,
+                        stream_callback=self._input_callback
+                    )
+                    self._input_stream.start_stream()
+                if self.enable_output:
+                    output_index = self._resolve_device(self.output_device, False)
+                    self.device_output_rate = self._negotiate_rate(output_index, self.output_rate, False)
+                    self._output_stream = self._pyaudio.open(
+                        format=pyaudio.paInt16,
+                        channels=self.channels,
+                        rate=self.device_output_rate,
+                        output=True,
+                        frames_per_buffer=round(self.output_frames_per_buffer * self.device_output_rate / self.output_rate),
+                        output_device_index=output_index,
+                        stream_callback=self._output_callback
+                    )
+                    self._output_stream.start_stream()
+            except Exception:
+                self._close_locked()
+                raise
+
+    def set_directions(self, enable_input=None, enable_output=None):
+        """调整要打开的方向（None 表示不变）；运行中方向有变化时重新打开音频流，订阅者与数据源保留"""
+        with self._lock:
+            enable_input = self.enable_input if enable_input is None else enable_input
+            enable_output = self.enable_output if enable_output is None else enable_output
+            if (enable_input, enable_output) == (self.enable_input, self.enable_output):
+                return
+            print(f"音频引擎切换方向: 输入={'开' if enable_input else '关'}, 输出={'开' if enable_output else '关'}")
+            self.enable_input = enable_input
+            self.enable_output = enable_output
+            running = self._pyaudio is not None
+            if running:
+                self._close_locked()
+        if running:
+            self.start()
+
+    def subscribe(self, callback):
+        """订阅采集数据: callback(pcm_bytes) 在音频回调线程中调用"""
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [cb for cb in self._subscribers if cb != callback]
+
+    def subscribe_playback(self, callback):
+        """
+        订阅实际播放的音频: callback(pcm_bytes) 在输出回调线程中调用
+
+        音频已重采样到采集采样率 input_rate，与麦克风数据同样实时推进，无回复时为静音。
+        """
+        with self._lock:
+            self._playback_subscribers = self._playback_subscribers + [callback]
+
+    def unsubscribe_playback(self, callback):
+        with self._lock:
+            self._playback_subscribers = [cb for cb in self._playback_subscribers if cb != callback]
+
+    def set_output_source(self, source, rate=None):
+        """设置输出数据源: source(frame_count) 返回不超过 frame_count 帧的 PCM 字节，不足部分补静音"""
+        with self._lock:
+            self._output_source = source
+            self._output_source_rate = rate or self.output_rate
+
+    def _input_callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            # 回调来不及取走数据，驱动丢弃了部分采样
+            self.stats["input_overflows"] += 1
+        if self.device_input_rate != self.input_rate:
+            in_data = resample_pcm(in_data, self.device_input_rate, self.input_rate)
+        self.stats["input_frames"] += 1
+        for callback in self._subscribers:
+            try:
+                callback(in_data)
+            except Exception as e:
+                if self.stats["subscriber_errors"] == 0:
+                    print(f"音频订阅者处理出错: {e}")
+                self.stats["subscriber_errors"] += 1
+        return None, pyaudio.paContinue
+
+    def _output_callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paOutputUnderflow:
+            self.stats["output_underflows"] += 1
+        needed = frame_count * self.sample_width * self.channels
+        source, source_rate = self._output_source, self._output_source_rate
+        if source is None:
+            data = b"\x00" * needed
+        else:
+            if source_rate == self.device_output_rate:
+                data = source(frame_count)
+            else:
+                # 按数据源的采样率取数据，再重采样到设备采样率
+                data = source(round(frame_count * source_rate / self.device_output_rate))
+                data = resample_pcm(data, source_rate, self.device_output_rate)
+            data = data[:needed]
+            data = data + b"\x00" * (needed - len(data))
+        self._notify_playback(data)
+        return data, pyaudio.paContinue
+
+    def _notify_playback(self, data):
+        subscribers = self._playback_subscribers
+        if not subscribers:
+            return
+        if self.device_output_rate != self.input_rate:
+            data = resample_pcm(data, self.device_output_rate, self.input_rate)
+        for callback in subscribers:
+            try:
+                callback(data)
+            except Exception as e:
+                if self.stats["subscriber_errors"] == 0:
+                    print(f"播放订阅者处理出错: {e}")
+                self.stats["subscriber_errors"] += 1
+
+    def _close_locked(self):
+        for stream in (self._input_stream, self._output_stream):
+            if stream is not None:
+                try:
+                    stream.stop_stream()
+                    stream.close()
+                except Exception as e:
+                    print(f"关闭音频流出错: {e}")
+        self._input_stream = None
+        self._output_stream = None
+        if self._pyaudio is not None:
+            self._pyaudio.terminate()
+            self._pyaudio = None
+
+    def close(self):
+        """关闭输入、输出流并释放 PyAudio"""
+        with self._lock:
+            self._close_locked()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_audio_engine(enable_input=None, enable_output=None):
+    """
+    获取（必要时创建并启动）全局音频引擎
+
+    enable_input / enable_output 为 None 表示不关心该方向（首次创建时默认打开）；明确指定且与
+    当前不同时重新打开音频流，例如 process 模式下父进程关闭麦克风，交给采集进程独占。
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AudioEngine(input_rate=Config.AUDIO_INPUT_RATE,
+                                  output_rate=Config.AUDIO_OUTPUT_RATE,
+                                  input_device=Config.AUDIO_INPUT_DEVICE,
+                                  output_device=Config.AUDIO_OUTPUT_DEVICE,
+                                  enable_input=enable_input is not False,
+                                  enable_output=enable_output is not False)
+        engine = _engine
+    engine.set_directions(enable_input, enable_output)
+    engine.start()
+    return engine
+
+
+def close_audio_engine():
+    """程序退出时关闭全局音频引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
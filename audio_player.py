@@ -0,0 +1,277 @@
+# TTS 音频直接播放：抖动缓冲的环形缓冲区 + 常开的回调模式输出流
+import os
+import queue
+import threading
+import wave
+import numpy as np
+from stage_queue import DROP_OLDEST, REJECT, StageStats
+
+
+def as_pcm_buffer(audio):
+    """把 bytes / bytearray / memoryview / NumPy 数组统一成 16-bit PCM 字节视图，能不复制就不复制"""
+    if isinstance(audio, np.ndarray):
+        if audio.dtype.kind == 'f':
+            # 浮点音频按 [-1, 1] 量化为 int16
+            audio = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+        audio = np.ascontiguousarray(audio, dtype=np.int16)
+    return memoryview(audio).cast('B')
+
+
+def resample_pcm(pcm, src_rate, dst_rate):
+    """对 16-bit 单声道 PCM 做线性插值重采样"""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples.tobytes()
+    dst_len = int(len(samples) * dst_rate / src_rate)
+    positions = np.linspace(0, len(samples) - 1, dst_len)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16).tobytes()
+
+
+class PCMRingBuffer:
+    """
+    线程安全的 PCM 字节环形缓冲区
+
+    写入方（TTS 消息循环）和读取方（音频回调线程）共享同一块预分配内存，
+    容量不足时按倍数扩容，不会丢弃尚未播放的音频（上限由调用方控制）。
+    """
+
+    def __init__(self, capacity):
+        self._buffer = bytearray(capacity)
+        self._read_pos = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, min_capacity):
+        capacity = len(self._buffer)
+        while capacity < min_capacity:
+            capacity *= 2
+        data = self._peek(self._size)
+        self._buffer = bytearray(capacity)
+        self._buffer[:len(data)] = data
+        self._read_pos = 0
+
+    def _peek(self, n):
+        capacity = len(self._buffer)
+        end = self._read_pos + n
+        if end <= capacity:
+            return bytes(self._buffer[self._read_pos:end])
+        return bytes(self._buffer[self._read_pos:]) + bytes(self._buffer[:end - capacity])
+
+    def write(self, data):
+        data = as_pcm_buffer(data)
+        with self._lock:
+            if self._size + len(data) > len(self._buffer):
+                self._grow(self._size + len(data))
+            capacity = len(self._buffer)
+            write_pos = (self._read_pos + self._size) % capacity
+            first = min(len(data), capacity - write_pos)
+            self._buffer[write_pos:write_pos + first] = data[:first]
+            if first < len(data):
+                self._buffer[:len(data) - first] = data[first:]
+            self._size += len(data)
+
+    def read(self, n):
+        """读取最多 n 字节"""
+        with self._lock:
+            n = min(n, self._size)
+            data = self._peek(n)
+            self._read_pos = (self._read_pos + n) % len(self._buffer)
+            self._size -= n
+            return data
+
+    def clear(self):
+        with self._lock:
+            self._read_pos = 0
+            self._size = 0
+
+
+class AsyncWavRecorder:
+    """在后台线程中把回复音频写入 WAV 文件，不占用播放和合成的关键路径"""
+
+    def __init__(self, filename, rate=24000, channels=1, sample_width=2):
+        self.filename = filename
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, pcm_bytes):
+        self._queue.put(pcm_bytes)
+
+    def close(self):
+        """结束录制，文件在后台线程中完成写入"""
+        self._queue.put(None)
+
+    def _write_loop(self):
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with wave.open(self.filename, 'wb') as wav_file:
+                wav_file.setnchannels(self.channels)
+                wav_file.setsampwidth(self.sample_width)
+                wav_file.setframerate(self.rate)
+                while True:
+                    data = self._queue.get()
+                    if data is None:
+                        break
+                    wav_file.writeframes(data)
+            print(f"回复音频已保存: {self.filename}")
+        except Exception as e:
+            print(f"保存回复音频失败: {e}")
+
+
+class PlaybackSink:
+    """
+    TTS 音频播放输出
+
+    作为 AudioEngine 常开输出流（回调模式）的数据源，每个 response.audio.delta 直接写入
+    环形缓冲区。缓冲区先积累 prebuffer_ms 的音频再开始出声（抖动缓冲），播放中途
+    数据跟不上时补静音并重新积累，避免断断续续的卡顿。
+
+    使用方式:
+        sink.begin_reply()       # 每轮回复开始
+        sink.write(pcm_bytes)    # 作为 TTS 音频回调
+        sink.end_reply()         # 回复文本全部合成完毕
+        sink.drain(sink.drain_timeout())  # 等待扬声器播放完毕
+
+    TTS -> 播放 阶段的缓冲上限为 max_buffer_seconds，超出时按 policy 处理:
+        drop_oldest: 丢弃最早的未播放音频，reject: 丢弃新到的音频。
+    stats 为该阶段的 StageStats，depth 以毫秒计。
+    """
+
+    def __init__(self, engine, rate=24000, channels=1, prebuffer_ms=80, buffer_seconds=30,
+                 max_buffer_seconds=120, policy=DROP_OLDEST):
+        self.engine = engine
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = 2  # 16-bit
+        self.prebuffer_bytes = int(rate * prebuffer_ms / 1000) * self.sample_width * channels
+
+        self._ring = PCMRingBuffer(rate * buffer_seconds * self.sample_width * channels)
+        if policy not in (DROP_OLDEST, REJECT):
+            raise ValueError(f"播放缓冲只支持 {DROP_OLDEST} / {REJECT} 策略")
+        self.policy = policy
+        self.bytes_per_ms = rate * self.sample_width * channels / 1000
+        self.max_buffer_bytes = int(max_buffer_seconds * 1000 * self.bytes_per_ms)
+        self.stage_stats = StageStats("playback")
+
+        # 当前回复状态
+        self._buffering = True
+        self._reply_ended = True
+        self._accepting = True
+        self._drained = threading.Event()
+        self._drained.set()
+        self._recorder = None
+        self._on_first_audio = None
+        self._first_audio_pending = False
+
+        # 统计信息
+        self.stats = {
+            "underruns": 0,
+            "played_bytes": 0
+        }
+
+    def start(self):
+        """接入音频引擎的常开输出流"""
+        self.engine.set_output_source(self._fill, self.rate)
+
+    def begin_reply(self, record_file=None, on_first_audio=None):
+        """开始新一轮回复；record_file 不为空时在后台把本轮音频另存为 WAV"""
+        self._buffering = True
+        self._reply_ended = False
+        self._accepting = True
+        self._drained.clear()
+        self._on_first_audio = on_first_audio
+        self._first_audio_pending = True
+        self._recorder = AsyncWavRecorder(record_file, rate=self.rate, channels=self.channels) if record_file else None
+
+    def write(self, pcm):
+        """TTS 音频回调：数据直接进入环形缓冲区，支持 bytes / memoryview / NumPy 数组"""
+        if not self._accepting:
+            # 本轮回复已被打断，迟到的音频直接丢弃
+            return
+        pcm = as_pcm_buffer(pcm)
+        excess = len(self._ring) + len(pcm) - self.max_buffer_bytes
+        if excess > 0:
+            if self.policy == REJECT:
+                self.stage_stats.record("rejected")
+                return
+            # 按整帧丢弃最早的音频
+            frame_bytes = self.sample_width * self.channels
+            self._ring.read(-(-excess // frame_bytes) * frame_bytes)
+            self.stage_stats.record("dropped")
+        self._ring.write(pcm)
+        self.stage_stats.record("enqueued", int(len(self._ring) / self.bytes_per_ms))
+        if self._recorder is not None:
+            self._recorder.write(bytes(pcm))
+
+    def end_reply(self):
+        """标记本轮音频已全部到达，剩余不足预缓冲量的数据也会立即播放"""
+        self._reply_ended = True
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        if len(self._ring) == 0:
+            self._drained.set()
+
+    def drain_timeout(self, margin=2.0):
+        """等待播放完毕的超时：缓冲区剩余音频时长（含未出声的预缓冲）加 margin 秒"""
+        return self.buffer_stats()["buffered_ms"] / 1000 + margin
+
+    def drain(self, timeout=None):
+        """等待缓冲区中的音频全部播放完毕；超时（输出设备回调停滞）时丢弃剩余音频并返回 False"""
+        if self._drained.wait(timeout):
+            return True
+        print(f"播放超时（{timeout:.1f} 秒内未播放完毕），丢弃剩余音频")
+        self.stop()
+        return False
+
+    def stop(self):
+        """立即停止当前回复的播放并丢弃未播放的音频，之后到达的音频也一并丢弃，直到下一次 begin_reply"""
+        self._accepting = False
+        self._ring.clear()
+        self.end_reply()
+
+    def buffer_stats(self):
+        """播放阶段的队列统计，以及缓冲区当前积压的音频时长与欠载次数"""
+        return {
+            **self.stage_stats.snapshot(),
+            "buffered_ms": len(self._ring) / self.bytes_per_ms,
+            "underruns": self.stats["underruns"]
+        }
+
+    def close(self):
+        """从音频引擎的输出流上断开"""
+        self.engine.set_output_source(None)
+
+    def _fill(self, frame_count):
+        """音频回调线程：从环形缓冲区取数据，不足部分由音频引擎补静音"""
+        needed = frame_count * self.sample_width * self.channels
+        buffered = len(self._ring)
+
+        if self._buffering and (buffered >= self.prebuffer_bytes or (self._reply_ended and buffered > 0)):
+            self._buffering = False
+
+        data = b""
+        if not self._buffering:
+            data = self._ring.read(needed)
+            if data and self._first_audio_pending:
+                self._first_audio_pending = False
+                if self._on_first_audio:
+                    self._on_first_audio()
+            self.stats["played_bytes"] += len(data)
+            if len(data) < needed:
+                if self._reply_ended:
+                    self._drained.set()
+                else:
+                    # 合成速度跟不上播放：补静音并重新积累抖动缓冲
+                    self.stats["underruns"] += 1
+                    self._buffering = True
+
+        return data
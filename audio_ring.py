@@ -0,0 +1,113 @@
+# 预分配的 int16 音频环形缓冲区：按绝对采样位置读写，提取语音段时尽量零拷贝
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    采集音频的环形缓冲区
+
+    所有采样都写入一块预分配的 int16 数组，位置用"自启动以来的绝对采样序号"表示。
+    语音段只需记录 (start, end) 两个序号，真正需要音频时再通过 view() 取出，
+    未跨越缓冲区末尾时返回的是原数组的视图，不产生任何拷贝。
+    """
+
+    def __init__(self, rate=16000, capacity_seconds=60):
+        self.rate = rate
+        self.capacity = int(rate * capacity_seconds)
+        self._data = np.zeros(self.capacity, dtype=np.int16)
+        self.total_written = 0  # 已写入的总采样数，即下一个采样的绝对序号
+
+    @property
+    def oldest(self):
+        """缓冲区中仍然保留的最早采样序号"""
+        return max(0, self.total_written - self.capacity)
+
+    def write(self, frame):
+        """写入一帧 PCM（bytes 或 int16 数组），返回这一帧的 (start, end) 绝对序号"""
+        samples = np.frombuffer(frame, dtype=np.int16)
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            self.total_written += n - self.capacity
+            n = self.capacity
+        start = self.total_written
+        pos = start % self.capacity
+        first = min(n, self.capacity - pos)
+        self._data[pos:pos + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:]
+        self.total_written += n
+        return start, self.total_written
+
+    def is_available(self, start):
+        """start 之后的音频是否还没有被覆盖"""
+        return start >= self.oldest
+
+    def view(self, start, end):
+        """取出 [start, end) 区间的音频；不跨越缓冲区末尾时为零拷贝视图"""
+        if start < self.oldest or end > self.total_written or start > end:
+            raise ValueError(f"音频区间 [{start}, {end}) 不在缓冲区范围内")
+        pos = start % self.capacity
+        n = end - start
+        if pos + n <= self.capacity:
+            return self._data[pos:pos + n]
+        # 跨越缓冲区末尾，只能拼接成新数组
+        return np.concatenate((self._data[pos:], self._data[:n - (self.capacity - pos)]))
+
+
+class SharedAudioRing(AudioRingBuffer):
+    """
+    放在 multiprocessing.shared_memory 中的环形缓冲区：采集进程写入，主进程读取
+
+    name 为空时创建新的共享内存（主进程），否则按名称附加到已有的共享内存（采集进程）。
+    写入进度 total_written 保存在共享内存头部，采样先写入、进度后更新，读取方看到的进度之前的数据总是完整的。
+    """
+
+    HEADER_BYTES = 8
+
+    def __init__(self, rate=16000, capacity_seconds=60, name=None):
+        self.rate = rate
+        self.capacity = int(rate * capacity_seconds)
+        self._owner = name is None
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER_BYTES + self.capacity * 2)
+        else:
+            self.shm = self._attach(name)
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self._data = np.ndarray((self.capacity,), dtype=np.int16, buffer=self.shm.buf, offset=self.HEADER_BYTES)
+        if self._owner:
+            self._header[0] = 0
+
+    @staticmethod
+    def _attach(name):
+        """附加到已有的共享内存，回收只由创建方负责"""
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python 3.13 之前没有 track 参数；spawn 启动的子进程与主进程共用 resource_tracker，
+            # 重复登记不会导致提前删除
+            return shared_memory.SharedMemory(name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def total_written(self):
+        return int(self._header[0])
+
+    @total_written.setter
+    def total_written(self, value):
+        self._header[0] = value
+
+    def close(self):
+        """释放共享内存；创建方同时删除共享内存。之前取出的 view() 不能再使用"""
+        self._header = None
+        self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            print("共享音频缓冲区仍被引用，稍后由系统回收")
+        if self._owner:
+            self.shm.unlink()
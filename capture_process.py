@@ -0,0 +1,137 @@
+# 独立的音频采集 + 语音检测进程：实时音频路径不与主进程的 JSON 解析、NumPy、向量库等争抢 GIL
+import queue
+import time
+import numpy as np
+from audio_engine import get_audio_engine, close_audio_engine
+from audio_ring import SharedAudioRing
+from echo_suppressor import EchoSuppressor
+from idle_monitor import IdleMonitor
+from utterance_detector import UtteranceDetector
+
+
+def _receive(text_conn, partial_text, reply_active):
+    """取主进程发来的最新状态：识别中间结果、是否正在处理 / 播放回复"""
+    while text_conn.poll():
+        message = text_conn.recv()
+        if message["type"] == "partial":
+            partial_text = message["text"]
+        elif message["type"] == "reply":
+            reply_active = message["active"]
+    return partial_text, reply_active
+
+
+def _drain(frames_queue):
+    frames = []
+    while True:
+        try:
+            frames.append(frames_queue.get_nowait())
+        except queue.Empty:
+            return frames
+
+
+def run_capture_process(ring_name, rate, chunk, capacity_seconds, detector_kwargs,
+                        event_conn, text_conn, stop_event, reference_name=None, reference_capacity_seconds=2,
+                        echo_max_delay_ms=300, idle_after_seconds=10.0, idle_decimation=8, stats_interval=1.0):
+    """
+    采集进程入口
+
+    进程内有自己的常驻音频引擎，麦克风数据写入共享内存环形缓冲区，检测到的语音段起止事件
+    通过 event_conn 发给主进程；主进程经 text_conn 发回流式识别的中间结果 {"type": "partial", "text": ...}
+    （供端点检测使用）和回复状态 {"type": "reply", "active": ...}。
+    reference_name 为主进程播放音频的共享内存参考缓冲区，给出时用回声抑制后的信号做检测，
+    ring 中保留原始音频供识别。
+    每隔 stats_interval 秒发送一次噪声基底状态、输入溢出次数、回声抑制与待机统计 {"type": "stats", ...}。
+    持续安静（且没有在处理 / 播放回复）idle_after_seconds 秒后进入低功耗待机，进入 / 退出时发送
+    {"type": "sleep"} / {"type": "wake"}；待机中回复开始时立即恢复完整检测，播报的回声不会绕过回声抑制。
+    """
+    ring = SharedAudioRing(rate=rate, capacity_seconds=capacity_seconds, name=ring_name)
+    detector = UtteranceDetector(rate=rate, chunk=chunk, **detector_kwargs)
+    reference = None
+    suppressor = None
+    if reference_name is not None:
+        reference = SharedAudioRing(rate=rate, capacity_seconds=reference_capacity_seconds, name=reference_name)
+        suppressor = EchoSuppressor(reference, rate=rate, frame_size=chunk, max_delay_ms=echo_max_delay_ms)
+    frames_queue = queue.Queue()
+    idle = IdleMonitor(ring, frames_queue.put, rate=rate, chunk=chunk,
+                       idle_after_seconds=idle_after_seconds, decimation=idle_decimation)
+    engine = None
+    partial_text = ""
+    reply_active = False
+    last_stats = time.time()
+
+    try:
+        engine = get_audio_engine(enable_output=False)
+        engine.subscribe(idle.feed)
+        print("采集进程启动 - 开始持续监听...")
+
+        while not stop_event.is_set():
+            try:
+                frames = [frames_queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    frames.append(frames_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            block = np.concatenate([np.frombuffer(data, dtype=np.int16) for data in frames])
+            block_start, _ = ring.write(block)
+            scored = None
+            if suppressor is not None:
+                scored = suppressor.process(block, detector.noise_tracker.state()["onset_threshold"])
+
+            # 取最新的识别中间结果与回复状态
+            partial_text, reply_active = _receive(text_conn, partial_text, reply_active)
+
+            events = detector.process_block(ring, block_start, frames, partial_text, samples=scored)
+            for event in events:
+                event_conn.send(event)
+
+            if time.time() - last_stats >= stats_interval:
+                last_stats = time.time()
+                event_conn.send({"type": "stats", "noise_floor": detector.noise_tracker.state(),
+                                 "input_overflows": engine.stats["input_overflows"],
+                                 "echo": dict(suppressor.stats) if suppressor else {},
+                                 "idle": dict(idle.stats)})
+
+            # 持续安静时进入低功耗待机：音频回调只做抽样能量检查，本循环每秒醒一次检查退出信号
+            if idle.observe(len(block), detector.is_recording or bool(events) or reply_active):
+                idle.enter(detector.noise_tracker.state()["offset_threshold"],
+                           lambda: _drain(frames_queue))
+                event_conn.send({"type": "sleep"})
+                woken = None
+                while not stop_event.is_set():
+                    woken = idle.wait(timeout=1.0)
+                    if woken is not None:
+                        break
+                    partial_text, reply_active = _receive(text_conn, partial_text, reply_active)
+                    if reply_active:
+                        # 开始播报回复：退出待机（期间若恰好被声音唤醒，仍补做唤醒前的检测）
+                        idle.interrupt()
+                        woken = idle.wait(timeout=0)
+                        break
+                if stop_event.is_set():
+                    break
+                event_conn.send({"type": "wake"})
+                if woken is not None:
+                    # 唤醒前的音频同样先做回声抑制再打分，参考信号按它落后于最新采集的长度对齐
+                    block_start, frames = woken
+                    scored = None
+                    if suppressor is not None:
+                        block = ring.view(block_start, block_start + len(frames) * chunk)
+                        scored = suppressor.process(block, detector.noise_tracker.state()["onset_threshold"],
+                                                    lag_samples=ring.total_written - block_start - len(block))
+                    for event in detector.process_block(ring, block_start, frames, partial_text, samples=scored):
+                        event_conn.send(event)
+
+    except (EOFError, BrokenPipeError, KeyboardInterrupt):
+        # 主进程已关闭管道或正在退出
+        pass
+    except Exception as e:
+        print(f"采集进程错误: {e}")
+    finally:
+        close_audio_engine()
+        ring.close()
+        if reference is not None:
+            reference.close()
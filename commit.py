@@ -1,43 +1,43 @@
-import os
 import asyncio
 import logging
-import wave
-from tts_realtime_client import TTSRealtimeClient, SessionMode
+import async_runtime
+from tts_realtime_client import TTSRealtimeClient, TTSSessionPool, SessionMode
 import re
-import pyaudio
 from config import Config
 
 
-# 收集音频数据
-_audio_chunks = []
-_AUDIO_SAMPLE_RATE = 24000
-_audio_pyaudio = pyaudio.PyAudio()
+# TTS 长连接会话池挂在全局异步运行时的事件循环上，连接可以跨轮次复用
+_tts_pool = None
 
 
-def _audio_callback(audio_bytes: bytes):
-    """TTSRealtimeClient 音频回调: 只收集音频数据，不播放"""
-    _audio_chunks.append(audio_bytes)
-    logging.info(f"Received audio chunk: {len(audio_bytes)} bytes")
+def _get_tts_pool() -> TTSSessionPool:
+    """获取全局 TTS 会话池"""
+    global _tts_pool
+    if _tts_pool is None:
+        _tts_pool = TTSSessionPool(
+            base_url=Config.TTS_URL,
+            api_key=Config.API_KEY,
+            voice="Cherry",
+            language_type="Chinese",  # 建议与文本语种一致，以获得正确的发音和自然的语调。
+            mode=SessionMode.COMMIT,
+            response_timeout=Config.TTS_RESPONSE_TIMEOUT,
+            pool_size=Config.TTS_POOL_SIZE,
+            keepalive_interval=Config.TTS_KEEPALIVE_INTERVAL
+        )
+    return _tts_pool
 
 
-def _save_audio_to_file(filename: str = "output.wav", sample_rate: int = 24000) -> bool:
-    """将收集到的音频数据保存为 WAV 文件"""
-    if not _audio_chunks:
-        logging.warning("No audio data to save")
-        return False
+def warm_up_tts():
+    """提前建立并配置好 TTS 会话，首轮对话无需再等待握手"""
+    async_runtime.run_sync(_get_tts_pool().start())
 
-    try:
-        audio_data = b"".join(_audio_chunks)
-        with wave.open(filename, 'wb') as wav_file:
-            wav_file.setnchannels(1)  # 单声道
-            wav_file.setsampwidth(2)  # 16-bit
-            wav_file.setframerate(sample_rate)
-            wav_file.writeframes(audio_data)
-        logging.info(f"Audio saved to: {filename}")
-        return True
-    except Exception as exc:
-        logging.error(f"Failed to save audio: {exc}")
-        return False
+
+async def close_tts():
+    """关闭 TTS 会话池中的所有连接"""
+    global _tts_pool
+    if _tts_pool is not None:
+        await _tts_pool.close()
+        _tts_pool = None
 
 
 async def _user_input_loop(client: TTSRealtimeClient, text: str):
@@ -52,46 +52,54 @@ async def _user_input_loop(client: TTSRealtimeClient, text: str):
             break
         except KeyboardInterrupt:  # 用户按下Ctrl+C
             break
-    # 空输入视为一次对话的结束: 提交缓冲区 -> 结束会话 -> 跳出循环
-    logging.info("空输入，发送 commit 事件并结束本次会话")
+    # 文本发送完毕: 提交缓冲区触发合成。会话保持打开，供下一轮复用
+    logging.info("文本发送完毕，发送 commit 事件")
     await client.commit_text_buffer()
-    # 适当等待服务器处理 commit，防止过早结束会话导致丢失音频
-    await asyncio.sleep(0.3)
-    await client.finish_session()
-    # 结束会话
-    logging.info("结束会话...")
-
-
-async def _run_demo(text, audio_file):
-    """运行完整 Demo"""
-    client = TTSRealtimeClient(
-        base_url=Config.TTS_URL,
-        api_key=Config.API_KEY,
-        voice="Cherry",
-        language_type="Chinese",  # 建议与文本语种一致，以获得正确的发音和自然的语调。
-        mode=SessionMode.COMMIT,  # 修改为COMMIT模式
-        audio_callback=_audio_callback
-    )
-
-    # 建立连接
-    await client.connect()
-
-    # 并行执行消息处理与用户输入
-    consumer_task = asyncio.create_task(client.handle_messages())
-    producer_task = asyncio.create_task(_user_input_loop(client, text))
-
-    await producer_task  # 等待用户输入完成
-
-    # 额外等待，确保所有音频数据收取完毕
-    await asyncio.sleep(5)
-
-    # 关闭连接并取消消费者任务
-    await client.close()
-    consumer_task.cancel()
-
-    # 保存音频数据
-    os.makedirs("outputs", exist_ok=True)
-    save_file = os.path.join("outputs", audio_file)
-    _save_audio_to_file(save_file)
-    _audio_chunks.clear()       # 清空缓存区的数据
-    return save_file
\ No newline at end of file
+
+
+async def _wait_synthesis_done(client: TTSRealtimeClient) -> bool:
+    """等待本轮提交的文本全部合成完毕，返回是否完成；超时的会话状态不确定，直接断开，下次取用时重连"""
+    if not await client.wait_for_responses():
+        await client.close()
+        return False
+    return True
+
+
+async def _abort_synthesis(client: TTSRealtimeClient):
+    """被打断时丢弃尚未合成的文本；不等待剩余音频，连接由会话池在后台重建"""
+    await client.cancel_response()
+
+
+async def _run_demo(text, audio_callback) -> bool:
+    """运行完整 Demo：合成整段文本，音频数据块直接交给 audio_callback（通常是播放输出）；等待合成完成超时返回 False"""
+    # 从会话池取用已建立好的连接，消息处理循环已在后台运行
+    async with _get_tts_pool().session(audio_callback) as client:
+        await _user_input_loop(client, text)
+
+        # 等待服务器返回 response.done，确保所有音频数据收取完毕
+        return await _wait_synthesis_done(client)
+
+async def _sentence_input_loop(client: TTSRealtimeClient, sentence_queue: asyncio.Queue):
+    """从队列中逐句读取文本，每收到一句立即提交合成，收到 None 表示回复结束"""
+    while True:
+        sentence = await sentence_queue.get()
+        if sentence is None:
+            break
+        logging.info(f"发送文本: {sentence}")
+        await client.append_text(sentence)
+        # 每句单独提交，服务器立即开始合成这一句，无需等待整段回复
+        await client.commit_text_buffer()
+
+
+async def _run_stream_demo(sentence_queue: asyncio.Queue, audio_callback):
+    """流式合成：边接收句子边合成，音频数据块直接交给 audio_callback"""
+    async with _get_tts_pool().session(audio_callback) as client:
+        try:
+            await _sentence_input_loop(client, sentence_queue)
+
+            # 等待最后一句合成完毕即可返回，无需固定等待
+            await _wait_synthesis_done(client)
+        except asyncio.CancelledError:
+            # 用户插话打断：立即停止本轮合成
+            await _abort_synthesis(client)
+            raise
@@ -8,9 +8,94 @@ class Config:
     API_KEY = os.getenv("DASHSCOPE_API_KEY")
     # QwenTTS 服务配置
     TTS_URL = "wss://dashscope.aliyuncs.com/api-ws/v1/realtime?model=qwen3-tts-flash-realtime"
+    # TTS 长连接会话池：预热会话数量、空闲心跳间隔（秒）
+    TTS_POOL_SIZE = 1
+    TTS_KEEPALIVE_INTERVAL = 20
+    # 等待服务器 response.done / session.finished 的超时时间（秒）
+    TTS_RESPONSE_TIMEOUT = 15
+    # 播放抖动缓冲：积累多少毫秒音频后开始出声
+    PLAYBACK_PREBUFFER_MS = 80
+    # 回复音频另存目录，为空则不落盘（设置后在后台线程异步写入 WAV）
+    TTS_RECORD_DIR = os.getenv("TTS_RECORD_DIR")
+    # 音频设备：序号或名称关键字，为空使用系统默认设备；设备不支持时自动协商采样率并重采样
+    AUDIO_INPUT_DEVICE = os.getenv("AUDIO_INPUT_DEVICE")
+    AUDIO_OUTPUT_DEVICE = os.getenv("AUDIO_OUTPUT_DEVICE")
+    AUDIO_INPUT_RATE = 16000
+    AUDIO_OUTPUT_RATE = 24000
+    # 音频采集与语音检测的运行方式: thread(与主流程同一进程) / process(独立进程，经共享内存传递音频)
+    CAPTURE_MODE = os.getenv("CAPTURE_MODE", "thread")
+    # 回声抑制：以正在播放的回复音频为参考，在 VAD 之前削弱麦克风中机器人自己的声音（设为 off 关闭）
+    ECHO_SUPPRESSION = os.getenv("ECHO_SUPPRESSION", "on") != "off"
+    # 扬声器到麦克风的最大延迟（毫秒），包括输出/输入缓冲与声学路径
+    ECHO_MAX_DELAY_MS = 300
+    # 识别前的语音段过滤：本地判断是人声的置信度低于该值时不送去识别（0 关闭过滤）
+    SPEECH_GATE_THRESHOLD = float(os.getenv("SPEECH_GATE_THRESHOLD", "0.5"))
+    # 低功耗待机：持续安静多少秒后停掉完整检测，只做抽样能量检查（0 关闭）；抽样间隔（采样数）
+    IDLE_AFTER_SECONDS = float(os.getenv("IDLE_AFTER_SECONDS", "10"))
+    IDLE_DECIMATION = 8
+    # 流水线各阶段队列的 (容量, 溢出策略)，策略可选 drop_oldest / coalesce / reject
+    CAPTURE_QUEUE = (64, "drop_oldest")    # 采集 -> 检测，单位为音频帧（30ms/帧）
+    UTTERANCE_QUEUE = (2, "drop_oldest")   # 检测 -> 识别/回复，单位为语音段
+    SENTENCE_QUEUE = (3, "coalesce")       # 大模型 -> TTS，单位为句子，合并时拼接为一句
+    PLAYBACK_QUEUE = (120, "drop_oldest")  # TTS -> 播放，单位为秒（未播放的音频时长），只支持 drop_oldest / reject
+    # 调试用：识别前的用户语音另存目录，为空则全程只在内存中处理
+    DEBUG_AUDIO_DIR = os.getenv("DEBUG_AUDIO_DIR")
 
     # qwen配置 阿里云百炼
     BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     CHAT_MODEL = "qwen-max"
+    # 语音识别模式: streaming(边录边识别) / file(录完整段再识别) / local(离线替身，不联网)
+    ASR_MODE = os.getenv("ASR_MODE", "streaming")
+    # local 模式下替身识别器返回的文本
+    LOCAL_ASR_TRANSCRIPT = os.getenv("LOCAL_ASR_TRANSCRIPT", "你好")
     # embedding_model
     EM_MODEL = "text-embedding-v1"
+    # embedding 缓存：内存 LRU 条数、磁盘缓存目录与条数（目录为空则只用内存层）
+    EMBEDDING_CACHE_MEMORY_ITEMS = 1024
+    EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./memory_db/embedding_cache")
+    EMBEDDING_CACHE_DISK_ITEMS = 50000
+    # 云端重排序：延迟预算（秒，超时则沿用向量检索顺序）与分数缓存条数
+    RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "1.5"))
+    RERANK_CACHE_SIZE = 256
+    # 记忆后台批量写入：每批最多条数、最长等待时间（秒），同一批连续失败多少次后拆批 / 移入死信日志
+    MEMORY_INGEST_BATCH = 32
+    MEMORY_INGEST_INTERVAL = 2.0
+    MEMORY_INGEST_MAX_ATTEMPTS = 3
+    # 近似重复记忆合并：余弦相似度阈值（0 关闭）与后台清理历史重复的间隔（秒）
+    MEMORY_DEDUP_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.95"))
+    MEMORY_COMPACTION_INTERVAL = 6 * 3600
+    # 记忆保留策略：每个分类最多保留的条数、易变分类的过期天数、分类重要性权重（超量时优先保留分数高的），
+    # 新近程度的半衰期（天）与执行间隔（秒）；超量或过期的记忆按月汇总成摘要记录，摘要正文最多 MEMORY_DIGEST_MAX_CHARS 字
+    MEMORY_CATEGORY_LIMITS = {
+        "personal_info": 500,
+        "family": 1000,
+        "health": 2000,
+        "preferences": 1000,
+        "daily_life": 2000,
+        "emotions": 1000
+    }
+    MEMORY_TTL_DAYS = {
+        "daily_life": 90,
+        "emotions": 30
+    }
+    MEMORY_IMPORTANCE = {
+        "personal_info": 3.0,
+        "health": 2.5,
+        "family": 2.0,
+        "preferences": 1.5,
+        "daily_life": 1.0,
+        "emotions": 1.0
+    }
+    MEMORY_RECENCY_HALF_LIFE_DAYS = 30
+    MEMORY_RETENTION_INTERVAL = float(os.getenv("MEMORY_RETENTION_INTERVAL", "3600"))
+    MEMORY_DIGEST_MAX_CHARS = 600
+    # 记忆触发词：{分类: [触发词]}，启动时编译一次；设置 MEMORY_TRIGGERS_FILE（同结构的 JSON 文件）可替换
+    MEMORY_TRIGGERS = {
+        "personal_info": ["我叫", "我今年", "我住在", "我的电话"],
+        "family": ["我儿子", "我女儿", "我孙子", "我老伴", "我家人"],
+        "health": ["血压", "血糖", "头疼", "不舒服", "吃药", "医院"],
+        "preferences": ["喜欢", "讨厌", "爱看", "爱吃", "爱听"],
+        "daily_life": ["今天去了", "昨天", "上周", "经常"],
+        "emotions": ["开心", "难过", "孤单", "担心", "想念"]
+    }
+    MEMORY_TRIGGERS_FILE = os.getenv("MEMORY_TRIGGERS_FILE")
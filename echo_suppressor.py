@@ -0,0 +1,111 @@
+# 回声抑制：以正在播放的 TTS 音频为参考信号，在 VAD 之前削弱麦克风中机器人自己的声音
+import numpy as np
+
+
+class EchoSuppressor:
+    """
+    频域回声抑制（向量化，按块处理）
+
+    参考信号是扬声器实际播放的 PCM：音频引擎的输出回调持续运行（无回复时为静音），重采样到
+    麦克风采样率后写入 reference 环形缓冲区，因此参考信号与麦克风信号都是实时推进的。处理一块
+    麦克风帧时，以"当前最新的参考位置"往前 max_delay_ms 为窗口，逐频带取窗口内参考幅度谱的
+    最大值作为回声包络（覆盖输出/输入缓冲和声学路径的未知延迟），乘以自适应的耦合系数得到回声
+    估计，再做谱减：
+
+        G(f) = clip(1 - over_subtraction * 回声估计(f) / |麦克风(f)|, gain_floor, 1)
+
+    用户在播报时插话，麦克风能量远高于回声估计，增益接近 1，插话仍能被检测到。
+    耦合系数（扬声器到麦克风的增益）只在有参考信号时更新：下降快、上升慢，插话不会把它带偏。
+    没有参考信号的帧原样通过。
+    输出按 frame_size 矩形分帧、不做重叠相加，帧边界不连续，只用于 VAD / 起始检测打分，不送识别。
+    """
+
+    def __init__(self, reference, rate=16000, frame_size=480, max_delay_ms=300,
+                 over_subtraction=2.5, gain_floor=0.05, reference_threshold=50.0,
+                 initial_coupling=1.0, coupling_up=0.02, coupling_down=0.05, max_coupling=4.0):
+        self.reference = reference
+        self.rate = rate
+        self.frame_size = frame_size
+        self.window_frames = max(1, int(np.ceil(max_delay_ms * rate / 1000 / frame_size))) + 1
+        self.over_subtraction = over_subtraction
+        self.gain_floor = gain_floor
+        self.reference_threshold = reference_threshold
+        self.coupling_up = coupling_up
+        self.coupling_down = coupling_down
+        self.max_coupling = max_coupling
+        self.coupling = np.full(frame_size // 2 + 1, initial_coupling, dtype=np.float32)
+
+        self._suppressing = False
+
+        # 统计信息
+        self.stats = {
+            "frames": 0,
+            "echo_frames": 0,          # 播放期间的帧
+            "suppressed_frames": 0,    # 原本超过语音起始门限、抑制后低于门限的帧
+            "suppressed_triggers": 0   # 被抑制掉的误触发次数（连续的 suppressed_frames 计一次）
+        }
+
+    def _reference_frames(self, n_frames, lag_samples=0):
+        """取覆盖 n_frames 个麦克风帧及其延迟窗口的参考信号（截止到最新位置之前 lag_samples），不足部分补零"""
+        count = (n_frames - 1 + self.window_frames) * self.frame_size
+        end = max(self.reference.total_written - lag_samples, 0)
+        start = max(end - count, self.reference.oldest)
+        samples = np.zeros(count, dtype=np.float32)
+        if end > start:
+            samples[count - (end - start):] = self.reference.view(start, end)
+        return samples.reshape(-1, self.frame_size)
+
+    def process(self, samples, onset_threshold=None, lag_samples=0):
+        """
+        处理一块麦克风音频（int16 数组或 PCM 字节），返回等长的 int16 数组；不足一帧的尾部原样保留
+
+        onset_threshold 为当前的语音起始能量门限，用于统计被抑制掉的误触发。
+        lag_samples 为这块音频的末尾比最新采集位置早多少个采样（例如待机唤醒后补做检测的音频），
+        参考信号相应往前对齐。
+        """
+        mic = np.frombuffer(samples, dtype=np.int16)
+        n_frames = len(mic) // self.frame_size
+        if n_frames == 0:
+            return mic
+        self.stats["frames"] += n_frames
+
+        # 参考信号的逐帧幅度谱，滑动取延迟窗口内的最大值作为回声包络
+        ref_frames = self._reference_frames(n_frames, lag_samples)
+        ref_energy = np.abs(ref_frames).mean(axis=1)
+        window_energy = np.lib.stride_tricks.sliding_window_view(ref_energy, self.window_frames).max(axis=1)
+        active = window_energy > self.reference_threshold
+        if not active.any():
+            self._suppressing = False
+            return mic
+
+        frames = mic[:n_frames * self.frame_size].reshape(n_frames, self.frame_size).astype(np.float32)
+        ref_mag = np.abs(np.fft.rfft(ref_frames, axis=1))
+        echo_envelope = np.lib.stride_tricks.sliding_window_view(ref_mag, self.window_frames, axis=0).max(axis=2)
+        spectrum = np.fft.rfft(frames, axis=1)
+        mic_mag = np.abs(spectrum)
+
+        # 自适应耦合系数：只用播放期间的帧更新，下降快、上升慢
+        ratio = np.minimum(mic_mag[active] / (echo_envelope[active] + 1e-6), self.max_coupling).mean(axis=0)
+        rate = np.where(ratio < self.coupling, self.coupling_down, self.coupling_up)
+        self.coupling += rate * (ratio - self.coupling)
+
+        # 谱减
+        echo = self.coupling * echo_envelope
+        gain = np.clip(1 - self.over_subtraction * echo / (mic_mag + 1e-6), self.gain_floor, 1.0)
+        gain[~active] = 1.0
+        processed = np.fft.irfft(spectrum * gain, n=self.frame_size, axis=1)
+        out = np.clip(processed, -32768, 32767).astype(np.int16).reshape(-1)
+        if len(out) < len(mic):
+            out = np.concatenate((out, mic[len(out):]))
+
+        self.stats["echo_frames"] += int(active.sum())
+        if onset_threshold is not None:
+            raw_energy = np.abs(frames).mean(axis=1)
+            out_energy = np.abs(out[:n_frames * self.frame_size].reshape(n_frames, self.frame_size)).mean(axis=1)
+            suppressed = active & (raw_energy > onset_threshold) & (out_energy <= onset_threshold)
+            self.stats["suppressed_frames"] += int(suppressed.sum())
+            # 连续被抑制的帧只算一次误触发
+            previous = np.concatenate(([self._suppressing], suppressed[:-1]))
+            self.stats["suppressed_triggers"] += int((suppressed & ~previous).sum())
+            self._suppressing = bool(suppressed[-1])
+        return out
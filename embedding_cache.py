@@ -0,0 +1,221 @@
+# 文本向量缓存：按内容哈希缓存 embedding，内存 LRU + 磁盘内存映射两级，重复的文本不再调用远程模型
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    两级 embedding 缓存
+
+    键为 sha1(模型名 + 文本)。
+    内存层: OrderedDict 实现的 LRU，最多 max_memory_items 条。
+    磁盘层: directory 下的 vectors.f32（np.memmap，max_disk_items 行 × 维度）与追加写的 index.log
+            （每行 "键\\t行号"），写满后按先进先出覆盖最早的行；启动时重放 index.log 恢复索引，
+            文件中的过期行超过容量时重写一次。维度在第一次写入时确定，模型换了维度会清空磁盘层。
+    directory 为空时只使用内存层。
+    """
+
+    def __init__(self, directory=None, model="", max_memory_items=1024, max_disk_items=50000):
+        self.directory = directory or None
+        self.model = model
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._index = {}          # 键 -> 磁盘行号
+        self._row_keys = []       # 行号 -> 键
+        self._next_row = 0
+        self._last_row = -1
+        self._index_lines = 0
+        self._vectors = None
+        self._index_file = None
+        self.dim = None
+
+        # 统计信息
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0
+        }
+
+        if directory and max_disk_items > 0:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    # ---------- 磁盘层 ----------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        """读取元信息并重放 index.log"""
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model or meta.get("capacity") != self.max_disk_items:
+                raise ValueError("缓存的模型或容量与当前配置不一致")
+            self._open_vectors(meta["dim"], "r+")
+            self._row_keys = [None] * self.max_disk_items
+            with open(self._path("index.log"), "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 2 or not parts[1].isdigit() or int(parts[1]) >= self.max_disk_items:
+                        continue  # 崩溃时写了一半的行
+                    self._assign_row(parts[0], int(parts[1]))
+                    self._index_lines += 1
+            self._next_row = meta.get("next_row", 0)
+            if self._index_lines:
+                # meta.json 只在关闭时更新，以索引文件中最后写入的行为准
+                self._next_row = (self._last_row + 1) % self.max_disk_items
+            self._index_file = open(self._path("index.log"), "a", encoding="utf-8")
+            print(f"已加载 embedding 磁盘缓存: {len(self._index)} 条")
+        except FileNotFoundError as e:
+            # 全新目录时什么都不做；只剩部分文件（例如 index.log 丢失）时向量无法对应到 key，清掉重建
+            if any(os.path.exists(self._path(name)) for name in ("meta.json", "index.log", "vectors.f32")):
+                print(f"embedding 磁盘缓存文件不完整，重新创建: {e}")
+            self._reset_disk()
+        except Exception as e:
+            print(f"embedding 磁盘缓存不可用，重新创建: {e}")
+            self._reset_disk()
+
+    def _open_vectors(self, dim, mode):
+        self.dim = dim
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode=mode,
+                                  shape=(self.max_disk_items, dim))
+
+    def _reset_disk(self):
+        self._vectors = None
+        self.dim = None
+        self._index = {}
+        self._row_keys = []
+        self._next_row = 0
+        self._index_lines = 0
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        for name in ("meta.json", "index.log", "vectors.f32"):
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def _create_disk(self, dim):
+        self._open_vectors(dim, "w+")
+        self._row_keys = [None] * self.max_disk_items
+        self._write_meta()
+        self._index_file = open(self._path("index.log"), "w", encoding="utf-8")
+
+    def _write_meta(self):
+        with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim, "capacity": self.max_disk_items,
+                       "next_row": self._next_row}, f)
+
+    def _assign_row(self, key, row):
+        old_key = self._row_keys[row]
+        if old_key is not None and self._index.get(old_key) == row:
+            del self._index[old_key]
+        old_row = self._index.get(key)
+        if old_row is not None and old_row != row:
+            self._row_keys[old_row] = None
+        self._row_keys[row] = key
+        self._index[key] = row
+        self._last_row = row
+
+    def _disk_put(self, key, vector):
+        if self.directory is None or self.max_disk_items <= 0 or key in self._index:
+            return
+        if self._vectors is None:
+            self._create_disk(len(vector))
+        elif len(vector) != self.dim:
+            print("embedding 维度发生变化，清空磁盘缓存")
+            self._reset_disk()
+            self._create_disk(len(vector))
+
+        row = self._next_row
+        if self._row_keys[row] is not None:
+            self.stats["disk_evictions"] += 1
+        self._vectors[row] = vector
+        self._assign_row(key, row)
+        self._next_row = (row + 1) % self.max_disk_items
+        self._index_file.write(f"{key}\t{row}\n")
+        self._index_file.flush()
+        self._index_lines += 1
+        if self._index_lines > 2 * self.max_disk_items:
+            self._compact_index()
+
+    def _compact_index(self):
+        """重写 index.log，只保留仍然有效的行（按写入顺序）"""
+        self._index_file.close()
+        order = sorted(self._index.items(), key=lambda item: (item[1] - self._next_row) % self.max_disk_items)
+        tmp_path = self._path("index.log.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, row in order:
+                f.write(f"{key}\t{row}\n")
+        os.replace(tmp_path, self._path("index.log"))
+        self._index_lines = len(order)
+        self._index_file = open(self._path("index.log"), "a", encoding="utf-8")
+
+    # ---------- 内存层 ----------
+
+    def _memory_put(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    # ---------- 对外接口 ----------
+
+    def get_many(self, texts):
+        """批量查询，返回与 texts 等长的列表，未命中的位置为 None"""
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                elif key in self._index:
+                    vector = self._vectors[self._index[key]].tolist()
+                    self._memory_put(key, vector)
+                    self.stats["disk_hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts, vectors):
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                vector = [float(x) for x in vector]
+                self._memory_put(key, vector)
+                self._disk_put(key, vector)
+
+    def hit_rate(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def close(self):
+        """把内存映射写回磁盘并关闭索引文件"""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._write_meta()
+            if self._index_file is not None:
+                self._index_file.close()
+                self._index_file = None
+            # 关闭后只读，新的向量只进内存层
+            self.directory = None
@@ -0,0 +1,142 @@
+# 语音结束判定（端点检测）：根据识别中间结果、韵律和说话人停顿习惯动态决定要等多久的静音
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+import numpy as np
+
+
+class Endpointer(ABC):
+    """
+    端点检测接口
+
+    检测线程在每段语音中按如下顺序调用：
+        endpointer.start(speaker_id)              # 检测到语音开始
+        endpointer.observe(is_speech, energy)     # 每一帧
+        endpointer.required_silence(partial_text) # 静音期间，返回当前需要的静音时长（秒）
+        endpointer.finish()                       # 判定语音结束
+    """
+
+    def start(self, speaker_id="default"):
+        pass
+
+    def observe(self, is_speech, energy):
+        pass
+
+    @abstractmethod
+    def required_silence(self, partial_text=""):
+        pass
+
+    def finish(self):
+        pass
+
+
+class FixedEndpointer(Endpointer):
+    """固定静音时长，等同于原来的 min_silence_duration 行为"""
+
+    def __init__(self, silence_seconds=1.5):
+        self.silence_seconds = silence_seconds
+
+    def required_silence(self, partial_text=""):
+        return self.silence_seconds
+
+
+class AdaptiveEndpointer(Endpointer):
+    """
+    自适应端点检测
+
+    以 base_silence 为基准，再按以下线索调整，结果限制在 [min_silence, max_silence]：
+        识别中间结果: 以句末标点或语气词（吗、呢、吧……）结尾说明话已说完，缩短等待；
+                      以"嗯、那个、然后"或逗号结尾说明还没说完，延长等待。
+        韵律: 最后几帧能量明显低于本段平均水平（句末降调、收尾），缩短等待。
+        说话人习惯: 记录每位说话人句中停顿的时长，说话慢、停顿长的人等待更久；
+                    上一段刚结束就又开口（被过早截断）时，把这段间隔也计入停顿统计。
+    """
+
+    COMPLETE_ENDINGS = ("。", "？", "！", "?", "!", "吗", "呢", "吧", "啊", "呀", "了", "哦", "嘛", "啦")
+    HESITANT_ENDINGS = ("，", ",", "、", "嗯", "呃", "那个", "就是", "然后", "还有", "因为", "但是", "所以", "和")
+
+    def __init__(self, frame_ms=30, base_silence=0.8, min_silence=0.35, max_silence=1.5,
+                 complete_factor=0.5, hesitant_factor=1.5, falling_factor=0.8,
+                 pause_margin=1.2, min_pause=0.15, resume_window=1.0, pause_history=50):
+        self.frame_seconds = frame_ms / 1000
+        self.base_silence = base_silence
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.complete_factor = complete_factor
+        self.hesitant_factor = hesitant_factor
+        self.falling_factor = falling_factor
+        self.pause_margin = pause_margin
+        self.min_pause = min_pause
+        self.resume_window = resume_window
+        self.pause_history = pause_history
+
+        # 每位说话人的句中停顿时长记录
+        self.speaker_pauses = {}
+
+        self._speaker_id = "default"
+        self._current_pause = 0.0
+        self._voiced_energy = deque(maxlen=200)
+        self._last_finish_time = None
+        self._last_required = base_silence
+
+    def _pauses(self):
+        return self.speaker_pauses.setdefault(self._speaker_id, deque(maxlen=self.pause_history))
+
+    def start(self, speaker_id="default"):
+        self._speaker_id = speaker_id
+        self._current_pause = 0.0
+        self._voiced_energy.clear()
+        # 上一段结束后很快又开口：说明上次截断过早，把这段间隔当作一次停顿记下来
+        if self._last_finish_time is not None:
+            gap = time.time() - self._last_finish_time
+            if gap <= self.resume_window:
+                self._pauses().append(self._last_required + gap)
+
+    def observe(self, is_speech, energy):
+        if is_speech:
+            if self._current_pause >= self.min_pause:
+                self._pauses().append(self._current_pause)
+            self._current_pause = 0.0
+            self._voiced_energy.append(float(energy))
+        else:
+            self._current_pause += self.frame_seconds
+
+    def speaker_pause_stats(self, speaker_id="default"):
+        """说话人停顿统计：次数、平均值与 90 分位（秒）"""
+        pauses = self.speaker_pauses.get(speaker_id)
+        if not pauses:
+            return {"count": 0, "mean": 0.0, "p90": 0.0}
+        values = np.array(pauses)
+        return {"count": len(values), "mean": float(values.mean()), "p90": float(np.percentile(values, 90))}
+
+    def _text_factor(self, partial_text):
+        text = (partial_text or "").strip()
+        if not text:
+            return 1.0
+        if text.endswith(self.HESITANT_ENDINGS):
+            return self.hesitant_factor
+        if text.endswith(self.COMPLETE_ENDINGS):
+            return self.complete_factor
+        return 1.0
+
+    def _prosody_factor(self):
+        if len(self._voiced_energy) < 10:
+            return 1.0
+        energies = np.array(self._voiced_energy)
+        # 最后几帧能量明显低于本段平均水平，视为句末收尾
+        if energies[-5:].mean() < 0.6 * energies.mean():
+            return self.falling_factor
+        return 1.0
+
+    def required_silence(self, partial_text=""):
+        silence = self.base_silence
+        stats = self.speaker_pause_stats(self._speaker_id)
+        if stats["count"] >= 3:
+            # 句中停顿习惯偏长的说话人，等待时间至少覆盖其大多数停顿
+            silence = max(silence, stats["p90"] * self.pause_margin)
+        silence *= self._text_factor(partial_text) * self._prosody_factor()
+        self._last_required = float(np.clip(silence, self.min_silence, self.max_silence))
+        return self._last_required
+
+    def finish(self):
+        self._last_finish_time = time.time()
@@ -0,0 +1,99 @@
+# 低功耗空闲监听：长时间安静后停掉完整的语音检测，只在音频回调里做抽样能量检查，有声音再唤醒
+import threading
+import numpy as np
+
+
+class IdleMonitor:
+    """
+    空闲检测与唤醒
+
+    正常运行时采集帧经 forward（通常是放入采集队列）交给检测循环做完整的 VAD。检测循环每处理完
+    一块调用 observe()，持续安静超过 idle_after_seconds 后调用 enter() 进入空闲：之后采集帧在
+    音频回调线程里直接写入环形缓冲区，每 decimation 个采样取一个算平均幅度，不再唤醒检测线程。
+    幅度超过门限时记录唤醒位置并通知 wait() 返回，检测循环从环形缓冲区里把唤醒前 preroll_seconds
+    的音频补做一次检测，再恢复完整检测，语音开头不会丢失。
+    """
+
+    def __init__(self, ring, forward, rate=16000, chunk=480, idle_after_seconds=10.0, decimation=8,
+                 preroll_seconds=1.0):
+        self.ring = ring
+        self.forward = forward
+        self.rate = rate
+        self.chunk = chunk
+        self.idle_after_samples = int(idle_after_seconds * rate)
+        self.decimation = decimation
+        self.preroll_samples = int(preroll_seconds * rate) // chunk * chunk
+
+        self.is_idle = False
+        self.threshold = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._silent_samples = 0
+        self._entered_at = 0
+        self._wake_position = 0
+
+        # 统计信息
+        self.stats = {
+            "idle_entries": 0,
+            "wakeups": 0,
+            "idle_frames": 0
+        }
+
+    @property
+    def enabled(self):
+        return self.idle_after_samples > 0
+
+    def feed(self, data):
+        """音频回调线程：空闲时写入环形缓冲区并做抽样能量检查，否则交给 forward"""
+        with self._lock:
+            if not self.is_idle:
+                self.forward(data)
+                return
+            _, end = self.ring.write(data)
+            self.stats["idle_frames"] += 1
+            if np.abs(np.frombuffer(data, dtype=np.int16)[::self.decimation].astype(np.int32)).mean() > self.threshold:
+                self._wake_position = end
+                self.is_idle = False
+                self.stats["wakeups"] += 1
+                self._wake.set()
+
+    def observe(self, n_samples, active):
+        """检测循环每处理完一块调用；active 表示这一块有语音活动或正在处理，返回是否应当进入空闲"""
+        if not self.enabled or active:
+            self._silent_samples = 0
+            return False
+        self._silent_samples += n_samples
+        return self._silent_samples >= self.idle_after_samples
+
+    def enter(self, threshold, drain):
+        """进入空闲；drain() 返回已经放入采集队列、尚未检测的帧，先按顺序写入环形缓冲区"""
+        with self._lock:
+            for data in drain():
+                self.ring.write(data)
+            self.threshold = threshold
+            self._silent_samples = 0
+            self._entered_at = self.ring.total_written
+            self._wake.clear()
+            self.is_idle = True
+            self.stats["idle_entries"] += 1
+
+    def wait(self, timeout=None):
+        """等待唤醒，返回需要补做检测的 (block_start, frames)；超时或被 interrupt() 时返回 None"""
+        if not self._wake.wait(timeout):
+            return None
+        with self._lock:
+            if self.is_idle or self._wake_position <= self._entered_at:
+                # 被 interrupt() 唤醒
+                self.is_idle = False
+                return None
+            end = self._wake_position
+        start = max(self._entered_at, self.ring.oldest, end - self.preroll_samples)
+        start = end - (end - start) // self.chunk * self.chunk
+        frames = [self.ring.view(pos, pos + self.chunk).tobytes() for pos in range(start, end, self.chunk)]
+        return start, frames
+
+    def interrupt(self):
+        """退出空闲并让 wait() 立即返回（停止监听时使用）"""
+        with self._lock:
+            self.is_idle = False
+            self._wake.set()
@@ -1,15 +1,20 @@
-import pyaudio
+import queue
 import wave
 from http import HTTPStatus
-import asyncio
 import os
-from openai import OpenAI
+import numpy as np
+from openai import OpenAI, AsyncOpenAI
 from dashscope.audio.asr import Recognition
 import dashscope
 import time
-from commit import _run_demo
+import async_runtime
+from commit import _run_demo, warm_up_tts, close_tts
+from audio_player import PlaybackSink, as_pcm_buffer, resample_pcm
+from audio_engine import get_audio_engine, close_audio_engine
+from asr_stream import DashScopeStreamingRecognizer, LocalStandInRecognizer
 from memory import MemoryManager
 from vad_tool import WebRTCVADRecorder, RealTimeVoiceMonitor
+from stream_pipeline import StreamingTurnEngine
 from config import Config
 
 class ElderlyCompanionDemo:
@@ -17,13 +22,14 @@ class ElderlyCompanionDemo:
         # 初始化客户端
         self.setup_clients()
 
-        # 音频参数
-        self.chunk = 1024
-        self.format = pyaudio.paInt16
+        # 音频参数（采集由全局音频引擎完成）
         self.channels = 1
-        self.rate = 16000
+        self.rate = Config.AUDIO_INPUT_RATE
         self.record_seconds = 5  # 每次录音时长
 
+        # TTS 播放输出（首次使用时打开，之后保持常开）
+        self.playback_sink = None
+
     def setup_clients(self):
         """初始化阿里云各服务客户端"""
         # 调用百炼API
@@ -32,49 +38,43 @@ class ElderlyCompanionDemo:
             api_key=Config.API_KEY,
             base_url=Config.BASE_URL,
         )
+        # 异步客户端只在全局事件循环中使用，HTTP 连接池跨轮次复用
+        self.async_client = AsyncOpenAI(
+            api_key=Config.API_KEY,
+            base_url=Config.BASE_URL,
+        )
 
-    def record_audio(self, filename="user_audio.wav"):
-        """录制音频 - 智能停顿"""
-        filename = WebRTCVADRecorder().record_until_silence()
-        return filename
+    def record_audio(self, filename=None):
+        """录制音频 - 智能停顿，默认返回内存中的 PCM 数据，指定 filename 时另存为 WAV"""
+        return WebRTCVADRecorder().record_until_silence(filename)
 
     def record_audio1(self, filename="user_audio.wav"):
         """录制音频 - 固定时长为 self.record_seconds 秒"""
         try:
-            p = pyaudio.PyAudio()
-
-            stream = p.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.rate,
-                input=True,
-                frames_per_buffer=self.chunk,
-                input_device_index=1
-            )
+            engine = get_audio_engine(enable_input=True)
+            frames_queue = queue.Queue()
+            total_samples = int(self.rate * self.record_seconds)
 
             print(f"开始录音...（{self.record_seconds}秒）")
             frames = []
+            recorded = 0
 
-            total_frames = int(self.rate * self.record_seconds / self.chunk)
-            # print(f"预计录制帧数: {total_frames}")
-
-            for i in range(total_frames):
-                try:
-                    data = stream.read(self.chunk, exception_on_overflow=False)
+            # 订阅常开输入流的采集数据，凑够时长后退订
+            engine.subscribe(frames_queue.put)
+            try:
+                while recorded < total_samples:
+                    try:
+                        data = frames_queue.get(timeout=1)
+                    except queue.Empty:
+                        print("读取音频数据超时")
+                        break
                     frames.append(data)
-                    # 显示录音进度
-                    # if i % 10 == 0:  # 每10帧打印一次进度
-                    #     print(f"录制进度: {i + 1}/{total_frames}")
-                except Exception as e:
-                    print(f"读取音频数据时出错: {e}")
-                    break
+                    recorded += len(data) // 2
+            finally:
+                engine.unsubscribe(frames_queue.put)
 
             print(f"录音结束，共录制 {len(frames)} 帧数据")
 
-            stream.stop_stream()
-            stream.close()
-            p.terminate()
-
             # 检查数据
             if not frames:
                 print("警告：没有录制到任何音频数据")
@@ -83,7 +83,7 @@ class ElderlyCompanionDemo:
             # 保存为wav文件
             wf = wave.open(filename, 'wb')
             wf.setnchannels(self.channels)
-            wf.setsampwidth(p.get_sample_size(self.format))
+            wf.setsampwidth(2)  # 16-bit
             wf.setframerate(self.rate)
             wf.writeframes(b''.join(frames))
             wf.close()
@@ -108,8 +108,11 @@ class ElderlyCompanionDemo:
             print(f"录音过程中出错: {e}")
             return None
 
-    def speech_to_text(self, audio_file="user_audio.wav"):
-        """语音转文本 - 使用文件转写服务"""
+    def speech_to_text(self, audio="user_audio.wav", rate=None):
+        """语音转文本 - 支持 WAV 文件路径，或内存中的 16-bit PCM（bytes / memoryview / NumPy 数组）"""
+        if not isinstance(audio, (str, os.PathLike)):
+            return self._speech_to_text_pcm(audio, rate or self.rate)
+        audio_file = audio
         try:
             dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
             recognition = Recognition(model='fun-asr-realtime',
@@ -138,40 +141,106 @@ class ElderlyCompanionDemo:
             print(f"语音识别错误: {e}")
             return ""
 
-    def text_to_speech(self, text, audio_name="response_audio.wav"):
-        """文本转语音"""
+    async def speech_to_text_async(self, audio="user_audio.wav", rate=None):
+        """speech_to_text 的异步版本，识别 SDK 是阻塞调用，放在共享线程池中执行"""
+        return await async_runtime.run_blocking(self.speech_to_text, audio, rate)
+
+    def get_playback_sink(self):
+        """获取常开的 TTS 播放输出，首次调用时接入音频引擎的输出流"""
+        if self.playback_sink is None:
+            max_buffer_seconds, policy = Config.PLAYBACK_QUEUE
+            self.playback_sink = PlaybackSink(get_audio_engine(enable_output=True), rate=24000,
+                                              prebuffer_ms=Config.PLAYBACK_PREBUFFER_MS,
+                                              max_buffer_seconds=max_buffer_seconds, policy=policy)
+            self.playback_sink.start()
+        return self.playback_sink
+
+    def get_record_file(self, audio_name="response_audio.wav"):
+        """回复音频的另存路径；未配置 TTS_RECORD_DIR 时不落盘"""
+        if not Config.TTS_RECORD_DIR:
+            return None
+        return os.path.join(Config.TTS_RECORD_DIR, audio_name)
+
+    def _speech_to_text_pcm(self, audio, rate):
+        """内存中的 PCM 直接以流式识别的方式送入，不经过临时文件"""
+        try:
+            pcm = as_pcm_buffer(audio)
+            recognizer = DashScopeStreamingRecognizer(sample_rate=rate)
+            recognizer.start()
+            step = rate // 10 * 2  # 每次发送 100ms 音频
+            for i in range(0, len(pcm), step):
+                recognizer.feed(pcm[i:i + step])
+            return recognizer.finish() or ""
+        except Exception as e:
+            print(f"语音识别错误: {e}")
+            return ""
+
+    def create_streaming_recognizer(self):
+        """按 Config.ASR_MODE 创建流式识别器；file 模式返回 None，录完整段后再走文件识别"""
+        if Config.ASR_MODE == "streaming":
+            return DashScopeStreamingRecognizer(sample_rate=self.rate)
+        if Config.ASR_MODE == "local":
+            return LocalStandInRecognizer(Config.LOCAL_ASR_TRANSCRIPT, sample_rate=self.rate)
+        return None
+
+    async def text_to_speech_async(self, text, audio_name="response_audio.wav"):
+        """文本转语音：合成的音频边接收边播放，返回时已播放完毕"""
+        sink = self.get_playback_sink()
+        sink.begin_reply(record_file=self.get_record_file(audio_name))
         try:
-            save_file = asyncio.run(_run_demo(text, audio_name))
-            return save_file
+            if not await _run_demo(text, sink.write):
+                # 没等到 response.done，部分音频可能缺失
+                print("语音合成未完成")
+                return False
+            return True
 
         except Exception as e:
             print(f"语音合成错误: {e}")
-            return None
+            return False
+        finally:
+            sink.end_reply()
+            await async_runtime.run_blocking(sink.drain, sink.drain_timeout())
+
+    def text_to_speech(self, text, audio_name="response_audio.wav"):
+        """text_to_speech_async 的同步入口"""
+        return async_runtime.run_sync(self.text_to_speech_async(text, audio_name))
 
-    def play_audio(self, audio_file):
-        """播放音频"""
+    def play_audio(self, audio, rate=24000):
+        """播放音频 - 支持 WAV 文件路径，或内存中的 16-bit 单声道 PCM（bytes / memoryview / NumPy 数组）"""
         try:
-            wf = wave.open(audio_file, 'rb')
-            p = pyaudio.PyAudio()
-
-            stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                            channels=wf.getnchannels(),
-                            rate=wf.getframerate(),
-                            output=True)
-
-            data = wf.readframes(self.chunk)
-            while data:
-                stream.write(data)
-                data = wf.readframes(self.chunk)
-
-            stream.stop_stream()
-            stream.close()
-            p.terminate()
-            wf.close()
+            if isinstance(audio, (str, os.PathLike)):
+                with wave.open(audio, 'rb') as wf:
+                    if wf.getsampwidth() != 2:
+                        raise ValueError("仅支持 16-bit WAV")
+                    rate = wf.getframerate()
+                    pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+                    if wf.getnchannels() > 1:
+                        pcm = pcm.reshape(-1, wf.getnchannels()).mean(axis=1).astype(np.int16)
+            else:
+                pcm = as_pcm_buffer(audio)
+
+            # 复用常开的播放输出，采样率不一致时先重采样
+            sink = self.get_playback_sink()
+            if rate != sink.rate:
+                pcm = resample_pcm(pcm, rate, sink.rate)
+            sink.begin_reply()
+            sink.write(pcm)
+            sink.end_reply()
+            sink.drain(sink.drain_timeout())
 
         except Exception as e:
             print(f"播放音频错误: {e}")
 
+    def _build_messages(self, memory_context, user_input):
+        """构建大模型对话消息"""
+        return [
+            {"role": "system", "content": f"你是一个专门为老年人设计的陪伴机器人，名字叫小伴。你说话要温柔、耐心、简洁，语速要慢一点, {memory_context}, "
+                                          f"绝对禁止在回复中使用任何形式的表情符号、颜文字（例如：😀, 😊, :) , :( 等）。"
+                                          f"回复内容应保持正式、书面化的语言风格，确保输出为纯净的中文文本内容。"
+                                          f"你所有的回复都将被用于语音合成，任何非文本字符都会导致合成失败。"},
+            {"role": "user", "content": f"{user_input}"},
+        ]
+
     def call_bailian_api(self, memory_context, user_input):
         """调用百炼大模型API"""
         try:
@@ -179,13 +248,7 @@ class ElderlyCompanionDemo:
                 # 模型列表：https://help.aliyun.com/zh/model-studio/getting-started/models
                 # model="qwen-plus",
                 model="qwen-max",
-                messages=[
-                    {"role": "system", "content": f"你是一个专门为老年人设计的陪伴机器人，名字叫小伴。你说话要温柔、耐心、简洁，语速要慢一点, {memory_context}, "
-                                                  f"绝对禁止在回复中使用任何形式的表情符号、颜文字（例如：😀, 😊, :) , :( 等）。"
-                                                  f"回复内容应保持正式、书面化的语言风格，确保输出为纯净的中文文本内容。"
-                                                  f"你所有的回复都将被用于语音合成，任何非文本字符都会导致合成失败。"},
-                    {"role": "user", "content": f"{user_input}"},
-                ],
+                messages=self._build_messages(memory_context, user_input),
             )
             resp_text = completion.choices[0].message.content
             # print(f'大模型回复：{resp_text}')
@@ -195,16 +258,56 @@ class ElderlyCompanionDemo:
             print(f"调用大模型API错误: {e}")
             return "抱歉，我刚才没听清楚，能再说一次吗？"
 
+    async def call_bailian_api_async(self, memory_context, user_input):
+        """call_bailian_api 的异步版本"""
+        try:
+            completion = await self.async_client.chat.completions.create(
+                model="qwen-max",
+                messages=self._build_messages(memory_context, user_input),
+            )
+            return completion.choices[0].message.content
+
+        except Exception as e:
+            print(f"调用大模型API错误: {e}")
+            return "抱歉，我刚才没听清楚，能再说一次吗？"
+
+    async def call_bailian_api_stream_async(self, memory_context, user_input):
+        """流式调用百炼大模型API，逐段产出回复文本"""
+        has_output = False
+        completion = None
+        try:
+            completion = await self.async_client.chat.completions.create(
+                model="qwen-max",
+                messages=self._build_messages(memory_context, user_input),
+                stream=True,
+            )
+            async for chunk in completion:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    has_output = True
+                    yield delta
+
+        except Exception as e:
+            print(f"流式调用大模型API错误: {e}")
+            if not has_output:
+                yield "抱歉，我刚才没听清楚，能再说一次吗？"
+        finally:
+            # 任务被取消（用户插话打断）时立即断开 HTTP 流
+            if completion is not None:
+                await completion.close()
+
     def run_conversation_cycle(self, user_text=None):
         """运行一次完整的对话循环"""
         try:
             # 1. 录音
-            audio_file = self.record_audio()
+            audio_data = self.record_audio()
 
             # 2. 语音转文本
-            if audio_file:
+            if audio_data:
                 # print("正在识别语音...")
-                user_text = self.speech_to_text(audio_file)
+                user_text = self.speech_to_text(audio_data)
             if not user_text:
                 user_text = "你好,我是李爷爷"  # 默认问候
 
@@ -215,14 +318,10 @@ class ElderlyCompanionDemo:
             response_text = self.call_bailian_api(memory_context="", user_input=user_text)
             # print(f"AI回复: {response_text}")
 
-            # 4. 文本转语音
+            # 4~5. 文本转语音，边合成边播放
             # print("正在合成AI语音...")
-            response_audio = self.text_to_speech(response_text)
-
-            # 5. 播放回复
-            if response_audio:
-                print("播放回复...")
-                self.play_audio(response_audio)
+            print("播放回复...")
+            self.text_to_speech(response_text)
 
             return True
 
@@ -232,28 +331,26 @@ class ElderlyCompanionDemo:
 
     def test_audio_system(self):
         """测试整个音频系统"""
-        import pyaudio
         import wave
 
-        p = pyaudio.PyAudio()
+        engine = get_audio_engine(enable_input=True, enable_output=True)
+        devices = engine.list_devices()
 
         print("=== 音频系统测试 ===")
 
         # 测试输入设备
         print("输入设备:")
-        for i in range(p.get_device_count()):
-            info = p.get_device_info_by_index(i)
-            if info['maxInputChannels'] > 0:
-                print(f"  设备 {i}: {info['name']}")
+        for index, name, max_input, _, default_rate in devices:
+            if max_input > 0:
+                print(f"  设备 {index}: {name}（默认 {default_rate}Hz）")
 
         # 测试输出设备
         print("输出设备:")
-        for i in range(p.get_device_count()):
-            info = p.get_device_info_by_index(i)
-            if info['maxOutputChannels'] > 0:
-                print(f"  设备 {i}: {info['name']}")
+        for index, name, _, max_output, default_rate in devices:
+            if max_output > 0:
+                print(f"  设备 {index}: {name}（默认 {default_rate}Hz）")
 
-        p.terminate()
+        print(f"当前采集: {engine.device_input_rate}Hz，播放: {engine.device_output_rate}Hz")
 
         # 测试 wave 模块
         print("wave 模块测试...")
@@ -282,30 +379,36 @@ class ElderlyCompanionWithMemory(ElderlyCompanionDemo):
         super().__init__()
         # 记忆管理器
         self.memory_manager = MemoryManager()
+        # 流式对话引擎
+        self.turn_engine = StreamingTurnEngine(self)
         # 实时监听器
         self.realtime_monitor = RealTimeVoiceMonitor(self)
+
+    def _build_memory_context(self, user_input):
+        """检索相关记忆并构建记忆上下文"""
+        related_memories = self.memory_manager.retrieve_related_memories(user_input)
+
+        memory_context = ""
+        if related_memories:
+            memory_context = "相关记忆：\n"
+            for memory in related_memories:
+                speaker = "老人" if memory["speaker"] == "user" else "小伴"
+                memory_context += f"- {speaker}曾说过：{memory['content']}\n"
+            memory_context += "\n"
+        print(f'检索到相关记忆：{memory_context}')
+        return memory_context
+
     def call_bailian_api_with_memory(self, user_input):
         """带长期记忆的大模型调用"""
         try:
-            # 1. 检索相关记忆
-            related_memories = self.memory_manager.retrieve_related_memories(user_input)
-
-            # 2. 构建记忆上下文
-            memory_context = ""
-            if related_memories:
-                memory_context = "相关记忆：\n"
-                for memory in related_memories:
-                    speaker = "老人" if memory["speaker"] == "user" else "小伴"
-                    memory_context += f"- {speaker}曾说过：{memory['content']}\n"
-                memory_context += "\n"
-            print(f'检索到相关记忆：{memory_context}')
+            # 1~2. 检索相关记忆并构建记忆上下文
+            memory_context = self._build_memory_context(user_input)
 
             # 3. 调用大模型（使用API调用方式）
             response = self.call_bailian_api(memory_context, user_input)  # 复用您现有的方法
 
-            # 4. 存储当前对话到长期记忆
-            self.memory_manager.store_memory(user_input, "user")
-            self.memory_manager.store_memory(response, "assistant")
+            # 4. 存储当前对话到长期记忆（入队后由后台线程批量写入，不占用回复时间）
+            self._store_turn(user_input, response)
 
             return response
 
@@ -313,16 +416,55 @@ class ElderlyCompanionWithMemory(ElderlyCompanionDemo):
             print(f"带记忆的对话错误: {e}")
             return self.call_bailian_api(user_input)  # 降级到普通对话
 
+    async def call_bailian_api_with_memory_async(self, user_input):
+        """call_bailian_api_with_memory 的异步版本：记忆检索在共享线程池中进行，写入交给后台写入队列"""
+        try:
+            memory_context = await async_runtime.run_blocking(self._build_memory_context, user_input)
+        except Exception as e:
+            print(f"记忆检索错误: {e}")
+            memory_context = ""
+
+        response = await self.call_bailian_api_async(memory_context, user_input)
+        self._store_turn(user_input, response)
+        return response
+
+    async def call_bailian_api_with_memory_stream_async(self, user_input):
+        """带长期记忆的流式大模型调用，逐段产出回复文本，回复结束（或被打断）后在后台存储记忆"""
+        try:
+            memory_context = await async_runtime.run_blocking(self._build_memory_context, user_input)
+        except Exception as e:
+            print(f"记忆检索错误: {e}")
+            memory_context = ""
+
+        reply_parts = []
+        stream = self.call_bailian_api_stream_async(memory_context, user_input)
+        try:
+            async for delta in stream:
+                reply_parts.append(delta)
+                yield delta
+        finally:
+            await stream.aclose()
+            self._store_turn(user_input, "".join(reply_parts))
+
+    def _store_turn(self, user_input, response):
+        """把一轮对话放入长期记忆的写入队列（只追加日志，很快返回）"""
+        try:
+            self.memory_manager.enqueue_memory(user_input, "user")
+            if response:
+                self.memory_manager.enqueue_memory(response, "assistant")
+        except Exception as e:
+            print(f"存储记忆错误: {e}")
+
     def run_conversation_cycle_with_memory(self):
         """带长期记忆的对话循环"""
         try:
             # 1. 录音
-            audio_file = self.record_audio()
+            audio_data = self.record_audio()
 
             # 2. 语音转文本
             print("正在识别语音...")
             a = time.time()
-            user_text = self.speech_to_text(audio_file)
+            user_text = self.speech_to_text(audio_data)
             if not user_text:
                 user_text = "你好"
             print(f"正在识别语音耗时{time.time()-a}")
@@ -335,15 +477,11 @@ class ElderlyCompanionWithMemory(ElderlyCompanionDemo):
             print(f"正在生成回复（带记忆）...耗时{time.time() - a}")
             print(f"AI回复: {response_text}")
 
-            # 4. 文本转语音
-            print("正在合成语音...")
+            # 4~5. 文本转语音，边合成边播放
+            print("正在合成并播放语音...")
             a = time.time()
-            response_audio = self.text_to_speech(response_text)
-            print(f"正在合成语音...耗时{time.time() - a}")
-            # 5. 播放回复
-            if response_audio:
-                print("播放回复...")
-                self.play_audio(response_audio)
+            self.text_to_speech(response_text)
+            print(f"正在合成并播放语音...耗时{time.time() - a}")
 
             return True
 
@@ -361,12 +499,12 @@ class ElderlyCompanionWithMemory(ElderlyCompanionDemo):
             print(f"\n=== 记忆系统统计 ===")
             print(f"总记忆数量: {count}")
 
-            # 按分类统计
+            # 按分类统计（一条记忆可以属于多个分类，逗号分隔，每个分类各计一次）
             if count > 0:
                 categories = {}
                 for metadata in all_memories['metadatas']:
-                    cat = metadata.get('category', 'unknown')
-                    categories[cat] = categories.get(cat, 0) + 1
+                    for cat in (metadata.get('category') or 'unknown').split(','):
+                        categories[cat] = categories.get(cat, 0) + 1
 
                 for cat, num in categories.items():
                     chinese_name = self.memory_manager.memory_categories.get(cat, cat)
@@ -385,7 +523,7 @@ class ElderlyCompanionWithMemory(ElderlyCompanionDemo):
         print(f"\n=== 搜索 '{query}' 相关记忆 ===")
         for i, memory in enumerate(memories, 1):
             speaker = "老人" if memory["speaker"] == "user" else "小伴"
-            category = self.memory_manager.memory_categories.get(memory["category"], memory["category"])
+            category = "、".join(self.memory_manager.memory_categories.get(c, c) for c in memory["categories"])
             print(f"{i}. [{category}] {speaker}: {memory['content']}")
 
         return memories
@@ -406,16 +544,35 @@ class ElderlyCompanionWithMemory(ElderlyCompanionDemo):
         # 显示记忆统计
         self.show_memory_stats()
 
+        # 预热 TTS 长连接
+        try:
+            warm_up_tts()
+        except Exception as e:
+            print(f"TTS 预热失败: {e}")
+
         # 启动实时监听
         self.realtime_monitor.start_realtime_listening()
 
     def start_demo(self, memory=True, realtime=False):
         """启动Demo - 增加实时模式选项"""
-        if realtime:
-            self.start_realtime_companion()
-        else:
-            # 原有的循环模式
-            self.start_demo_old(memory)
+        try:
+            if realtime:
+                self.start_realtime_companion()
+            else:
+                # 原有的循环模式
+                self.start_demo_old(memory)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """关闭 TTS 长连接、全局事件循环与音频引擎，并把记忆相关的缓存写回磁盘"""
+        try:
+            async_runtime.run_sync(close_tts(), timeout=5)
+        except Exception as e:
+            print(f"关闭 TTS 连接出错: {e}")
+        async_runtime.shutdown()
+        close_audio_engine()
+        self.memory_manager.close()
 
     def start_demo_old(self, memory=True):
         """启动Demo"""
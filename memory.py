@@ -1,25 +1,52 @@
 import chromadb
 # from sentence_transformers import SentenceTransformer
+import os
 import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import dashscope
 from langchain_openai import OpenAIEmbeddings
 from datetime import datetime
 from chromadb import Documents, EmbeddingFunction, Embeddings
 from config import Config
+from embedding_cache import EmbeddingCache
+from memory_ingest import MemoryIngestQueue
+from memory_retention import MemoryRetention
+from memory_consolidation import MemoryConsolidator
+from trigger_matcher import TriggerMatcher, category_flag
 from typing import List, Dict
 import numpy as np
 
 
 # 创建一个符合ChromaDB接口的嵌入函数类
 class OpenAIEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, embedding_model):
+    def __init__(self, embedding_model, cache=None):
         self.embedding_model = embedding_model
+        # 按文本内容缓存向量，只把未命中的文本合并成一次请求发给远程模型
+        self.cache = cache
 
     def __call__(self, texts: Documents) -> Embeddings:
         # 将文本列表转换为向量
-        embeddings = self.embedding_model.embed_documents(texts)
+        if self.cache is None:
+            return self.embedding_model.embed_documents(texts)
+
+        embeddings = self.cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            # 同一批里重复的文本只请求一次
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = dict(zip(missing_texts, self.embedding_model.embed_documents(missing_texts)))
+            self.cache.put_many(missing_texts, [fresh[text] for text in missing_texts])
+            for i in missing:
+                embeddings[i] = fresh[texts[i]]
         return embeddings
 
+    def embed_text(self, text):
+        """单条文本的向量（走同一个缓存）；不覆盖 chromadb 自己的 embed_query"""
+        return self([text])[0]
+
 
 class MemoryManager:
     def __init__(self, persist_directory="./memory_db"):
@@ -36,13 +63,37 @@ class MemoryManager:
             check_embedding_ctx_length=False
         )
 
-        embedding_function = OpenAIEmbeddingFunction(self.embedding_model)
+        # embedding 缓存：内存 LRU + 磁盘内存映射
+        self.embedding_cache = EmbeddingCache(
+            directory=Config.EMBEDDING_CACHE_DIR,
+            model=Config.EM_MODEL,
+            max_memory_items=Config.EMBEDDING_CACHE_MEMORY_ITEMS,
+            max_disk_items=Config.EMBEDDING_CACHE_DISK_ITEMS
+        )
+        embedding_function = OpenAIEmbeddingFunction(self.embedding_model, cache=self.embedding_cache)
+        self.embedding_function = embedding_function
         # 使用自定义嵌入函数创建集合
         self.collection = self.client.get_or_create_collection(
             name="elderly_memory",
             embedding_function=embedding_function,
             metadata={"description": "长期记忆存储"}
         )
+        # 近似重复合并：老人常重复说同样的话，写入时并入已有记忆，后台定期清理历史重复
+        self.consolidator = MemoryConsolidator(
+            self.collection,
+            threshold=Config.MEMORY_DEDUP_THRESHOLD,
+            compaction_interval=Config.MEMORY_COMPACTION_INTERVAL
+        )
+        # 后台批量写入：对话只把记忆追加到日志并入队，向量计算与写库不占用回复时间
+        self.ingest_queue = MemoryIngestQueue(
+            self.collection,
+            embedding_function,
+            journal_path=os.path.join(persist_directory, "ingest.journal"),
+            batch_size=Config.MEMORY_INGEST_BATCH,
+            flush_interval=Config.MEMORY_INGEST_INTERVAL,
+            max_attempts=Config.MEMORY_INGEST_MAX_ATTEMPTS,
+            consolidator=self.consolidator
+        )
         # 记忆分类
         self.memory_categories = {
             "personal_info": "个人信息",
@@ -52,6 +103,21 @@ class MemoryManager:
             "daily_life": "日常生活",
             "emotions": "情绪状态"
         }
+        # 保留策略：后台按分类限制条数、过期易变记忆，旧记忆汇总成摘要；与合并共用锁，检索不加锁
+        self.retention = MemoryRetention(
+            self.collection,
+            embedding_function,
+            lock=self.consolidator.lock,
+            limits=Config.MEMORY_CATEGORY_LIMITS,
+            ttl_days=Config.MEMORY_TTL_DAYS,
+            importance=Config.MEMORY_IMPORTANCE,
+            half_life_days=Config.MEMORY_RECENCY_HALF_LIFE_DAYS,
+            interval=Config.MEMORY_RETENTION_INTERVAL,
+            digest_max_chars=Config.MEMORY_DIGEST_MAX_CHARS,
+            category_names=self.memory_categories
+        )
+        # 记忆触发词编译成自动机，一遍扫描找出一句话命中的所有分类
+        self.trigger_matcher = TriggerMatcher.from_config()
 
         # 重排序模型配置
         self.reranker_config = {
@@ -61,6 +127,12 @@ class MemoryManager:
             "reranker_type": "gte-rerank-v2"  # "bge_reranker" 会下载模型到本地，或 "gte-rerank-v2"(调用云端API)
         }
 
+        # 云端重排序：分数按 (查询哈希, 候选集合哈希) 缓存；超过延迟预算仍未返回时沿用向量检索的顺序
+        self.rerank_cache = OrderedDict()
+        self._rerank_cache_lock = threading.Lock()
+        self._rerank_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rerank")
+        self.rerank_stats = {"calls": 0, "cache_hits": 0, "timeouts": 0, "errors": 0}
+
         # 初始化重排序模型
         self._init_reranker()
 
@@ -90,8 +162,14 @@ class MemoryManager:
             print(f"重排序模型初始化错误: {e}")
             self.reranker_config["enable_reranking"] = False
 
-    def rerank_memories(self, query: str, memories: List[Dict]) -> List[Dict]:
-        """使用重排序模型对记忆进行重新排序"""
+    def rerank_memories(self, query: str, memories: List[Dict], query_embedding=None,
+                        embeddings=None) -> List[Dict]:
+        """
+        使用重排序模型对记忆进行重新排序
+
+        query_embedding / embeddings 为初步检索时已经得到的查询向量和候选记忆向量（与 memories 一一对应），
+        备用方案直接复用，不再请求 embedding
+        """
         if not self.reranker_config["enable_reranking"] or len(memories) <= 1:
             return memories[:self.reranker_config["final_retrieval_count"]]
 
@@ -113,7 +191,7 @@ class MemoryManager:
                 memories = self.dashscope_rerank(query, memories, self.reranker_config["final_retrieval_count"])
             else:
                 # 备用方案：使用嵌入相似度进行重排序
-                memories = self._fallback_rerank(query, memories)
+                memories = self._fallback_rerank(query, memories, query_embedding, embeddings)
 
             return memories[:self.reranker_config["final_retrieval_count"]]
 
@@ -121,17 +199,19 @@ class MemoryManager:
             print(f"重排序失败: {e}, 使用原始顺序")
             return memories[:self.reranker_config["final_retrieval_count"]]
 
-    def _fallback_rerank(self, query: str, memories: List[Dict]) -> List[Dict]:
-        """备用重排序方案：使用嵌入相似度"""
+    def _fallback_rerank(self, query: str, memories: List[Dict], query_embedding=None,
+                         embeddings=None) -> List[Dict]:
+        """备用重排序方案：使用嵌入相似度，一次矩阵运算算出所有候选的分数"""
         try:
-            # 获取查询的嵌入向量
-            query_embedding = self.embedding_model.embed_query(query)
+            # 优先复用初步检索时的向量，缺失时才（经缓存）计算
+            if query_embedding is None:
+                query_embedding = self.embedding_function.embed_text(query)
+            if embeddings is None or len(embeddings) != len(memories):
+                embeddings = self.embedding_function([memory["content"] for memory in memories])
 
-            # 计算每个记忆与查询的余弦相似度
-            for memory in memories:
-                memory_embedding = self.embedding_model.embed_query(memory["content"])
-                similarity = self._cosine_similarity(query_embedding, memory_embedding)
-                memory["relevance_score"] = similarity
+            scores = self._cosine_scores(query_embedding, embeddings)
+            for memory, score in zip(memories, scores):
+                memory["relevance_score"] = float(score)
 
             # 按相似度降序排序
             memories.sort(key=lambda x: x["relevance_score"], reverse=True)
@@ -141,87 +221,134 @@ class MemoryManager:
             print(f"备用重排序失败: {e}")
             return memories
 
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """计算余弦相似度"""
-        vec1 = np.array(vec1)
-        vec2 = np.array(vec2)
-        return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-
-    def dashscope_rerank(self, query: str, memories: List[Dict], top_n: int):
-        """调用阿里云百炼重排序模型sdk"""
-        documents = [memory["content"] for memory in memories]
+    @staticmethod
+    def _cosine_scores(query_embedding, embeddings) -> np.ndarray:
+        """查询向量与每个候选向量的余弦相似度"""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        return matrix @ query / np.maximum(norms, 1e-10)
+
+    @staticmethod
+    def _rerank_key(query: str, documents: List[str], top_n: int):
+        query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        documents_hash = hashlib.sha1("\0".join(documents).encode("utf-8")).hexdigest()
+        return query_hash, documents_hash, top_n
+
+    def _cache_rerank_scores(self, key, scores):
+        with self._rerank_cache_lock:
+            self.rerank_cache[key] = scores
+            self.rerank_cache.move_to_end(key)
+            while len(self.rerank_cache) > Config.RERANK_CACHE_SIZE:
+                self.rerank_cache.popitem(last=False)
+
+    def _call_dashscope_rerank(self, key, query: str, documents: List[str], top_n: int):
+        """调用阿里云百炼重排序模型sdk，返回 [(候选序号, 分数)] 并写入缓存；失败时返回 None"""
         resp = dashscope.TextReRank.call(
             model="gte-rerank-v2",
             query=query,
             documents=documents,
             top_n=top_n,
-            return_documents=True
+            return_documents=False
         )
-        if resp['status_code'] == 200:
-            memory = []
-            for dic in resp['output']['results']:
-                for tmp_memory in memories:
-                    if dic['document']['text'] == tmp_memory['content']:
-                        tmp_memory['relevance_score'] = dic['relevance_score']
-                        memory.append(tmp_memory)
-                        break
-        else:
-            return []
-        # print(f'阿里云百炼API memory={memory}')
-        return memory
+        if resp['status_code'] != 200:
+            print(f"重排序接口返回错误: {resp['status_code']} {resp.get('message', '')}")
+            self.rerank_stats["errors"] += 1
+            return None
+        scores = [(dic['index'], dic['relevance_score']) for dic in resp['output']['results']]
+        self._cache_rerank_scores(key, scores)
+        return scores
 
-    def extract_memory_content(self, text, speaker="user"):
-        """从对话中提取值得记忆的内容"""
-        memory_candidates = []
-
-        # 基于规则的关键词触发
-        memory_triggers = {
-            "personal_info": ["我叫", "我今年", "我住在", "我的电话"],
-            "family": ["我儿子", "我女儿", "我孙子", "我老伴", "我家人"],
-            "health": ["血压", "血糖", "头疼", "不舒服", "吃药", "医院"],
-            "preferences": ["喜欢", "讨厌", "爱看", "爱吃", "爱听"],
-            "daily_life": ["今天去了", "昨天", "上周", "经常"],
-            "emotions": ["开心", "难过", "孤单", "担心", "想念"]
-        }
-
-        for category, triggers in memory_triggers.items():
-            for trigger in triggers:
-                if trigger in text:
-                    memory_candidates.append({
-                        "content": text,
-                        "category": category,
-                        "speaker": speaker,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                    break
+    def dashscope_rerank(self, query: str, memories: List[Dict], top_n: int):
+        """
+        云端重排序，按返回结果中的序号映射回候选记忆（内容相同的记忆也不会错位）
 
-        return memory_candidates
+        超过 Config.RERANK_TIMEOUT 秒没有结果或接口出错时返回向量检索的原始顺序；
+        超时的请求在后台继续完成，分数写入缓存供下次使用。
+        """
+        documents = [memory["content"] for memory in memories]
+        key = self._rerank_key(query, documents, top_n)
+        with self._rerank_cache_lock:
+            scores = self.rerank_cache.get(key)
+            if scores is not None:
+                self.rerank_cache.move_to_end(key)
+        if scores is not None:
+            self.rerank_stats["cache_hits"] += 1
+        else:
+            self.rerank_stats["calls"] += 1
+            future = self._rerank_executor.submit(self._call_dashscope_rerank, key, query, documents, top_n)
+            try:
+                scores = future.result(timeout=Config.RERANK_TIMEOUT)
+            except FutureTimeoutError:
+                print(f"重排序超过 {Config.RERANK_TIMEOUT} 秒未返回，使用向量检索顺序")
+                self.rerank_stats["timeouts"] += 1
+                return memories[:top_n]
+            except Exception as e:
+                print(f"重排序接口调用失败: {e}，使用向量检索顺序")
+                self.rerank_stats["errors"] += 1
+                return memories[:top_n]
+            if scores is None:
+                return memories[:top_n]
+
+        reranked = []
+        for index, score in scores:
+            memory = memories[index]
+            memory['relevance_score'] = score
+            reranked.append(memory)
+        return reranked
 
-    def store_memory(self, text, speaker="user"):
-        """存储记忆到向量数据库"""
+    def extract_memory_content(self, text, speaker="user"):
+        """从对话中提取值得记忆的内容：命中任意触发词时返回一条记忆，categories 为命中的全部分类"""
+        categories = self.trigger_matcher.match(text)
+        if not categories:
+            return []
+        return [{
+            "content": text,
+            "category": ",".join(categories),
+            "categories": categories,
+            "speaker": speaker,
+            "timestamp": datetime.now().isoformat()
+        }]
+
+    def _memory_records(self, text, speaker="user"):
+        """把一句话转换为待写入向量数据库的记录 [{"id", "document", "metadata"}]"""
         # 确保text是纯文本
         clean_text = self.extract_text_from_asr_result(text)
         # print(f'存储记忆：clean_text={clean_text}')
         memories = self.extract_memory_content(clean_text, speaker)
-
+        records = []
         for memory in memories:
-            memory_id = str(uuid.uuid4())
+            # category 保存逗号分隔的全部分类；每个分类另存一个布尔字段，供 where 条件按分类过滤
+            metadata = {
+                "category": memory["category"],
+                "speaker": memory["speaker"],
+                "timestamp": memory["timestamp"],
+                "last_seen": memory["timestamp"],
+                "count": 1,
+                "type": "conversation_memory"
+            }
+            metadata.update({category_flag(category): True for category in memory["categories"]})
+            records.append({"id": str(uuid.uuid4()), "document": memory["content"], "metadata": metadata})
+        return records
 
-            # 存储到向量数据库
+    def store_memory(self, text, speaker="user"):
+        """存储记忆到向量数据库（同步，一次写入）"""
+        records = self._memory_records(text, speaker)
+        if records:
+            embeddings = self.embedding_function([record["document"] for record in records])
+            records, embeddings = self.consolidator.consolidate(records, embeddings)
+        if records:
             self.collection.add(
-                documents=[memory["content"]],
-                metadatas=[{
-                    "category": memory["category"],
-                    "speaker": memory["speaker"],
-                    "timestamp": memory["timestamp"],
-                    "type": "conversation_memory"
-                }],
-                ids=[memory_id]
+                documents=[record["document"] for record in records],
+                metadatas=[record["metadata"] for record in records],
+                ids=[record["id"] for record in records],
+                embeddings=embeddings
             )
+        return len(records)
 
-            # print(f"存储记忆: {memory['content'][:50]}...")
-
-        return len(memories)
+    def enqueue_memory(self, text, speaker="user"):
+        """存储记忆（异步）：写入日志并入队后立即返回，由后台线程批量写入向量数据库"""
+        return self.ingest_queue.submit(self._memory_records(text, speaker))
 
     def extract_text_from_asr_result(self, asr_result):
         """从ASR结果中提取纯文本"""
@@ -294,15 +421,19 @@ class MemoryManager:
 
             # print(f"检索记忆，查询文本: {query_text}")
 
-            # 第一步：初步检索更多记忆
+            # 第一步：初步检索更多记忆，同时取回候选记忆的向量，供备用重排序直接复用
+            query_embedding = self.embedding_function.embed_text(query_text)
             initial_results = self.collection.query(
-                query_texts=[query_text],
-                n_results=self.reranker_config["initial_retrieval_count"]
+                query_embeddings=[query_embedding],
+                n_results=self.reranker_config["initial_retrieval_count"],
+                include=["documents", "metadatas", "distances", "embeddings"]
             )
 
-            if not initial_results['documents']:
+            if not initial_results['documents'] or not initial_results['documents'][0]:
                 print("未找到相关记忆")
                 return []
+            embeddings = initial_results.get('embeddings')
+            embeddings = embeddings[0] if embeddings is not None else None
 
             # 构建记忆列表
             memories = []
@@ -311,8 +442,10 @@ class MemoryManager:
                 memories.append({
                     "content": doc,
                     "category": metadata["category"],
+                    "categories": metadata["category"].split(","),
                     "speaker": metadata["speaker"],
                     "timestamp": metadata["timestamp"],
+                    "count": metadata.get("count", 1),
                     "initial_rank": i + 1  # 记录初始排名
                 })
 
@@ -320,7 +453,7 @@ class MemoryManager:
 
             # 第二步：使用重排序模型重新排序
             if self.reranker_config["enable_reranking"] and len(memories) > 1:
-                memories = self.rerank_memories(query_text, memories)
+                memories = self.rerank_memories(query_text, memories, query_embedding, embeddings)
                 # print(f"重排序后选择前 {len(memories)} 条记忆")
             else:
                 # 如果没有启用重排序，直接取前n_results个
@@ -337,12 +470,29 @@ class MemoryManager:
             print(f"记忆检索错误: {e}")
             return []
 
+    def cache_stats(self):
+        """embedding 缓存的命中统计"""
+        return {**self.embedding_cache.stats, "hit_rate": round(self.embedding_cache.hit_rate(), 3)}
+
+    def close(self):
+        """程序退出时写完排队中的记忆，并把 embedding 磁盘缓存写回"""
+        self.ingest_queue.close()
+        self.consolidator.close()
+        self.retention.close()
+        print(f"记忆写入统计: {self.ingest_queue.stats}")
+        print(f"记忆合并统计: {self.consolidator.stats}")
+        print(f"记忆保留统计: {self.retention.stats}")
+        print(f"embedding 缓存统计: {self.cache_stats()}")
+        print(f"重排序统计: {self.rerank_stats}")
+        self._rerank_executor.shutdown(wait=False)
+        self.embedding_cache.close()
+
     def get_user_profile(self):
         """获取用户画像摘要"""
         try:
-            # 检索所有个人信息类记忆
+            # 检索所有个人信息类记忆（旧数据只有单值的 category 字段）
             personal_memories = self.collection.get(
-                where={"category": "personal_info"}
+                where={"$or": [{"category": "personal_info"}, {category_flag("personal_info"): True}]}
             )
 
             profile = {}
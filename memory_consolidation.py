@@ -0,0 +1,214 @@
+# 记忆合并：新记忆与已有的近似重复记忆合并为一条（计数 + 最近出现时间），后台定期清理历史数据中的重复
+import threading
+import numpy as np
+from memory_retention import DIGEST_TYPE
+from trigger_matcher import category_flag
+
+# 每条记录最多记住多少个已并入它的记录 id（重试与日志重放只涉及最近的几批）
+ABSORBED_LIMIT = 64
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def absorbed_ids(metadata):
+    """已经并入这条记录的记录 id"""
+    return [record_id for record_id in metadata.get("absorbed_ids", "").split(",") if record_id]
+
+
+def merge_metadata(target, source, source_id=None):
+    """
+    把 source 合并进 target，返回新的元数据：次数相加、首次/最近出现时间取两端、分类取并集
+
+    source_id 与 source 已吸收的 id 记入 absorbed_ids（逗号分隔，最多 ABSORBED_LIMIT 个），
+    写入失败重试或重放日志时据此跳过已经合并过的记录，计数不会重复累加。
+    """
+    merged = dict(target)
+    target_first = target.get("timestamp", "")
+    source_first = source.get("timestamp", "")
+    merged["count"] = target.get("count", 1) + source.get("count", 1)
+    merged["timestamp"] = min(filter(None, (target_first, source_first)), default="")
+    merged["last_seen"] = max(target.get("last_seen", target_first), source.get("last_seen", source_first))
+    categories = [c for c in target.get("category", "").split(",") if c]
+    for category in source.get("category", "").split(","):
+        if category and category not in categories:
+            categories.append(category)
+    merged["category"] = ",".join(categories)
+    merged.update({category_flag(category): True for category in categories})
+    absorbed = absorbed_ids(target)
+    for record_id in absorbed_ids(source) + ([source_id] if source_id else []):
+        if record_id not in absorbed:
+            absorbed.append(record_id)
+    if absorbed:
+        merged["absorbed_ids"] = ",".join(absorbed[-ABSORBED_LIMIT:])
+    return merged
+
+
+class MemoryConsolidator:
+    """
+    近似重复记忆合并
+
+    写入时: consolidate() 用这一批记录的向量一次查询每条的 neighbors 个最近邻，余弦相似度不低于
+            threshold 且说话人相同的，合并进已有记录（count + 1，更新 last_seen，分类取并集），
+            同一批内的重复也合并为一条；返回仍需新写入的记录。已经记在近邻 absorbed_ids 里的记录
+            （上次合并后 upsert 失败重试、或崩溃后重放日志）直接跳过，不会重复合并。
+    后台:   每 compaction_interval 秒按 page_size 分页扫描整个集合，把历史数据里的近似重复合并进
+            最近邻并删除，每页之间让出锁，不阻塞写入与检索。
+    threshold <= 0 时不做合并；保留策略生成的摘要记录不参与合并。
+    """
+
+    def __init__(self, collection, threshold=0.95, neighbors=3, compaction_interval=6 * 3600,
+                 page_size=200, start_delay=60.0, lock=None):
+        self.collection = collection
+        self.threshold = threshold
+        self.neighbors = neighbors
+        self.compaction_interval = compaction_interval
+        self.page_size = page_size
+        self.start_delay = start_delay
+
+        # 写入合并、后台清理与保留策略都会改已有记录，共用这把锁互斥执行，避免计数丢失
+        self.lock = lock or threading.Lock()
+        self._stop = threading.Event()
+
+        # 统计信息
+        self.stats = {
+            "merged": 0,
+            "compaction_runs": 0,
+            "compacted": 0
+        }
+
+        self._worker = None
+        if self.enabled and compaction_interval > 0:
+            self._worker = threading.Thread(target=self._compaction_loop, name="memory-compaction", daemon=True)
+            self._worker.start()
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def _nearest(self, embeddings, exclude_ids):
+        """一次查询所有向量的最近邻，返回 [[(相似度, id, 元数据), ...]]，不含 exclude_ids 中的记录和摘要记录"""
+        results = self.collection.query(
+            query_embeddings=[list(map(float, e)) for e in embeddings],
+            n_results=self.neighbors + 1,
+            include=["metadatas", "embeddings"]
+        )
+        queries = _normalize(embeddings)
+        neighbors = []
+        for i in range(len(embeddings)):
+            ids = results["ids"][i] if results.get("ids") else []
+            found = []
+            if len(ids):
+                scores = _normalize(results["embeddings"][i]) @ queries[i]
+                for score, record_id, metadata in zip(scores, ids, results["metadatas"][i]):
+                    if record_id in exclude_ids or metadata.get("type") == DIGEST_TYPE:
+                        continue
+                    if score >= self.threshold:
+                        found.append((float(score), record_id, metadata))
+            neighbors.append(found)
+        return neighbors
+
+    def consolidate(self, records, embeddings):
+        """写入前调用：把近似重复合并进已有记录，返回 (需要新写入的记录, 对应的向量)"""
+        if not self.enabled or not records:
+            return records, embeddings
+        with self.lock:
+            ids = {record["id"] for record in records}
+            neighbors = self._nearest(embeddings, ids)
+            vectors = _normalize(embeddings)
+            updates = {}   # 已有记录 id -> 合并后的元数据
+            kept = []      # 本批中保留下来的记录下标
+            for i, record in enumerate(records):
+                if any(record["id"] in absorbed_ids(metadata) for _, _, metadata in neighbors[i]):
+                    continue   # 之前已经合并进已有记录
+                speaker = record["metadata"].get("speaker")
+                target = None
+                for _, record_id, metadata in neighbors[i]:
+                    if metadata.get("speaker") == speaker:
+                        target = record_id
+                        updates.setdefault(record_id, metadata)
+                        break
+                if target is not None:
+                    updates[target] = merge_metadata(updates[target], record["metadata"], record["id"])
+                    self.stats["merged"] += 1
+                    continue
+                # 与本批中更早的记录重复
+                for j in kept:
+                    if records[j]["metadata"].get("speaker") == speaker and float(vectors[j] @ vectors[i]) >= self.threshold:
+                        records[j] = {**records[j], "metadata": merge_metadata(records[j]["metadata"], record["metadata"],
+                                                                               record["id"])}
+                        self.stats["merged"] += 1
+                        break
+                else:
+                    kept.append(i)
+
+            if updates:
+                self.collection.update(ids=list(updates), metadatas=list(updates.values()))
+        return [records[i] for i in kept], [embeddings[i] for i in kept]
+
+    # ---------- 后台清理 ----------
+
+    def _compaction_loop(self):
+        delay = self.start_delay
+        while not self._stop.wait(delay):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"记忆去重清理失败: {e}")
+            delay = self.compaction_interval
+
+    def compact(self):
+        """分页扫描集合，把近似重复的记录合并进最近邻并删除，返回本轮合并的条数"""
+        compacted = 0
+        offset = 0
+        while not self._stop.is_set():
+            with self.lock:
+                page = self.collection.get(limit=self.page_size, offset=offset,
+                                           include=["metadatas", "embeddings"])
+                page_ids = page["ids"]
+                if not len(page_ids):
+                    break
+                neighbors = self._nearest(page["embeddings"], set())
+                merged = {}    # 幸存记录 id -> 合并后的元数据
+                removed = set()
+                for i, record_id in enumerate(page_ids):
+                    metadata = page["metadatas"][i]
+                    if record_id in merged or metadata.get("type") == DIGEST_TYPE:
+                        continue   # 已经有别的记录并入它，或者是摘要记录，保留
+                    for _, target, target_metadata in neighbors[i]:
+                        if target == record_id or target in removed:
+                            continue
+                        if record_id in absorbed_ids(target_metadata):
+                            # 上次已经并入 target，只是没来得及删除
+                            removed.add(record_id)
+                            break
+                        if target_metadata.get("speaker") == metadata.get("speaker"):
+                            merged[target] = merge_metadata(merged.get(target, target_metadata), metadata, record_id)
+                            removed.add(record_id)
+                            break
+                if merged:
+                    self.collection.update(ids=list(merged), metadatas=list(merged.values()))
+                if removed:
+                    self.collection.delete(ids=list(removed))
+                compacted += len(removed)
+                # 删除的都是本页的记录，后面的记录前移
+                offset += len(page_ids) - len(removed)
+            # 每页之间稍作停顿，把锁让给写入线程
+            self._stop.wait(0.05)
+        with self.lock:
+            self.stats["compaction_runs"] += 1
+            self.stats["compacted"] += compacted
+        if compacted:
+            print(f"记忆去重清理: 合并 {compacted} 条重复记忆")
+        return compacted
+
+    def close(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout=1)
@@ -0,0 +1,244 @@
+# 记忆写入队列：对话结束后只把待存储的记忆追加到日志并入队，由后台线程批量计算向量、批量写入向量库
+import json
+import os
+import threading
+import time
+
+
+class MemoryIngestQueue:
+    """
+    后台批量写入记忆（write-behind）
+
+    submit() 把记录追加写入 journal_path（每行一条 JSON），再放入内存队列后立即返回。
+    后台线程攒够 batch_size 条或等待 flush_interval 秒后，把这一批记录用一次 embedding 请求、
+    一次 collection.upsert 写入，成功后在日志中追加 {"done": [...]}。所有记录都已写入时清空日志。
+    启动时重放日志，把没有完成标记的记录重新入队；upsert 按 id 幂等，崩溃前已写入但未标记的记录不会重复。
+    写入失败时记录保留在队列中，按 retry_interval 重试；同一批连续失败 max_attempts 次后拆成一半重试，
+    直到找出写不进去的单条记录，把它追加到 deadletter_path（默认 journal_path + ".deadletter"）并标记完成，
+    不再阻塞后面的记录。close() 之后 submit() 拒绝新记录。
+    提供 consolidator（MemoryConsolidator）时，写入前先把近似重复的记录合并进已有记录。
+    """
+
+    def __init__(self, collection, embedding_function, journal_path, batch_size=32, flush_interval=2.0,
+                 retry_interval=10.0, max_attempts=3, deadletter_path=None, consolidator=None):
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.consolidator = consolidator
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.deadletter_path = deadletter_path or journal_path + ".deadletter"
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._running = True
+        self._writing = False
+        self._flush_requested = False
+        self._oldest_at = 0.0   # 队列中最早一条记录的入队时间
+        self._retry_at = 0.0
+        self._attempts = 0                 # 队首这一批连续失败的次数
+        self._batch_limit = batch_size     # 拆批后每批的条数
+        self._suspect = 0                  # 队首还有多少条记录属于曾经失败的批次，写完之前不恢复批大小
+
+        # 统计信息
+        self.stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "failures": 0,
+            "recovered": 0,
+            "dead_lettered": 0
+        }
+
+        directory = os.path.dirname(journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._journal = open(journal_path, "a", encoding="utf-8")
+
+        self._worker = threading.Thread(target=self._run, name="memory-ingest", daemon=True)
+        self._worker.start()
+
+    def _recover(self):
+        """重放日志，取回上次退出时还没有写入向量库的记录"""
+        if not os.path.exists(self.journal_path):
+            return
+        records = {}
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时写了一半的行
+                if "done" in entry:
+                    for record_id in entry["done"]:
+                        records.pop(record_id, None)
+                else:
+                    records[entry["id"]] = entry
+        self._pending = list(records.values())
+        self.stats["recovered"] = len(self._pending)
+        # 只保留未完成的记录，日志从头开始
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            for record in self._pending:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if self._pending:
+            print(f"从记忆写入日志恢复 {len(self._pending)} 条未写入的记忆")
+
+    def _append_journal(self, entries):
+        with self._journal_lock:
+            if self._journal.closed:
+                return
+            for entry in entries:
+                self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._journal.flush()
+
+    def submit(self, records):
+        """records: [{"id", "document", "metadata"}]；写入日志后入队，不等待向量库"""
+        if not records:
+            return 0
+        with self._condition:
+            if not self._running:
+                print(f"记忆写入队列已关闭，丢弃 {len(records)} 条记忆")
+                return 0
+            # 持有 _condition 写日志，保证不会与清空日志交错
+            self._append_journal(records)
+            if not self._pending:
+                self._oldest_at = time.time()
+            self._pending.extend(records)
+            self.stats["submitted"] += len(records)
+            self._condition.notify()
+        return len(records)
+
+    def _take_batch(self):
+        """等待下一批记录；已停止时返回 None（剩余记录留在日志里）"""
+        with self._condition:
+            while True:
+                now = time.time()
+                if not self._running:
+                    return None
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                if now < self._retry_at:
+                    self._condition.wait(self._retry_at - now)
+                    continue
+                # 攒够一批、最早的记录已等待 flush_interval 秒、或者要求立即写入时取出一批
+                due = self._oldest_at + self.flush_interval
+                if len(self._pending) >= self.batch_size or now >= due or self._flush_requested:
+                    self._writing = True
+                    return self._pending[:self._batch_limit]
+                self._condition.wait(due - now)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+            try:
+                records = batch
+                embeddings = self.embedding_function([record["document"] for record in batch])
+                if self.consolidator is not None:
+                    records, embeddings = self.consolidator.consolidate(batch, embeddings)
+                if records:
+                    self.collection.upsert(
+                        ids=[record["id"] for record in records],
+                        documents=[record["document"] for record in records],
+                        metadatas=[record["metadata"] for record in records],
+                        embeddings=embeddings
+                    )
+            except Exception as e:
+                self._handle_failure(batch, e)
+                continue
+
+            self._complete(batch)
+
+    def _handle_failure(self, batch, error):
+        """同一批失败 max_attempts 次后拆成一半；已经是单条记录时移入死信日志"""
+        with self._condition:
+            self.stats["failures"] += 1
+            self._attempts += 1
+            if self._attempts < self.max_attempts:
+                print(f"批量写入记忆失败，{self.retry_interval} 秒后重试: {error}")
+                self._retry_at = time.time() + self.retry_interval
+                self._writing = False
+                self._condition.notify_all()
+                return
+            self._attempts = 0
+            self._suspect = max(self._suspect, len(batch))
+            if len(batch) > 1:
+                self._batch_limit = len(batch) // 2
+                print(f"{len(batch)} 条记忆连续写入失败 {self.max_attempts} 次，拆成每批 {self._batch_limit} 条重试: {error}")
+                self._writing = False
+                self._condition.notify_all()
+                return
+
+        print(f"记忆 {batch[0]['id']} 连续写入失败 {self.max_attempts} 次，移入死信日志: {error}")
+        try:
+            with open(self.deadletter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({**batch[0], "error": str(error)}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"写入死信日志失败: {e}")
+        self._complete(batch, dead_lettered=True)
+
+    def _complete(self, batch, dead_lettered=False):
+        """队首这一批已经处理完（写入或移入死信日志）：记完成标记并出队"""
+        self._append_journal([{"done": [record["id"] for record in batch]}])
+        with self._condition:
+            del self._pending[:len(batch)]
+            if dead_lettered:
+                self.stats["dead_lettered"] += len(batch)
+            else:
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+            self._writing = False
+            self._attempts = 0
+            self._suspect = max(self._suspect - len(batch), 0)
+            if not self._suspect:
+                self._batch_limit = self.batch_size
+            if not self._pending:
+                self._flush_requested = False
+                self._truncate_journal()
+            else:
+                # 剩下的记录已经等过了，尽快写入
+                self._oldest_at = 0.0
+            self._condition.notify_all()
+
+    def _truncate_journal(self):
+        """所有记录都已写入，清空日志（调用方持有 _condition）"""
+        with self._journal_lock:
+            if self._journal.closed:
+                return
+            self._journal.seek(0)
+            self._journal.truncate()
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self, timeout=10.0):
+        """立即写入所有排队的记录，最多等待 timeout 秒，返回是否全部写入"""
+        deadline = time.time() + timeout
+        with self._condition:
+            self._flush_requested = True
+            self._retry_at = 0.0
+            self._condition.notify_all()
+            while self._pending or self._writing:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """写入剩余记录并停止后台线程；没写完的记录留在日志里，下次启动时恢复"""
+        if not self.flush(timeout):
+            print(f"退出时仍有 {self.pending_count()} 条记忆未写入，已保留在日志中")
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._worker.join(timeout=1)
+        with self._journal_lock:
+            self._journal.close()
@@ -0,0 +1,204 @@
+# 记忆保留策略：按分类限制条数、易变分类过期，超出的旧记忆按月汇总成摘要记录而不是直接删除
+import math
+import threading
+from datetime import datetime
+from trigger_matcher import category_flag
+
+DIGEST_TYPE = "memory_digest"
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MemoryRetention:
+    """
+    记忆保留与分层
+
+    每 interval 秒按分类逐个处理（每个分类之间让出锁，检索不受影响）：
+    1. 过期: 该分类设置了 ttl_days 且最近出现时间超过该期限的记忆；
+    2. 超量: 该分类剩余记忆超过 limits 时，按 重要性 × 重复次数 × 新近程度 打分，分数最低的超出部分。
+    以上记忆按 (说话人, 月份) 汇总进该分类的摘要记录（type=memory_digest，已有摘要时追加），再把原记录
+    移出该分类（改写 category，cat_<分类> 置为 False）；不再属于任何分类的记录才删除。
+    摘要正文最多 digest_max_chars 个字符，保留次数与起止时间，本身不再参与过期与超量处理。
+    """
+
+    def __init__(self, collection, embedding_function, lock, limits=None, ttl_days=None, importance=None,
+                 half_life_days=30.0, interval=3600.0, digest_max_chars=600, category_names=None,
+                 start_delay=120.0):
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.lock = lock
+        self.limits = limits or {}
+        self.ttl_days = ttl_days or {}
+        self.importance = importance or {}
+        self.half_life_days = half_life_days
+        self.interval = interval
+        self.digest_max_chars = digest_max_chars
+        self.category_names = category_names or {}
+        self.start_delay = start_delay
+
+        self._stop = threading.Event()
+
+        # 统计信息
+        self.stats = {
+            "runs": 0,
+            "expired": 0,
+            "evicted": 0,
+            "stripped": 0,     # 仍属于其他分类、只移出当前分类的记录
+            "digests_created": 0,
+            "digests_updated": 0
+        }
+
+        self._worker = None
+        if interval > 0 and (self.limits or self.ttl_days):
+            self._worker = threading.Thread(target=self._run, name="memory-retention", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        delay = self.start_delay
+        while not self._stop.wait(delay):
+            try:
+                self.enforce()
+            except Exception as e:
+                print(f"记忆保留策略执行失败: {e}")
+            delay = self.interval
+
+    # ---------- 打分 ----------
+
+    @staticmethod
+    def _categories(metadata):
+        return [c for c in metadata.get("category", "").split(",") if c]
+
+    def _last_seen(self, metadata, now):
+        return _parse_time(metadata.get("last_seen") or metadata.get("timestamp")) or now
+
+    def _expired(self, category, metadata, now):
+        ttl = self.ttl_days.get(category)
+        if ttl is None:
+            return False
+        return (now - self._last_seen(metadata, now)).total_seconds() > ttl * 86400
+
+    def score(self, metadata, now=None):
+        """重要性（所属分类中最高的权重）× (1 + ln 次数) × 新近程度（按 half_life_days 半衰）"""
+        now = now or datetime.now()
+        importance = max((self.importance.get(c, 1.0) for c in self._categories(metadata)), default=1.0)
+        age_days = max((now - self._last_seen(metadata, now)).total_seconds() / 86400, 0.0)
+        recency = 0.5 ** (age_days / self.half_life_days) if self.half_life_days > 0 else 1.0
+        return importance * (1.0 + math.log(max(metadata.get("count", 1), 1))) * recency
+
+    # ---------- 执行 ----------
+
+    def enforce(self):
+        """处理所有配置了上限或期限的分类，返回汇总进摘要的记忆条数"""
+        total = 0
+        for category in dict.fromkeys(list(self.ttl_days) + list(self.limits)):
+            if self._stop.is_set():
+                break
+            with self.lock:
+                total += self.enforce_category(category)
+            # 分类之间让出锁，写入与去重清理可以插进来
+            self._stop.wait(0.05)
+        self.stats["runs"] += 1
+        if total:
+            print(f"记忆保留策略: {total} 条旧记忆已汇总为摘要")
+        return total
+
+    def enforce_category(self, category, now=None):
+        """处理单个分类（调用方持有 lock），返回汇总进摘要的记忆条数"""
+        now = now or datetime.now()
+        result = self.collection.get(
+            where={"$or": [{"category": category}, {category_flag(category): True}]},
+            include=["documents", "metadatas"]
+        )
+        records = [(record_id, document, metadata)
+                   for record_id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+                   if metadata.get("type") != DIGEST_TYPE]
+
+        expired = [record for record in records if self._expired(category, record[2], now)]
+        expired_ids = {record[0] for record in expired}
+        remaining = [record for record in records if record[0] not in expired_ids]
+
+        evicted = []
+        limit = self.limits.get(category)
+        if limit is not None and len(remaining) > limit:
+            remaining.sort(key=lambda record: self.score(record[2], now), reverse=True)
+            evicted = remaining[limit:]
+
+        self.stats["expired"] += len(expired)
+        self.stats["evicted"] += len(evicted)
+        retired = expired + evicted
+        if retired:
+            self._digest(category, retired, now)
+            self._retire(category, retired)
+        return len(retired)
+
+    def _retire(self, category, records):
+        """把已汇总的记录移出该分类；还属于其他分类的保留，否则删除"""
+        deleted, stripped = [], {}
+        for record_id, _, metadata in records:
+            categories = [c for c in self._categories(metadata) if c != category]
+            if categories:
+                stripped[record_id] = {**metadata, "category": ",".join(categories), category_flag(category): False}
+            else:
+                deleted.append(record_id)
+        if stripped:
+            self.collection.update(ids=list(stripped), metadatas=list(stripped.values()))
+            self.stats["stripped"] += len(stripped)
+        if deleted:
+            self.collection.delete(ids=deleted)
+
+    # ---------- 摘要 ----------
+
+    def _digest(self, category, records, now):
+        """把记录按 (说话人, 月份) 汇总进该分类的摘要记录"""
+        groups = {}
+        for record in sorted(records, key=lambda record: self._last_seen(record[2], now)):
+            metadata = record[2]
+            period = self._last_seen(metadata, now).strftime("%Y-%m")
+            groups.setdefault((metadata.get("speaker", "user"), period), []).append(record)
+
+        ids, documents, metadatas = [], [], []
+        for (speaker, period), group in groups.items():
+            digest_id = f"digest-{category}-{speaker}-{period}"
+            existing = self.collection.get(ids=[digest_id], include=["documents", "metadatas"])
+            if existing["ids"]:
+                document = existing["documents"][0]
+                metadata = dict(existing["metadatas"][0])
+                self.stats["digests_updated"] += 1
+            else:
+                document = f"{period} {self.category_names.get(category, category)}摘要："
+                metadata = {
+                    "category": category,
+                    category_flag(category): True,
+                    "speaker": speaker,
+                    "timestamp": group[0][2].get("timestamp", ""),
+                    "last_seen": "",
+                    "count": 0,
+                    "period": period,
+                    "type": DIGEST_TYPE
+                }
+                self.stats["digests_created"] += 1
+
+            for _, text, item in group:
+                metadata["count"] += item.get("count", 1)
+                metadata["timestamp"] = min(filter(None, (metadata["timestamp"], item.get("timestamp", ""))), default="")
+                metadata["last_seen"] = max(metadata["last_seen"], item.get("last_seen") or item.get("timestamp", ""))
+                # 正文满了只累计次数与时间范围
+                if text not in document and len(document) + len(text) + 1 <= self.digest_max_chars:
+                    document += text if document.endswith("：") else f"；{text}"
+
+            ids.append(digest_id)
+            documents.append(document)
+            metadatas.append(metadata)
+
+        self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas,
+                               embeddings=self.embedding_function(documents))
+
+    def close(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout=1)
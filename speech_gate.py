@@ -0,0 +1,154 @@
+# 识别前的语音段过滤：用时长、浊音帧占比和频谱特征在本地判断是不是人声，咳嗽、关门声等不送去识别
+import numpy as np
+from audio_player import as_pcm_buffer
+from vad_engine import frame_features
+
+
+class SpeechGate:
+    """
+    轻量的语音 / 非语音分类器
+
+    只看能量超过结束门限（随噪声基底变化）的活动帧，累计整段特征:
+        voiced_seconds: 浊音帧（过零率适中、频谱平坦度低、语音频带能量占比不低于 min_band_ratio）累计时长
+        voiced_ratio:   浊音帧占活动帧的比例，噪声、摩擦声很低
+        flatness:       活动帧的平均频谱平坦度，宽带噪声接近 1
+        band_ratio:     300~3400Hz 语音频带能量占比，低频撞击、高频嘶声偏低
+        peak_ratio:     能量最高的 10% 帧占总能量的比例，关门、拍桌等瞬态接近 1
+    线性组合后经 logistic 得到 0~1 的置信度，不低于 threshold 视为语音。
+    浊音时长不足 min_voiced_seconds 时直接判为非语音。threshold 为 0 时关闭过滤。
+
+    每段语音先 reset()，录音过程中用 add() 增量累计：每次只对新加入的帧做 FFT，is_speech() / check()
+    根据累计结果判断，不会随语音段变长反复重算整段。
+    """
+
+    WEIGHTS = {"voiced_ratio": 5.0, "flatness": -6.0, "band_ratio": 3.0, "peak_ratio": -4.0}
+    BIAS = -0.2
+    CENTERS = {"voiced_ratio": 0.4, "flatness": 0.3, "band_ratio": 0.5, "peak_ratio": 0.4}
+
+    def __init__(self, rate=16000, frame_ms=30, threshold=0.5, min_voiced_seconds=0.2,
+                 flatness_threshold=0.5, zcr_min=0.01, zcr_max=0.5, min_band_ratio=0.2):
+        self.rate = rate
+        self.frame_size = int(rate * frame_ms / 1000)
+        self.frame_seconds = frame_ms / 1000
+        self.threshold = threshold
+        self.min_voiced_seconds = min_voiced_seconds
+        self.flatness_threshold = flatness_threshold
+        self.zcr_min = zcr_min
+        self.zcr_max = zcr_max
+        self.min_band_ratio = min_band_ratio
+
+        freqs = np.fft.rfftfreq(self.frame_size, 1 / rate)
+        self._band = (freqs >= 300) & (freqs <= 3400)
+        self._window = np.hanning(self.frame_size).astype(np.float32)
+
+        # 统计信息
+        self.stats = {
+            "checked": 0,
+            "passed": 0,
+            "rejected": 0,
+            "asr_calls_avoided": 0
+        }
+        self.reset()
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def _frame_stats(self, samples, energy_threshold):
+        """逐帧特征（只保留活动帧），不足一帧的尾部忽略；没有活动帧时返回 None"""
+        samples = np.frombuffer(samples, dtype=np.int16)
+        n_frames = len(samples) // self.frame_size
+        if n_frames == 0:
+            return None
+        frames = samples[:n_frames * self.frame_size].reshape(n_frames, self.frame_size)
+        energy, zcr, flatness = frame_features(frames)
+        active = energy > energy_threshold
+        if not active.any():
+            return None
+
+        power = np.abs(np.fft.rfft(frames[active].astype(np.float32) * self._window, axis=1)) ** 2
+        band_power = power[:, self._band].sum(axis=1)
+        total_power = power.sum(axis=1)
+        # 浊音帧：过零率适中、频谱平坦度低，并且语音频带有足够能量（排除低频撞击声）
+        voiced = (flatness[active] < self.flatness_threshold) & (zcr[active] >= self.zcr_min) & \
+            (zcr[active] <= self.zcr_max) & (band_power >= self.min_band_ratio * total_power)
+        return {
+            "voiced": voiced,
+            "flatness": flatness[active],
+            "band_power": band_power,
+            "total_power": total_power,
+            "frame_power": energy[active] ** 2
+        }
+
+    # ---------- 录音过程中的增量累计 ----------
+
+    def reset(self):
+        """开始一段新的语音，清空累计的特征"""
+        self._tail = b""
+        self._voiced_frames = 0
+        self._active_frames = 0
+        self._flatness_sum = 0.0
+        self._band_power = 0.0
+        self._total_power = 0.0
+        self._frame_powers = []
+
+    def add(self, samples, energy_threshold):
+        """追加新录到的音频，只对新的帧计算特征；每帧按加入时的门限判断是否活动"""
+        data = self._tail + as_pcm_buffer(samples).tobytes()
+        usable = len(data) // (self.frame_size * 2) * self.frame_size * 2
+        self._tail = data[usable:]
+        stats = self._frame_stats(data[:usable], energy_threshold)
+        if stats is None:
+            return
+        self._voiced_frames += int(stats["voiced"].sum())
+        self._active_frames += len(stats["voiced"])
+        self._flatness_sum += float(stats["flatness"].sum())
+        self._band_power += float(stats["band_power"].sum())
+        self._total_power += float(stats["total_power"].sum())
+        self._frame_powers.append(stats["frame_power"])
+
+    def current_features(self):
+        """到目前为止累计的特征，没有活动帧时返回 None"""
+        if self._active_frames == 0:
+            return None
+        frame_power = np.concatenate(self._frame_powers)
+        top = max(1, int(np.ceil(len(frame_power) * 0.1)))
+        return {
+            "voiced_seconds": float(self._voiced_frames * self.frame_seconds),
+            "voiced_ratio": float(self._voiced_frames / self._active_frames),
+            "flatness": float(self._flatness_sum / self._active_frames),
+            "band_ratio": float(self._band_power / (self._total_power + 1e-10)),
+            "peak_ratio": float(np.partition(frame_power, -top)[-top:].sum() / (frame_power.sum() + 1e-10))
+        }
+
+    def confidence(self, features):
+        """特征 -> 是语音的置信度（0~1）"""
+        if features is None or features["voiced_seconds"] < self.min_voiced_seconds:
+            return 0.0
+        z = self.BIAS + sum(weight * (features[name] - self.CENTERS[name]) for name, weight in self.WEIGHTS.items())
+        return float(1 / (1 + np.exp(-z)))
+
+    def is_speech(self):
+        """录音过程中的判断（不计入统计）：累计的音频已经有足够证据表明是语音"""
+        if not self.enabled:
+            return True
+        return self.confidence(self.current_features()) >= self.threshold
+
+    def record_early_pass(self):
+        """录音期间已经由 is_speech() 判定为语音的语音段，结束时只计数"""
+        self.stats["checked"] += 1
+        self.stats["passed"] += 1
+
+    def check(self):
+        """语音段结束时对累计的音频做最终判断，返回 (是否送去识别, 置信度)，并更新统计"""
+        self.stats["checked"] += 1
+        if not self.enabled:
+            self.stats["passed"] += 1
+            return True, 1.0
+        confidence = self.confidence(self.current_features())
+        if confidence >= self.threshold:
+            self.stats["passed"] += 1
+            return True, confidence
+        self.stats["rejected"] += 1
+        self.stats["asr_calls_avoided"] += 1
+        return False, confidence
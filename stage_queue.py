@@ -0,0 +1,153 @@
+# 流水线阶段之间的有界队列：容量固定，放满后按溢出策略处理，并统计队列深度与丢弃次数
+import asyncio
+import queue
+import threading
+
+DROP_OLDEST = "drop_oldest"  # 丢弃最早的一项，保证新数据进入
+COALESCE = "coalesce"        # 把新数据合并进队尾的一项
+REJECT = "reject"            # 拒绝新数据
+POLICIES = (DROP_OLDEST, COALESCE, REJECT)
+
+
+class StageStats:
+    """单个阶段的队列统计，可以在多个队列对象之间共享（例如每轮新建的句子队列）"""
+
+    def __init__(self, name):
+        self.name = name
+        self.depth = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def record(self, field, depth=None):
+        with self._lock:
+            if field is not None:
+                setattr(self, field, getattr(self, field) + 1)
+            if depth is not None:
+                self.depth = depth
+                self.max_depth = max(self.max_depth, depth)
+
+    def snapshot(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected
+        }
+
+
+class _OverflowPolicy:
+    """两种队列共用的溢出处理；None 作为结束/退出信号，总是放入，不受容量限制"""
+
+    def _init_policy(self, name, maxsize, policy, coalesce, on_drop, stats):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}，可选 {POLICIES}")
+        if policy == COALESCE and coalesce is None:
+            raise ValueError("coalesce 策略需要提供合并函数")
+        if maxsize <= 0:
+            raise ValueError("队列容量必须大于 0")
+        self.name = name
+        self.capacity = maxsize
+        self.policy = policy
+        self.coalesce = coalesce
+        self.on_drop = on_drop
+        self.stats = stats or StageStats(name)
+
+    def _overflow(self, items, item):
+        """
+        队列已满时按策略处理（调用方持有锁或位于事件循环线程内）
+
+        返回 (是否还需要把 item 追加到队尾, 被丢弃的项)
+        """
+        if item is None or len(items) < self.capacity:
+            return True, None
+        if self.policy == REJECT:
+            self.stats.record("rejected")
+            return False, None
+        if self.policy == COALESCE and items[-1] is not None:
+            items[-1] = self.coalesce(items[-1], item)
+            self.stats.record("coalesced")
+            return False, None
+        self.stats.record("dropped")
+        return True, items.popleft()
+
+    def _notify_drop(self, dropped):
+        if dropped is not None and self.on_drop is not None:
+            try:
+                self.on_drop(dropped)
+            except Exception as e:
+                print(f"{self.name} 队列丢弃回调出错: {e}")
+
+
+class BoundedStageQueue(_OverflowPolicy, queue.Queue):
+    """
+    线程间使用的有界阶段队列
+
+    put() 永远不阻塞生产者（例如音频采集线程），放满后按 policy 处理:
+        drop_oldest: 丢弃最早的一项，被丢弃的项交给 on_drop（例如取消其识别器）
+        coalesce:    用 coalesce(队尾项, 新项) 合并进队尾
+        reject:      丢弃新项，put() 返回 False
+    get() / get_nowait() 与 queue.Queue 相同。
+    """
+
+    def __init__(self, name, maxsize, policy=DROP_OLDEST, coalesce=None, on_drop=None, stats=None):
+        # 底层队列不限容量，上限由 put() 按策略维持
+        queue.Queue.__init__(self)
+        self._init_policy(name, maxsize, policy, coalesce, on_drop, stats)
+
+    def put(self, item, block=True, timeout=None):
+        with self.mutex:
+            append, dropped = self._overflow(self.queue, item)
+            if append:
+                self._put(item)
+                if dropped is None:
+                    self.unfinished_tasks += 1
+                self.not_empty.notify()
+        self._notify_drop(dropped)
+        return append
+
+    def put_nowait(self, item):
+        return self.put(item)
+
+    def _put(self, item):
+        self.queue.append(item)
+        self.stats.record("enqueued", len(self.queue))
+
+    def _get(self):
+        item = self.queue.popleft()
+        self.stats.record(None, len(self.queue))
+        return item
+
+
+class AsyncBoundedStageQueue(_OverflowPolicy, asyncio.Queue):
+    """事件循环内使用的有界阶段队列，溢出策略与 BoundedStageQueue 相同，只能在事件循环线程内 put"""
+
+    def __init__(self, name, maxsize, policy=DROP_OLDEST, coalesce=None, on_drop=None, stats=None):
+        asyncio.Queue.__init__(self)
+        self._init_policy(name, maxsize, policy, coalesce, on_drop, stats)
+
+    def put_nowait(self, item):
+        append, dropped = self._overflow(self._queue, item)
+        if dropped is not None:
+            self.task_done()
+        if append:
+            asyncio.Queue.put_nowait(self, item)
+        self._notify_drop(dropped)
+        return append
+
+    async def put(self, item):
+        return self.put_nowait(item)
+
+    def _put(self, item):
+        self._queue.append(item)
+        self.stats.record("enqueued", len(self._queue))
+
+    def _get(self):
+        item = self._queue.popleft()
+        self.stats.record(None, len(self._queue))
+        return item
@@ -0,0 +1,165 @@
+# 流式对话管线：ASR 文本 -> 大模型流式回复 -> 逐句 TTS -> 边合成边播放
+import asyncio
+import re
+import threading
+import time
+import async_runtime
+from commit import _run_stream_demo
+from stage_queue import AsyncBoundedStageQueue, StageStats
+from config import Config
+
+
+class SentenceSplitter:
+    """
+    将大模型逐字产出的文本切分为适合合成的完整句子。
+
+    遇到句末标点（。！？；等）立即切句；遇到逗号等停顿标点时，只有积累的文本
+    足够长才切句，这样第一句可以尽早送去合成，又不会把回复切得过碎。
+    """
+
+    STRONG_PUNCTUATION = "。！？；!?;\n"
+    SOFT_PUNCTUATION = "，、：,:"
+
+    def __init__(self, soft_min_chars=12):
+        self.soft_min_chars = soft_min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """输入一段文本增量，返回其中已经完整的句子列表"""
+        sentences = []
+        for char in text:
+            self._buffer += char
+            if char in self.STRONG_PUNCTUATION or (
+                    char in self.SOFT_PUNCTUATION and len(self._buffer) >= self.soft_min_chars):
+                sentence = self._buffer.strip()
+                self._buffer = ""
+                if self._has_content(sentence):
+                    sentences.append(sentence)
+        return sentences
+
+    def flush(self):
+        """回复结束时取出剩余的未完结文本"""
+        sentence = self._buffer.strip()
+        self._buffer = ""
+        return [sentence] if self._has_content(sentence) else []
+
+    @staticmethod
+    def _has_content(sentence):
+        """过滤只有标点或空白的片段"""
+        return bool(re.sub(r"[\s，。！？；、：,.!?;:]", "", sentence))
+
+
+class StreamingTurnEngine:
+    """
+    流式对话引擎
+
+    大模型的回复按 token 流式返回，每凑齐一句就送入 TTS，TTS 的音频增量直接写入常开的播放输出。
+    三个阶段相互重叠，首句可闻延迟 ≈ 首句生成 + 首句合成，而不是各阶段耗时之和。
+    整轮对话作为一个任务运行在全局异步运行时的事件循环上，run_turn_async() 供异步调用方使用，
+    run_turn() 是供处理线程使用的同步入口。
+
+    interrupt() 可以从任意线程调用（用户插话时由检测线程调用）：立即停止播放并取消本轮任务，
+    TTS 会话被打断、大模型流随之关闭，本轮返回已生成的部分回复。
+    """
+
+    def __init__(self, companion_instance, soft_min_chars=12):
+        self.companion = companion_instance
+        self.soft_min_chars = soft_min_chars
+        self.last_turn_metrics = {}
+        # 大模型 -> TTS 句子队列的统计，跨轮次累计
+        self.sentence_stats = StageStats("sentence")
+
+        # 当前轮次的打断控制
+        self._lock = threading.Lock()
+        self._turn_task = None
+        self._sink = None
+
+    @property
+    def is_active(self):
+        """当前是否有正在进行的回复"""
+        return self._turn_task is not None and not self._turn_task.done()
+
+    def interrupt(self):
+        """打断当前回复：停止播放并取消本轮任务；没有进行中的回复时返回 False"""
+        with self._lock:
+            if not self.is_active:
+                return False
+            task, sink = self._turn_task, self._sink
+            self._turn_task = None
+        sink.stop()
+        async_runtime.call_soon(task.cancel)
+        return True
+
+    def _reply_stream(self, user_text):
+        """优先使用带记忆的流式接口"""
+        if hasattr(self.companion, 'call_bailian_api_with_memory_stream_async'):
+            return self.companion.call_bailian_api_with_memory_stream_async(user_text)
+        return self.companion.call_bailian_api_stream_async("", user_text)
+
+    async def _produce_sentences(self, sentence_queue, user_text, metrics, reply_parts):
+        """消费大模型流，把完整句子放入队列；任务被取消时大模型流随之关闭"""
+        splitter = SentenceSplitter(self.soft_min_chars)
+        try:
+            async for delta in self._reply_stream(user_text):
+                if "first_token" not in metrics:
+                    metrics["first_token"] = time.time()
+                reply_parts.append(delta)
+                for sentence in splitter.feed(delta):
+                    if "first_sentence" not in metrics:
+                        metrics["first_sentence"] = time.time()
+                    sentence_queue.put_nowait(sentence)
+            for sentence in splitter.flush():
+                if "first_sentence" not in metrics:
+                    metrics["first_sentence"] = time.time()
+                sentence_queue.put_nowait(sentence)
+        except Exception as e:
+            print(f"流式生成回复错误: {e}")
+        finally:
+            sentence_queue.put_nowait(None)
+
+    async def run_turn_async(self, user_text):
+        """运行一轮流式对话，返回回复文本；被打断时返回已生成的部分"""
+        metrics = {"start": time.time()}
+        reply_parts = []
+        sink = self.companion.get_playback_sink()
+        sink.begin_reply(record_file=self.companion.get_record_file(f"response_{int(metrics['start'])}.wav"),
+                         on_first_audio=lambda: metrics.setdefault("first_audio", time.time()))
+        with self._lock:
+            self._turn_task = asyncio.current_task()
+            self._sink = sink
+
+        capacity, policy = Config.SENTENCE_QUEUE
+        sentence_queue = AsyncBoundedStageQueue("sentence", capacity, policy,
+                                                coalesce=lambda queued, new: queued + new,
+                                                stats=self.sentence_stats)
+        producer = asyncio.create_task(self._produce_sentences(sentence_queue, user_text, metrics, reply_parts))
+        interrupted = False
+        try:
+            await _run_stream_demo(sentence_queue, sink.write)
+            await producer
+            sink.end_reply()
+            await async_runtime.run_blocking(sink.drain, sink.drain_timeout())
+        except asyncio.CancelledError:
+            interrupted = True
+            print("回复被用户打断")
+        except Exception as e:
+            print(f"流式对话错误: {e}")
+        finally:
+            producer.cancel()
+            with self._lock:
+                self._turn_task = None
+                self._sink = None
+            sink.end_reply()
+        metrics["end"] = time.time()
+
+        self.last_turn_metrics = {
+            key: value - metrics["start"] for key, value in metrics.items() if key != "start"
+        }
+        self.last_turn_metrics["interrupted"] = interrupted
+        if "first_audio" in self.last_turn_metrics:
+            print(f"首句可闻延迟: {self.last_turn_metrics['first_audio']:.2f}秒")
+        return "".join(reply_parts)
+
+    def run_turn(self, user_text):
+        """同步入口：在处理线程中运行一轮流式对话"""
+        return async_runtime.run_sync(self.run_turn_async(user_text))
@@ -0,0 +1,86 @@
+# 记忆触发词匹配：所有分类的触发词编译成一个 Aho-Corasick 自动机，一遍扫描找出命中的全部分类
+import json
+from typing import Dict, List
+from config import Config
+
+
+def category_flag(category):
+    """分类对应的元数据布尔字段名，一条记忆属于多个分类时按该字段过滤"""
+    return f"cat_{category}"
+
+
+class TriggerMatcher:
+    """
+    多模式串匹配
+
+    triggers 为 {分类: [触发词, ...]}，构造时编译一次：字典树 + 失败指针，每个状态记录
+    以它结尾的触发词所属分类的位掩码。match() 对文本只扫描一遍，返回命中的分类
+    （按 triggers 中的定义顺序），全部分类都已命中时提前结束。
+    """
+
+    def __init__(self, triggers: Dict[str, List[str]]):
+        self.categories = list(triggers)
+        self.triggers = {category: list(words) for category, words in triggers.items()}
+        self._all_mask = (1 << len(self.categories)) - 1
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [0]
+        self._build()
+
+    @classmethod
+    def from_config(cls):
+        """从 Config.MEMORY_TRIGGERS_FILE（JSON）加载触发词，未设置或读取失败时使用 Config.MEMORY_TRIGGERS"""
+        path = Config.MEMORY_TRIGGERS_FILE
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return cls(json.load(f))
+            except Exception as e:
+                print(f"加载记忆触发词文件失败，使用默认配置: {e}")
+        return cls(Config.MEMORY_TRIGGERS)
+
+    def _build(self):
+        # 字典树
+        for bit, category in enumerate(self.categories):
+            for word in self.triggers[category]:
+                if not word:
+                    continue
+                state = 0
+                for ch in word:
+                    next_state = self._goto[state].get(ch)
+                    if next_state is None:
+                        next_state = len(self._goto)
+                        self._goto[state][ch] = next_state
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._output.append(0)
+                    state = next_state
+                self._output[state] |= 1 << bit
+
+        # 按层次遍历设置失败指针，并把失败链上的输出合并进来
+        frontier = list(self._goto[0].values())
+        while frontier:
+            next_frontier = []
+            for state in frontier:
+                for ch, child in self._goto[state].items():
+                    fail = self._fail[state]
+                    while fail and ch not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[child] = self._goto[fail].get(ch, 0)
+                    self._output[child] |= self._output[self._fail[child]]
+                    next_frontier.append(child)
+            frontier = next_frontier
+
+    def match(self, text: str) -> List[str]:
+        """返回 text 命中的所有分类"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        mask = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            mask |= output[state]
+            if mask == self._all_mask:
+                break
+        return [category for bit, category in enumerate(self.categories) if mask >> bit & 1]
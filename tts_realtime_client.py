@@ -1,9 +1,12 @@
 # -- coding: utf-8 --
 import websockets
+import asyncio
 import json
 import base64
 import time
-from typing import Optional, Callable, Dict, Any
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Callable, Dict, Any, List
 from enum import Enum
 
 
@@ -31,6 +34,8 @@ class TTSRealtimeClient:
             接收音频数据的回调函数。
         language_type(str)
             合成的语音的语种，可选值Chinese、English、German、Italian、Portuguese、Spanish、Japanese、Korean、French、Russian、Auto
+        response_timeout (float):
+            等待服务器 response.done / session.finished 事件的超时时间（秒）。
     """
 
     def __init__(
@@ -40,7 +45,8 @@ class TTSRealtimeClient:
             voice: str = "Cherry",
             mode: SessionMode = SessionMode.SERVER_COMMIT,
             audio_callback: Optional[Callable[[bytes], None]] = None,
-        language_type: str = "Auto"):
+        language_type: str = "Auto",
+            response_timeout: float = 15.0):
         self.base_url = base_url
         self.api_key = api_key
         self.voice = voice
@@ -48,12 +54,20 @@ class TTSRealtimeClient:
         self.ws = None
         self.audio_callback = audio_callback
         self.language_type = language_type
+        self.response_timeout = response_timeout
 
         # 当前回复状态
         self._current_response_id = None
         self._current_item_id = None
         self._is_responding = False
 
+        # 完成事件：每次 commit 对应一个等待 response.done 的 future
+        self._pending_responses = deque()
+        self._session_finished = None
+
+        # 长连接状态：后台消息循环与最近一次使用时间
+        self._reader_task = None
+        self.last_used = time.time()
 
     async def connect(self) -> None:
         """与 TTS Realtime API 建立 WebSocket 连接。"""
@@ -98,12 +112,40 @@ class TTSRealtimeClient:
         await self.send_event(event)
 
 
-    async def commit_text_buffer(self) -> None:
-        """提交文本缓冲区以触发处理。"""
+    async def commit_text_buffer(self) -> asyncio.Future:
+        """提交文本缓冲区以触发处理，返回在 response.done 时完成的 future。"""
         event = {
             "type": "input_text_buffer.commit"
         }
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending_responses.append(waiter)
         await self.send_event(event)
+        return waiter
+
+    async def wait_for_responses(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待所有已提交的文本合成完毕（收到 response.done）。
+
+        音频回调在 response.done 之前同步调用，因此返回时所有音频数据都已交付。
+        超过 timeout（默认 response_timeout）仍未完成则放弃等待并返回 False。
+        """
+        if not self._pending_responses:
+            return True
+        timeout = self.response_timeout if timeout is None else timeout
+        waiters = list(self._pending_responses)
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiters), timeout)
+            return True
+        except asyncio.TimeoutError:
+            print(f"等待 TTS 合成完成超时（{timeout}秒）")
+            return False
+        except Exception as e:
+            print(f"TTS 合成未正常完成: {e}")
+            return False
+        finally:
+            for waiter in waiters:
+                if waiter in self._pending_responses:
+                    self._pending_responses.remove(waiter)
 
 
     async def clear_text_buffer(self) -> None:
@@ -114,12 +156,57 @@ class TTSRealtimeClient:
         await self.send_event(event)
 
 
-    async def finish_session(self) -> None:
-        """结束会话。"""
+    async def finish_session(self, timeout: Optional[float] = None) -> bool:
+        """结束会话，并等待服务器返回 session.finished。"""
         event = {
             "type": "session.finish"
         }
+        self._session_finished = asyncio.get_running_loop().create_future()
         await self.send_event(event)
+        timeout = self.response_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._session_finished, timeout)
+            return True
+        except asyncio.TimeoutError:
+            print(f"等待会话结束超时（{timeout}秒）")
+            return False
+        except Exception as e:
+            print(f"会话未正常结束: {e}")
+            return False
+
+    async def cancel_response(self) -> None:
+        """
+        打断当前合成：不再向外交付音频，清空文本缓冲区并结束会话，最后断开连接。
+
+        已提交的文本仍可能在服务器端继续合成，会话状态无法与下一轮干净地衔接，
+        因此不等待 session.finished，直接断开，由 TTSSessionPool 在归还时重新建立连接。
+        """
+        self.audio_callback = None
+        try:
+            if self.ws is not None:
+                await self.clear_text_buffer()
+                await self.send_event({"type": "session.finish"})
+        except Exception as e:
+            print(f"打断 TTS 合成出错: {e}")
+        finally:
+            await self.close()
+
+    def _resolve_next_response(self) -> None:
+        """response.done 到达时完成最早的一个等待者。"""
+        while self._pending_responses:
+            waiter = self._pending_responses.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+
+    def _fail_pending(self, exc: Exception) -> None:
+        """连接断开时让所有等待者立即失败，避免一直等到超时。"""
+        while self._pending_responses:
+            waiter = self._pending_responses.popleft()
+            if not waiter.done():
+                waiter.set_exception(exc)
+        if self._session_finished is not None and not self._session_finished.done():
+            self._session_finished.set_exception(exc)
 
 
     async def handle_messages(self) -> None:
@@ -165,18 +252,220 @@ class TTSRealtimeClient:
                     self._is_responding = False
                     self._current_response_id = None
                     self._current_item_id = None
+                    self._resolve_next_response()
                     # print("响应完成")
                 elif event_type == "session.finished":
-                    pass
+                    if self._session_finished is not None and not self._session_finished.done():
+                        self._session_finished.set_result(True)
                     # print("会话已结束")
 
-        except websockets.exceptions.ConnectionClosed:
+        except websockets.exceptions.ConnectionClosed as e:
             print("连接已关闭")
+            self._fail_pending(e)
         except Exception as e:
             print("消息处理出错: ", str(e))
+            self._fail_pending(e)
+        else:
+            self._fail_pending(ConnectionError("连接已关闭"))
+
+
+    def start_message_loop(self) -> None:
+        """在后台持续运行 handle_messages，供长连接复用。"""
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.create_task(self.handle_messages())
 
+    async def health_check(self, timeout: float = 5.0) -> bool:
+        """检查连接是否可用：消息循环仍在运行且心跳在超时时间内得到响应。"""
+        if self.ws is None or self._reader_task is None or self._reader_task.done():
+            return False
+        try:
+            pong_waiter = await self.ws.ping()
+            await asyncio.wait_for(pong_waiter, timeout)
+            return True
+        except Exception:
+            return False
 
     async def close(self) -> None:
         """关闭 WebSocket 连接。"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending(ConnectionError("连接已关闭"))
         if self.ws:
-            await self.ws.close()
\ No newline at end of file
+            await self.ws.close()
+            self.ws = None
+
+
+class TTSSessionPool:
+    """
+    TTS 长连接会话池。
+
+    预先建立并配置好 WebSocket 会话，多轮对话复用同一连接，避免每轮都重新进行
+    TLS/WebSocket 握手和 session.update。取用时做健康检查，断线后按指数退避重连；
+    空闲期间后台定期心跳保活。
+
+    属性说明:
+        pool_size (int):
+            预热的会话数量。
+        keepalive_interval (float):
+            空闲会话的心跳间隔（秒）。
+        health_check_timeout (float):
+            心跳等待响应的超时时间（秒）。
+        reconnect_base_delay / reconnect_max_delay (float):
+            重连退避的初始等待与最大等待（秒）。
+        response_timeout (float):
+            会话等待完成事件的超时时间（秒），传给每个 TTSRealtimeClient。
+        max_reconnect_attempts (int):
+            单次重连的最大尝试次数。
+    """
+
+    def __init__(
+            self,
+            base_url: str,
+            api_key: str,
+            voice: str = "Cherry",
+            mode: SessionMode = SessionMode.COMMIT,
+            language_type: str = "Auto",
+            response_timeout: float = 15.0,
+            pool_size: int = 1,
+            keepalive_interval: float = 20.0,
+            health_check_timeout: float = 5.0,
+            reconnect_base_delay: float = 0.5,
+            reconnect_max_delay: float = 30.0,
+            max_reconnect_attempts: int = 5):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.voice = voice
+        self.mode = mode
+        self.language_type = language_type
+        self.response_timeout = response_timeout
+        self.pool_size = pool_size
+        self.keepalive_interval = keepalive_interval
+        self.health_check_timeout = health_check_timeout
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_reconnect_attempts = max_reconnect_attempts
+
+        self._clients: List[TTSRealtimeClient] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._keepalive_task = None
+        self._closed = False
+
+    def _new_client(self) -> TTSRealtimeClient:
+        return TTSRealtimeClient(
+            base_url=self.base_url,
+            api_key=self.api_key,
+            voice=self.voice,
+            mode=self.mode,
+            language_type=self.language_type,
+            response_timeout=self.response_timeout
+        )
+
+    async def start(self) -> None:
+        """预热会话池：建立连接并完成会话配置。重复调用无副作用。"""
+        if self._idle is not None:
+            return
+        self._closed = False
+        self._idle = asyncio.Queue()
+        for _ in range(self.pool_size):
+            client = self._new_client()
+            try:
+                await self._connect_with_backoff(client)
+            except Exception as e:
+                # 预热失败不影响启动，取用时会再次重连
+                print(f"TTS 会话预热失败: {e}")
+            self._clients.append(client)
+            self._idle.put_nowait(client)
+        self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+
+    async def _connect_with_backoff(self, client: TTSRealtimeClient) -> None:
+        """（重新）建立连接，失败时按指数退避重试。"""
+        delay = self.reconnect_base_delay
+        for attempt in range(1, self.max_reconnect_attempts + 1):
+            try:
+                await client.close()
+                await client.connect()
+                client.start_message_loop()
+                client.last_used = time.time()
+                return
+            except Exception as e:
+                if attempt == self.max_reconnect_attempts:
+                    raise
+                print(f"TTS 连接失败（第{attempt}次）: {e}，{delay:.1f}秒后重试")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def acquire(self, audio_callback: Optional[Callable[[bytes], None]] = None) -> TTSRealtimeClient:
+        """取出一个已配置好的会话，必要时先重连。"""
+        await self.start()
+        client = await self._idle.get()
+        try:
+            if not await client.health_check(self.health_check_timeout):
+                print("TTS 会话不可用，正在重连...")
+                await self._connect_with_backoff(client)
+        except BaseException:
+            self._idle.put_nowait(client)
+            raise
+        client.audio_callback = audio_callback
+        return client
+
+    async def release(self, client: TTSRealtimeClient) -> None:
+        """归还会话，连接保持打开供下一轮复用；已断开的连接先在后台重连再归还。"""
+        client.audio_callback = None
+        client.last_used = time.time()
+        if client.ws is None and not self._closed:
+            asyncio.create_task(self._reconnect_and_release(client))
+            return
+        self._idle.put_nowait(client)
+
+    async def _reconnect_and_release(self, client: TTSRealtimeClient) -> None:
+        """后台重连（例如被打断后主动断开的会话），无论成败都放回空闲队列。"""
+        try:
+            await self._connect_with_backoff(client)
+        except Exception as e:
+            # 重连失败时取用时会再次尝试
+            print(f"TTS 会话重连失败: {e}")
+        finally:
+            if self._idle is not None:
+                self._idle.put_nowait(client)
+
+    @asynccontextmanager
+    async def session(self, audio_callback: Optional[Callable[[bytes], None]] = None):
+        """以上下文管理器的方式取用会话，结束后自动归还。"""
+        client = await self.acquire(audio_callback)
+        try:
+            yield client
+        finally:
+            await self.release(client)
+
+    async def _keepalive_loop(self) -> None:
+        """空闲保活：定期检查空闲会话，断开的连接在后台提前重连。"""
+        while not self._closed:
+            await asyncio.sleep(self.keepalive_interval)
+            for _ in range(self._idle.qsize()):
+                client = self._idle.get_nowait()
+                try:
+                    if time.time() - client.last_used < self.keepalive_interval:
+                        continue
+                    if not await client.health_check(self.health_check_timeout):
+                        print("TTS 空闲会话已断开，后台重连...")
+                        await self._connect_with_backoff(client)
+                    client.last_used = time.time()
+                except Exception as e:
+                    print(f"TTS 会话保活失败: {e}")
+                finally:
+                    self._idle.put_nowait(client)
+
+    async def close(self) -> None:
+        """关闭会话池中的所有连接。"""
+        self._closed = True
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        for client in self._clients:
+            try:
+                await client.close()
+            except Exception:
+                pass
+        self._clients = []
+        self._idle = None
\ No newline at end of file
@@ -0,0 +1,110 @@
+# 语音段检测状态机：VAD 打分 + 端点检测，产出语音段起止事件，检测线程和独立采集进程共用
+from vad_engine import VADEngine, NoiseFloorTracker
+from endpointing import AdaptiveEndpointer
+
+
+class UtteranceDetector:
+    """
+    语音段检测
+
+    每次输入一块已经写入环形缓冲区的音频帧，完成 VAD 打分（同时更新噪声基底）和端点判定，
+    返回本块内发生的事件列表。事件都是普通 dict，可以直接通过管道发给其他进程:
+        {"type": "onset", "start": 语音段起点（含预触发）, "end": 触发帧末尾}
+        {"type": "end", "start": 语音段起点, "end": 语音段末尾, "duration": 录音时长（秒）}
+    """
+
+    def __init__(self, rate=16000, chunk=480, silence_threshold=200, min_silence_duration=1.5,
+                 max_single_utterance=10.0, vad_aggressiveness=2, endpointer=None, pre_trigger_seconds=0.5):
+        self.rate = rate
+        self.chunk = chunk
+        self.max_single_utterance = max_single_utterance
+
+        # 语音活动检测：每个 chunk 为一帧，整块向量化打分
+        # 噪声基底持续更新，起始/结束门限随环境噪声自适应并带滞回
+        frame_ms = int(chunk * 1000 / rate)
+        self.noise_tracker = NoiseFloorTracker(frame_ms=frame_ms, min_onset=silence_threshold,
+                                               min_offset=silence_threshold * 0.6)
+        self.vad_engine = VADEngine(rate=rate, frame_ms=frame_ms, smoothing_window=3,
+                                    webrtc_aggressiveness=vad_aggressiveness,
+                                    noise_tracker=self.noise_tracker)
+
+        # 端点检测：根据识别中间结果、韵律和说话人停顿习惯决定静音等待时长
+        self.frame_seconds = chunk / rate
+        self.endpointer = endpointer or AdaptiveEndpointer(frame_ms=frame_ms, max_silence=min_silence_duration)
+
+        self.pre_trigger_samples = int(pre_trigger_seconds * rate)  # 预触发：保留语音开始前的音频
+        self.max_recording_frames = int(max_single_utterance * rate / chunk)
+
+        # 检测状态
+        self.is_recording = False
+        self.silence_frames = 0
+        self.recording_start = 0
+        self.recording_frames = 0
+        self.utterance_start = 0
+
+    def process_block(self, ring, block_start, frames, partial_text="", samples=None):
+        """
+        frames 已写入 ring 的 [block_start, ring.total_written) 区间；partial_text 为当前的识别中间结果
+        samples 为用于打分的同一段音频（例如回声抑制后的信号），默认直接取 ring 中的音频
+        """
+        events = []
+        if samples is None:
+            samples = ring.view(block_start, block_start + sum(len(f) // 2 for f in frames))
+        result = self.vad_engine.score_block(samples)
+
+        frame_end = block_start
+        for data, energy, is_speech in zip(frames, result["energy"], result["speech"]):
+            frame_end += len(data) // 2
+
+            if self.is_recording:
+                # 录音状态
+                self.recording_frames += 1
+
+                # 检查语音活动
+                if not is_speech:
+                    self.silence_frames += 1
+                else:
+                    self.silence_frames = 0
+                self.endpointer.observe(is_speech, energy)
+
+                # 检查停止条件（按采样数计算时长，批量处理时也准确）
+                recording_duration = (frame_end - self.recording_start) / self.rate
+
+                # 条件1: 持续静音超过端点检测器给出的等待时长
+                condition1 = self.silence_frames > 0 and (
+                    self.silence_frames * self.frame_seconds
+                    >= self.endpointer.required_silence(partial_text))
+                # 条件2: 达到最大录音时长
+                condition2 = recording_duration >= self.max_single_utterance
+                # 条件3: 录音帧数过多
+                condition3 = self.recording_frames >= self.max_recording_frames
+
+                if condition1 or condition2 or condition3:
+                    print(f"语音结束，录音时长: {recording_duration:.2f}秒")
+                    events.append({"type": "end", "start": self.utterance_start, "end": frame_end,
+                                   "duration": recording_duration})
+                    self.endpointer.finish()
+
+                    # 重置状态
+                    self.is_recording = False
+                    self.silence_frames = 0
+                    self.recording_frames = 0
+
+                # 实时显示录音状态
+                if self.recording_frames % 10 == 0 and self.is_recording:  # 每10帧显示一次
+                    partial_info = f", 识别中: {partial_text}" if partial_text else ""
+                    print(f"录音中... {recording_duration:.1f}秒, 能量: {energy:.1f}{partial_info}")
+
+            elif is_speech:
+                # 检测到语音活动，开始录音
+                print("检测到语音活动，开始录音...")
+                self.is_recording = True
+                self.recording_start = frame_end - len(data) // 2
+                self.endpointer.start()
+
+                # 语音段从预触发区间开始（包含当前帧）
+                self.utterance_start = max(ring.oldest, frame_end - self.pre_trigger_samples)
+                self.recording_frames = (frame_end - self.utterance_start) // self.chunk
+                events.append({"type": "onset", "start": self.utterance_start, "end": frame_end})
+
+        return events
@@ -0,0 +1,233 @@
+# 批量语音活动检测引擎：一次对一整块音频帧做向量化打分
+import time
+from collections import deque
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:  # webrtcvad 不可用时只使用能量与频谱特征
+    webrtcvad = None
+
+
+def frame_energy(frames):
+    """每帧平均绝对幅度"""
+    return np.abs(frames.astype(np.float32)).mean(axis=1)
+
+
+def frame_features(frames):
+    """
+    对形状为 (帧数, 每帧采样数) 的 int16 数组批量计算特征
+
+    返回:
+        energy: 每帧平均绝对幅度
+        zcr: 每帧过零率（0~1）
+        flatness: 每帧频谱平坦度（0~1，噪声接近 1，浊音明显更低）
+    """
+    samples = frames.astype(np.float32)
+    energy = frame_energy(frames)
+
+    signs = np.signbit(frames)
+    zcr = (signs[:, 1:] != signs[:, :-1]).mean(axis=1)
+
+    window = np.hanning(frames.shape[1]).astype(np.float32)
+    power = np.abs(np.fft.rfft(samples * window, axis=1)) ** 2 + 1e-10
+    flatness = np.exp(np.log(power).mean(axis=1)) / power.mean(axis=1)
+
+    return energy, zcr, flatness
+
+
+class NoiseFloorTracker:
+    """
+    持续的噪声基底估计（最小值统计法）
+
+    先对帧能量做短时平滑，再取最近 window_seconds 内的最小值作为噪声基底。说话时总有
+    停顿，基底不会被语音抬高；电视等持续噪声出现后，一个窗口长度内基底就会升到新的噪声
+    水平，噪声消失后又会很快回落。
+
+    起始门限与结束门限分别为基底乘以 onset_ratio / offset_ratio（且不低于各自的下限），
+    起始门限更高，形成滞回，避免能量在门限附近抖动时反复触发。
+    """
+
+    def __init__(self, frame_ms=30, window_seconds=3.0, sub_windows=6, smoothing_seconds=0.1,
+                 onset_ratio=3.0, offset_ratio=2.0, min_onset=200.0, min_offset=120.0,
+                 history_interval=1.0, history_size=600):
+        self.frame_seconds = frame_ms / 1000
+        self.onset_ratio = onset_ratio
+        self.offset_ratio = offset_ratio
+        self.min_onset = min_onset
+        self.min_offset = min_offset
+
+        self._sub_window_frames = max(1, int(window_seconds / sub_windows / self.frame_seconds))
+        self._sub_minima = deque(maxlen=sub_windows)
+        self._current_min = np.inf
+        self._current_count = 0
+        self._alpha = 1 - np.exp(-self.frame_seconds / smoothing_seconds)
+        self._smoothed = None
+        self.floor = None
+
+        # 历史记录：每隔 history_interval 秒记录一次当前状态
+        self.history = deque(maxlen=history_size)
+        self._history_frames = max(1, int(history_interval / self.frame_seconds))
+        self._frames_since_history = 0
+
+    def thresholds(self):
+        """当前的 (起始门限, 结束门限)"""
+        floor = 0.0 if self.floor is None else self.floor
+        return max(self.min_onset, floor * self.onset_ratio), max(self.min_offset, floor * self.offset_ratio)
+
+    def state(self):
+        onset, offset = self.thresholds()
+        return {
+            "floor": float(self.floor or 0.0),
+            "onset_threshold": float(onset),
+            "offset_threshold": float(offset)
+        }
+
+    def update(self, energy):
+        """输入一块帧能量，返回每一帧对应的起始门限与结束门限数组"""
+        onset = np.empty(len(energy))
+        offset = np.empty(len(energy))
+        for i, value in enumerate(energy):
+            self._smoothed = value if self._smoothed is None else self._smoothed + self._alpha * (value - self._smoothed)
+            self._current_min = min(self._current_min, self._smoothed)
+            self._current_count += 1
+            if self._current_count >= self._sub_window_frames:
+                self._sub_minima.append(self._current_min)
+                self._current_min = np.inf
+                self._current_count = 0
+            self.floor = min(min(self._sub_minima, default=np.inf), self._current_min)
+            onset[i], offset[i] = self.thresholds()
+
+            self._frames_since_history += 1
+            if self._frames_since_history >= self._history_frames:
+                self._frames_since_history = 0
+                self.history.append({"time": time.time(), **self.state()})
+        return onset, offset
+
+
+class VADEngine:
+    """
+    向量化语音活动检测
+
+    每次传入一块连续的音频（可以包含任意多帧），先用 NumPy 一次性计算所有帧的能量
+    （不启用 webrtcvad 时还有过零率和频谱平坦度），再与 webrtcvad 的逐帧判决合并，最后用滑动窗口做平滑。
+    平滑状态在调用之间保留，因此实时逐帧调用和离线整段调用得到的结果完全一致。
+
+    判决规则:
+        能量超过 energy_threshold 是必要条件；传入 noise_tracker 时改用随噪声基底变化的
+        起始/结束门限（滞回）；
+        启用 webrtcvad 时再要求 webrtcvad 判为语音，否则要求过零率落在
+        [zcr_min, zcr_max] 且频谱平坦度低于 flatness_threshold；
+        平滑后窗口内语音帧占比超过 speech_ratio 才视为语音。
+    """
+
+    def __init__(self, rate=16000, frame_ms=30, energy_threshold=200.0,
+                 flatness_threshold=0.5, zcr_min=0.01, zcr_max=0.5,
+                 smoothing_window=10, speech_ratio=0.5, webrtc_aggressiveness=None,
+                 noise_tracker=None):
+        if frame_ms not in (10, 20, 30):
+            raise ValueError("frame_ms 只能是 10、20 或 30 毫秒")
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.frame_size = int(rate * frame_ms / 1000)
+        self.energy_threshold = energy_threshold
+        self.flatness_threshold = flatness_threshold
+        self.zcr_min = zcr_min
+        self.zcr_max = zcr_max
+        self.smoothing_window = smoothing_window
+        self.speech_ratio = speech_ratio
+        self.noise_tracker = noise_tracker
+
+        self.vad = None
+        if webrtc_aggressiveness is not None:
+            if webrtcvad is None:
+                print("未安装 webrtcvad，仅使用能量与频谱特征判决")
+            else:
+                self.vad = webrtcvad.Vad(webrtc_aggressiveness)
+
+        self.stats = {
+            "frames": 0,
+            "speech_frames": 0,
+            "webrtc_errors": 0
+        }
+        self.reset()
+
+    def reset(self):
+        """清空平滑状态，开始一段新的音频"""
+        self._history = np.zeros(0, dtype=np.int32)
+        self._energy_active = False
+
+    def _webrtc_flags(self, frames):
+        flags = np.zeros(len(frames), dtype=bool)
+        for i, frame in enumerate(frames):
+            try:
+                flags[i] = self.vad.is_speech(frame.tobytes(), self.rate)
+            except Exception as e:
+                # 帧长或采样率不符合 webrtcvad 要求时记录错误，按非语音处理
+                if self.stats["webrtc_errors"] == 0:
+                    print(f"webrtcvad 判决出错: {e}")
+                self.stats["webrtc_errors"] += 1
+        return flags
+
+    def _energy_gate(self, energy):
+        """能量门限：有噪声基底跟踪时使用滞回门限，处于语音中用较低的结束门限"""
+        if self.noise_tracker is None:
+            return energy > self.energy_threshold
+        onset, offset = self.noise_tracker.update(energy)
+        gate = np.empty(len(energy), dtype=bool)
+        active = self._energy_active
+        for i in range(len(energy)):
+            active = energy[i] > (offset[i] if active else onset[i])
+            gate[i] = active
+        self._energy_active = active
+        return gate
+
+    def _smooth(self, raw):
+        """滑动窗口平滑：窗口内语音帧占比超过 speech_ratio 视为语音"""
+        window = self.smoothing_window
+        extended = np.concatenate((self._history, raw.astype(np.int32)))
+        cumsum = np.concatenate(([0], np.cumsum(extended)))
+        ends = np.arange(len(self._history) + 1, len(extended) + 1)
+        starts = np.maximum(ends - window, 0)
+        ratios = (cumsum[ends] - cumsum[starts]) / (ends - starts)
+        self._history = extended[-(window - 1):] if window > 1 else extended[:0]
+        return ratios > self.speech_ratio
+
+    def score_block(self, samples):
+        """
+        对一块音频打分，samples 为 int16 数组或 PCM 字节，末尾不足一帧的采样会被忽略
+
+        返回 dict，每个值都是长度为帧数的数组:
+            energy: 每帧能量
+            zcr / flatness: 过零率与频谱平坦度，只在未启用 webrtcvad 时计算并返回
+            raw: 平滑前的逐帧判决
+            speech: 平滑后的判决
+        """
+        samples = np.frombuffer(samples, dtype=np.int16)
+        n_frames = len(samples) // self.frame_size
+        frames = samples[:n_frames * self.frame_size].reshape(n_frames, self.frame_size)
+        if n_frames == 0:
+            empty = np.zeros(0)
+            return {"energy": empty, "raw": empty.astype(bool), "speech": empty.astype(bool)}
+
+        if self.vad is not None:
+            # webrtcvad 负责判决，不需要频谱特征，省掉每块的 FFT
+            energy = frame_energy(frames)
+            raw = self._energy_gate(energy)
+            raw &= self._webrtc_flags(frames)
+            result = {"energy": energy}
+        else:
+            energy, zcr, flatness = frame_features(frames)
+            raw = self._energy_gate(energy)
+            raw &= (zcr >= self.zcr_min) & (zcr <= self.zcr_max) & (flatness < self.flatness_threshold)
+            result = {"energy": energy, "zcr": zcr, "flatness": flatness}
+        speech = self._smooth(raw)
+
+        self.stats["frames"] += n_frames
+        self.stats["speech_frames"] += int(speech.sum())
+        return {**result, "raw": raw, "speech": speech}
+
+    def process(self, pcm):
+        """离线处理一整段录音，返回逐帧的判决结果"""
+        self.reset()
+        return self.score_block(pcm)
@@ -1,50 +1,59 @@
-import webrtcvad
-import collections
-import pyaudio
 import os
 import wave
 import threading
 import queue
 import time
+import multiprocessing
 import numpy as np
-from collections import deque
+import async_runtime
+from audio_player import AsyncWavRecorder, as_pcm_buffer
+from audio_ring import AudioRingBuffer, SharedAudioRing
+from echo_suppressor import EchoSuppressor
+from vad_engine import VADEngine
+from endpointing import AdaptiveEndpointer
+from stage_queue import BoundedStageQueue
+from speech_gate import SpeechGate
+from idle_monitor import IdleMonitor
+from utterance_detector import UtteranceDetector
+from capture_process import run_capture_process
+from audio_engine import get_audio_engine
+from config import Config
 
 
 class WebRTCVADRecorder:
 
-    def __init__(self, rate=16000, aggressiveness=2):
+    def __init__(self, rate=16000, aggressiveness=2, audio_engine=None):
         self.rate = rate
-        self.vad = webrtcvad.Vad(aggressiveness)  # 0-3，3最激进
+        self.audio_engine = audio_engine
 
         # 参数配置
         self.frame_duration = 30  # 毫秒，webrtcvad要求10,20,30ms
         self.chunk = int(rate * self.frame_duration / 1000)  # 每帧采样数
-        self.silence_timeout = 2.0  # 静音超时（秒）
+
+        # webrtcvad 判决 + 10帧滑动窗口平滑（窗口内超过一半为语音才算语音）
+        self.vad_engine = VADEngine(rate=rate, frame_ms=self.frame_duration, energy_threshold=0,
+                                    smoothing_window=10, speech_ratio=0.5,
+                                    webrtc_aggressiveness=aggressiveness)  # 0-3，3最激进
+        self.silence_timeout = 2.0  # 最长静音超时（秒），实际等待由端点检测器动态决定
+        self.endpointer = AdaptiveEndpointer(frame_ms=self.frame_duration, max_silence=self.silence_timeout)
         self.min_recording_duration = 1.0  # 最小录音时长（秒）
 
-        self.format = pyaudio.paInt16
         self.channels = 1
 
-    def record_until_silence(self, filename="user_audio.wav"):
-        """使用WebRTC VAD进行智能录音"""
-        p = pyaudio.PyAudio()
+    def record_until_silence(self, filename=None):
+        """使用WebRTC VAD进行智能录音，返回内存中的 PCM 数据；指定 filename 时另存为 WAV 并返回文件名"""
+        engine = self.audio_engine or get_audio_engine(enable_input=True)
+        frames_queue = queue.Queue()
+        # 订阅常开输入流的采集数据，不再单独打开麦克风
+        engine.subscribe(frames_queue.put)
 
         try:
-            stream = p.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.rate,
-                input=True,
-                frames_per_buffer=self.chunk,
-                input_device_index=1
-            )
-
             print("开始智能录音（WebRTC VAD）...")
             frames = []
             voiced_frames = []
-            ring_buffer = collections.deque(maxlen=10)  # 用于平滑检测
+            self.vad_engine.reset()
 
-            silence_frames_threshold = int(self.silence_timeout * 1000 / self.frame_duration)
+            frame_seconds = self.frame_duration / 1000
             min_frames = int(self.min_recording_duration * 1000 / self.frame_duration)
 
             silence_frames = 0
@@ -52,24 +61,17 @@ class WebRTCVADRecorder:
             is_recording = False
 
             while True:
-                data = stream.read(self.chunk, exception_on_overflow=False)
-
-                # 使用VAD检测语音活动
-                try:
-                    is_speech = self.vad.is_speech(data, self.rate)
-                except:
-                    is_speech = False
+                data = frames_queue.get(timeout=1)
 
-                ring_buffer.append(1 if is_speech else 0)
-
-                # 使用滑动窗口判断（减少误判）
-                speech_ratio = sum(ring_buffer) / len(ring_buffer)
-                is_voiced = speech_ratio > 0.5
+                # 使用VAD检测语音活动（平滑状态由引擎增量维护）
+                speech = self.vad_engine.score_block(data)["speech"]
+                is_voiced = bool(speech[-1]) if len(speech) else False
 
                 if is_voiced:
                     if not is_recording:
                         print("检测到语音，开始录音...")
                         is_recording = True
+                        self.endpointer.start()
                     silence_frames = 0
                     voiced_frames.append(data)
                 else:
@@ -79,12 +81,15 @@ class WebRTCVADRecorder:
                 if is_recording:
                     frames.append(data)
                     total_frames += 1
+                    self.endpointer.observe(is_voiced, np.abs(np.frombuffer(data, dtype=np.int16)).mean())
 
                     # 检查停止条件
-                    if (silence_frames >= silence_frames_threshold and
+                    if (silence_frames > 0 and
+                            silence_frames * frame_seconds >= self.endpointer.required_silence() and
                             len(voiced_frames) >= min_frames):
                         duration = total_frames * self.frame_duration / 1000
                         print(f"检测到持续静音，停止录音。录音时长: {duration:.2f}秒")
+                        self.endpointer.finish()
                         break
 
                 # 安全限制
@@ -92,16 +97,20 @@ class WebRTCVADRecorder:
                     print("达到最大录音时长，自动停止")
                     break
 
-            stream.stop_stream()
-            stream.close()
+            engine.unsubscribe(frames_queue.put)
 
-            # 保存音频文件
             if frames:
+                pcm = b''.join(frames)
+                if filename is None:
+                    print(f"智能录音完成, 大小: {len(pcm)} 字节")
+                    return pcm
+
+                # 保存音频文件
                 wf = wave.open(filename, 'wb')
                 wf.setnchannels(self.channels)
-                wf.setsampwidth(p.get_sample_size(self.format))
+                wf.setsampwidth(2)  # 16-bit
                 wf.setframerate(self.rate)
-                wf.writeframes(b''.join(frames))
+                wf.writeframes(pcm)
                 wf.close()
 
                 file_size = os.path.getsize(filename)
@@ -111,17 +120,21 @@ class WebRTCVADRecorder:
                 print("没有录制到音频")
                 return None
 
+        except queue.Empty:
+            print("智能录音过程中出错: 读取音频数据超时")
+            return None
         except Exception as e:
             print(f"智能录音过程中出错: {e}")
             return None
         finally:
-            p.terminate()
+            engine.unsubscribe(frames_queue.put)
 
 
 class RealTimeVoiceMonitor:
     def __init__(self, companion_instance, rate=16000, chunk=480,
                  silence_threshold=200, min_silence_duration=1.5,
-                 max_single_utterance=10.0):
+                 max_single_utterance=10.0, vad_aggressiveness=2, endpointer=None, barge_in=True,
+                 capture_mode=None, audio_engine=None, echo_suppression=None):
         """
         实时语音监控器
 
@@ -129,214 +142,366 @@ class RealTimeVoiceMonitor:
             companion_instance: 陪伴机器人实例
             rate: 采样率
             chunk: 每次读取的音频块大小（推荐480，对应30ms，适合VAD）
-            silence_threshold: 静音阈值
-            min_silence_duration: 最小静音持续时间（秒）
+            silence_threshold: 静音阈值下限（实际门限随环境噪声基底持续自适应，不会低于该值）
+            min_silence_duration: 判定语音结束的最长静音等待时间（秒），实际等待由端点检测器动态决定
             max_single_utterance: 单次说话最大时长（秒）
+            vad_aggressiveness: webrtcvad 激进程度（0-3），None 表示只用能量与频谱特征
+            endpointer: 端点检测器（见 endpointing.py），默认使用 AdaptiveEndpointer
+            barge_in: 是否允许用户在机器人回复期间插话打断
+            capture_mode: thread 或 process，默认取 Config.CAPTURE_MODE；process 模式下采集与检测在独立进程中运行
+            audio_engine: 使用的音频引擎，默认为全局音频引擎（开始监听时才打开设备）
+            echo_suppression: 是否以播放中的回复音频为参考做回声抑制，默认取 Config.ECHO_SUPPRESSION
         """
         self.companion = companion_instance
         self.rate = rate
         self.chunk = chunk
-        self.silence_threshold = silence_threshold
         self.min_silence_duration = min_silence_duration
         self.max_single_utterance = max_single_utterance
 
-        self.format = pyaudio.paInt16
         self.channels = 1
 
+        # 语音段检测（VAD + 噪声基底 + 端点检测）
+        self._detector_kwargs = {
+            "silence_threshold": silence_threshold,
+            "min_silence_duration": min_silence_duration,
+            "max_single_utterance": max_single_utterance,
+            "vad_aggressiveness": vad_aggressiveness,
+            "endpointer": endpointer
+        }
+        self.detector = UtteranceDetector(rate=rate, chunk=chunk, **self._detector_kwargs)
+        self.noise_tracker = self.detector.noise_tracker
+        self.vad_engine = self.detector.vad_engine
+        self.endpointer = self.detector.endpointer
+        self.max_batch_frames = 32  # 检测线程一次最多处理的积压帧数
+
+        # 识别前的语音段过滤：录音期间攒够人声证据才启动识别器，结束时仍不像人声的语音段直接丢弃
+        self.speech_gate = SpeechGate(rate=rate, frame_ms=int(chunk * 1000 / rate),
+                                      threshold=Config.SPEECH_GATE_THRESHOLD)
+        self._gate_open = False
+        self._utterance_start = 0
+        self._gate_fed_until = 0
+
+        # 采集与检测的运行方式: thread（与主流程同一进程）/ process（独立进程 + 共享内存环形缓冲区）
+        self.capture_mode = capture_mode or Config.CAPTURE_MODE
+        self.audio_engine = audio_engine
+        self._capture_process = None
+        self._event_conn = None
+        self._text_conn = None
+        self._stop_event = None
+
         # 状态控制
         self.is_listening = False
         self.is_processing = False
-        self.current_state = "idle"  # idle, detecting, recording, processing
-
-        # 音频缓冲区
-        self.audio_buffer = deque(maxlen=int(rate * 2 / chunk))  # 保存2秒音频用于预触发
-        self.current_recording = []
-
-        # 线程和队列
-        self.audio_queue = queue.Queue()
-        self.processing_queue = queue.Queue()
+        self.current_state = "idle"  # idle, sleeping, recording, processing
+        # 状态变化时依次调用 listener(state)，默认打印状态行
+        self.state_listeners = [self._print_status]
+        self._sleeping = False
+
+        # 插话打断：每次打断递增轮次编号，编号落后的语音段视为过期
+        self.barge_in = barge_in
+        self.turn_generation = 0
+
+        # 音频缓冲区：预分配的环形缓冲区，语音段以 (start, end) 采样序号表示
+        # process 模式在启动监听时换成共享内存环形缓冲区
+        self.ring_capacity_seconds = 60
+        self.ring_buffer = AudioRingBuffer(rate=rate, capacity_seconds=self.ring_capacity_seconds)
+
+        # 低功耗待机（thread 模式；process 模式由采集进程自己待机）
+        self.idle_monitor = IdleMonitor(self.ring_buffer, self._enqueue_capture_frame, rate=rate, chunk=chunk,
+                                        idle_after_seconds=Config.IDLE_AFTER_SECONDS,
+                                        decimation=Config.IDLE_DECIMATION)
+
+        # 回声抑制：音频引擎把实际播放的音频（采集采样率）写入参考环形缓冲区，检测前先从麦克风信号中减掉
+        # process 模式在启动监听时换成共享内存参考缓冲区，由采集进程做抑制
+        if echo_suppression is None:
+            echo_suppression = Config.ECHO_SUPPRESSION
+        self.reference_capacity_seconds = 2
+        self.reference_ring = None
+        self.echo_suppressor = None
+        if echo_suppression:
+            self.reference_ring = AudioRingBuffer(rate=rate, capacity_seconds=self.reference_capacity_seconds)
+            self.echo_suppressor = EchoSuppressor(self.reference_ring, rate=rate, frame_size=chunk,
+                                                  max_delay_ms=Config.ECHO_MAX_DELAY_MS)
+
+        # 流式识别：录音开始即把音频送入识别器，_fed_until 为已送入的采样序号；
+        # 语音结束时立即开始取最终结果，处理线程最多等待 transcript_timeout 秒
+        self.current_recognizer = None
+        self.transcript_timeout = 10.0
+        self.current_partial_text = ""
+        self._fed_until = 0
+
+        # 线程和队列：各阶段之间都是有界队列，下游卡住时按溢出策略丢弃或合并，不会无限堆积
+        self.audio_queue = BoundedStageQueue("capture", *Config.CAPTURE_QUEUE)
+        self.processing_queue = BoundedStageQueue("utterance", *Config.UTTERANCE_QUEUE,
+                                                  coalesce=self._coalesce_utterances,
+                                                  on_drop=self._on_utterance_dropped)
 
         # 统计信息
         self.stats = {
             "total_detections": 0,
             "processed_utterances": 0,
-            "last_activity_time": time.time()
+            "last_activity_time": time.time(),
+            "barge_ins": 0,
+            "dropped_turns": 0,
+            "input_overflows": 0,
+            "echo": dict(self.echo_suppressor.stats) if self.echo_suppressor else {},
+            "speech_gate": self.speech_gate.stats,
+            "idle": self.idle_monitor.stats,
+            "noise_floor": self.noise_tracker.state(),
+            "noise_floor_history": self.noise_tracker.history
         }
 
-    def calculate_energy(self, audio_data):
-        """计算音频能量 - 稳定版本"""
-        try:
-            audio_array = np.frombuffer(audio_data, dtype=np.int16)
-            if len(audio_array) == 0:
-                return 0
-
-            # 使用绝对值的平均值，避免平方根问题
-            # 这种方法对静音帧更稳定，计算开销也更小
-            energy = np.mean(np.abs(audio_array))
-            return energy
-
-        except Exception as e:
-            print(f"计算能量时出错: {e}")
-            return 0
-
-    def auto_calibrate_threshold(self, calibration_seconds=3):
-        """自动校准静音阈值"""
-        print("正在进行环境噪音校准，请保持安静...")
-
-        p = pyaudio.PyAudio()
-        try:
-            stream = p.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.rate,
-                input=True,
-                frames_per_buffer=self.chunk,
-                input_device_index=1
-            )
-
-            energies = []
-            total_frames = int(self.rate * calibration_seconds / self.chunk)
-
-            for i in range(total_frames):
-                data = stream.read(self.chunk, exception_on_overflow=False)
-                energy = self.calculate_energy(data)
-                energies.append(energy)
+    @property
+    def silence_threshold(self):
+        """当前的语音起始门限（随噪声基底变化）"""
+        return self.stats["noise_floor"]["onset_threshold"]
 
-            avg_energy = np.mean(energies)
-            std_energy = np.std(energies)
+    def _on_capture_frame(self, data):
+        """音频引擎回调线程：待机时只做抽样能量检查，否则放入采集队列，不做任何耗时处理"""
+        self.idle_monitor.feed(data)
 
-            # 设置阈值为平均值加上2倍标准差
-            new_threshold = avg_energy + 2 * std_energy
-            # 确保阈值至少为400
-            new_threshold = max(400, new_threshold)
+    def _enqueue_capture_frame(self, data):
+        self.audio_queue.put(data)
 
-            print(f"环境噪音水平: {avg_energy:.2f} ± {std_energy:.2f}")
-            print(f"自动设置静音阈值: {new_threshold:.2f}")
-
-            self.silence_threshold = new_threshold
-
-            stream.stop_stream()
-            stream.close()
-            return new_threshold
-
-        except Exception as e:
-            print(f"校准过程中出错: {e}")
+    def _drain_capture_queue(self):
+        """取出采集队列中尚未检测的帧"""
+        frames = []
+        while True:
+            try:
+                frames.append(self.audio_queue.get_nowait())
+            except queue.Empty:
+                return frames
+
+    def _set_state(self, state):
+        """切换状态并通知所有 listener（只在状态变化时通知）"""
+        if state == self.current_state:
+            return
+        self.current_state = state
+        for listener in self.state_listeners:
+            try:
+                listener(state)
+            except Exception as e:
+                print(f"状态通知出错: {e}")
+
+    def _idle_state(self):
+        """空闲时的状态：采集处于低功耗待机则为 sleeping"""
+        return "sleeping" if self._sleeping else "idle"
+
+    def _print_status(self, state):
+        """默认的状态 listener：打印状态行"""
+        status_info = {
+            "idle": "🟢 监听中 - 等待语音",
+            "sleeping": "🔵 待机中 - 有声音时自动唤醒",
+            "recording": "🔴 录音中 - 请继续说话",
+            "processing": "🟣 处理中 - 生成回复"
+        }
+        status_emoji = status_info.get(state, "⚪ 未知状态")
+        stats_text = f"检测: {self.stats['total_detections']}次, 处理: {self.stats['processed_utterances']}次"
+        print(f"{status_emoji} | {stats_text} | 按Ctrl+C退出", flush=True)
+
+    def _on_playback_frame(self, data):
+        """音频引擎输出回调线程：实际播放的音频写入回声参考缓冲区"""
+        self.reference_ring.write(data)
+
+    def _start_recognizer(self, pre_roll):
+        """语音开始时创建流式识别器，并补送预触发区间的音频"""
+        factory = getattr(self.companion, 'create_streaming_recognizer', None)
+        recognizer = factory() if factory else None
+        if recognizer is None:
             return None
-        finally:
-            p.terminate()
+        self.current_partial_text = ""
+        recognizer.start(on_partial=self._on_partial_text)
+        recognizer.feed(as_pcm_buffer(pre_roll))
+        return recognizer
+
+    def _on_partial_text(self, text):
+        """流式识别的中间结果"""
+        self.current_partial_text = text
+
+    @staticmethod
+    def _cancel_recognizer(recognizer):
+        """取消识别器：取消要等服务端确认，交给共享线程池，不阻塞检测线程或持有队列锁的调用方"""
+        if recognizer is not None:
+            async_runtime.submit_blocking(recognizer.cancel)
+
+    def _finish_recognizer(self):
+        """语音段结束：在共享线程池中向识别器要最终结果，返回 Future（没有流式识别器时为 None）"""
+        recognizer, self.current_recognizer = self.current_recognizer, None
+        if recognizer is None:
+            return None
+        return async_runtime.submit_blocking(recognizer.finish)
+
+    @staticmethod
+    def _discard_transcript(utterance):
+        """放弃排队语音段的识别结果；已经在取结果的识别会自行结束，结果不再使用"""
+        if utterance["transcript"] is not None:
+            utterance["transcript"].cancel()
+
+    @staticmethod
+    def _coalesce_utterances(queued, new):
+        """合并两段排队的语音：区间覆盖两段，识别结果以整段重新识别为准"""
+        for utterance in (queued, new):
+            RealTimeVoiceMonitor._discard_transcript(utterance)
+        return {
+            "start": queued["start"],
+            "end": new["end"],
+            "transcript": None,
+            "generation": new["generation"]
+        }
 
-    def audio_capture_thread(self):
-        """音频捕获线程 - 持续从麦克风读取数据"""
-        p = pyaudio.PyAudio()
+    def _on_utterance_dropped(self, utterance):
+        """排队的语音段被丢弃时放弃其识别结果"""
+        print("处理跟不上，丢弃最早排队的语音段")
+        self._discard_transcript(utterance)
 
+    def _await_transcript(self, utterance):
+        """等待语音段结束时已经开始获取的最终识别结果，失败或超时返回 None"""
+        if utterance["transcript"] is None:
+            return None
         try:
-            stream = p.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.rate,
-                input=True,
-                frames_per_buffer=self.chunk,
-                input_device_index=1
-            )
-
-            print("音频捕获线程启动 - 开始持续监听...")
-
-            while self.is_listening:
-                try:
-                    data = stream.read(self.chunk, exception_on_overflow=False)
-                    self.audio_queue.put(data)
-                except Exception as e:
-                    print(f"音频捕获错误: {e}")
-                    time.sleep(0.1)
-
-            stream.stop_stream()
-            stream.close()
-
+            return utterance["transcript"].result(timeout=self.transcript_timeout)
         except Exception as e:
-            print(f"音频捕获线程错误: {e}")
-        finally:
-            p.terminate()
+            print(f"获取流式识别结果失败: {e}")
+            utterance["transcript"].cancel()
+            return None
+
+    def stage_stats(self):
+        """各阶段队列的深度与丢弃统计"""
+        stages = {"utterance": self.processing_queue.stats.snapshot()}
+        if self.capture_mode != "process":
+            # process 模式下采集直接写入共享内存，没有采集队列
+            stages["capture"] = self.audio_queue.stats.snapshot()
+        turn_engine = getattr(self.companion, 'turn_engine', None)
+        if turn_engine is not None:
+            stages["sentence"] = turn_engine.sentence_stats.snapshot()
+        sink = getattr(self.companion, 'playback_sink', None)
+        if sink is not None:
+            stages["playback"] = sink.buffer_stats()
+        return stages
+
+    def _barge_in(self):
+        """用户在机器人处理或播报期间开口：立即打断当前回复，排队中的旧语音段一并作废"""
+        self.turn_generation += 1
+        turn_engine = getattr(self.companion, 'turn_engine', None)
+        if turn_engine is None or not turn_engine.interrupt():
+            # 没有流式对话引擎（或尚未开始回复）时至少停止播放
+            sink = getattr(self.companion, 'playback_sink', None)
+            if sink is not None:
+                sink.stop()
+        self.stats["barge_ins"] += 1
+        print("检测到用户插话，打断当前回复")
+
+    def _is_stale(self, utterance):
+        """语音段入队之后发生过插话打断，说明用户已经开始了新的一轮"""
+        return utterance["generation"] != self.turn_generation
+
+    def _feed_recognizer(self, end):
+        """把 [_fed_until, end) 之间的音频送入当前的流式识别器"""
+        if self.current_recognizer is not None and end > self._fed_until:
+            self.current_recognizer.feed(as_pcm_buffer(self.ring_buffer.view(self._fed_until, end)))
+        self._fed_until = max(self._fed_until, end)
+
+    def _open_gate(self, end):
+        """确认是人声：需要时打断当前回复，并启动流式识别（补送语音段开始以来的音频）"""
+        self._gate_open = True
+        if self.barge_in and self.is_processing:
+            self._barge_in()
+        self.current_recognizer = self._start_recognizer(self.ring_buffer.view(self._utterance_start, end))
+        self._fed_until = end
+
+    def _gate_threshold(self):
+        """语音段过滤只看超过结束门限的活动帧"""
+        return self.stats["noise_floor"]["offset_threshold"]
+
+    def _feed_gate(self, end):
+        """把 [_gate_fed_until, end) 之间的新音频加入语音段过滤的累计特征"""
+        if end > self._gate_fed_until:
+            self.speech_gate.add(self.ring_buffer.view(self._gate_fed_until, end), self._gate_threshold())
+        self._gate_fed_until = max(self._gate_fed_until, end)
+
+    def _handle_detection_events(self, events):
+        """处理语音段起止事件（线程模式来自检测线程，进程模式来自采集进程），并把新音频送入识别器"""
+        for event in events:
+            if event["type"] == "onset":
+                self._set_state("recording")
+                self.stats["total_detections"] += 1
+                self._utterance_start = event["start"]
+                self._gate_open = False
+                self._fed_until = event["end"]
+                self.speech_gate.reset()
+                self._gate_fed_until = event["start"]
+                self._feed_gate(event["end"])
+
+                # 过滤关闭或已有足够人声证据时立即启动流式识别，边录边识别
+                if self.speech_gate.is_speech():
+                    self._open_gate(event["end"])
+
+            elif event["type"] == "end":
+                if self._gate_open:
+                    self.speech_gate.record_early_pass()
+                else:
+                    self._feed_gate(event["end"])
+                    accepted, confidence = self.speech_gate.check()
+                    if not accepted:
+                        # 咳嗽、关门声等非语音，不调用识别，也不打断当前回复
+                        print(f"不像人声（置信度 {confidence:.2f}），跳过识别")
+                        self._set_state("processing" if self.is_processing else self._idle_state())
+                        continue
+                    self._open_gate(event["end"])
+                self._gate_open = False
+                self._feed_recognizer(event["end"])
+
+                # 端点处立即向流式识别器要最终结果，连同语音段的采样区间放入处理队列，不拷贝音频
+                self.processing_queue.put({
+                    "start": event["start"],
+                    "end": event["end"],
+                    "transcript": self._finish_recognizer(),
+                    "generation": self.turn_generation
+                })
+                self._set_state("processing")
+
+        if self.current_state == "recording" and not self._gate_open:
+            # 录音中：只累计新到的帧，攒够人声证据后再启动识别器
+            end = self.ring_buffer.total_written
+            self._feed_gate(end)
+            if self.speech_gate.is_speech():
+                self._open_gate(end)
+        self._feed_recognizer(self.ring_buffer.total_written)
 
     def voice_detection_thread(self):
         """语音检测线程 - 实时检测语音活动"""
         print("语音检测线程启动 - 等待语音活动...")
 
-        silence_frames_threshold = int(self.min_silence_duration * self.rate / self.chunk)
-        max_recording_frames = int(self.max_single_utterance * self.rate / self.chunk)
-
-        silence_frames = 0
-        is_recording = False
-        recording_start_time = 0
-        recording_frames = 0
-
-        # 预触发缓冲区（保存语音开始前0.5秒的音频）
-        pre_trigger_buffer = deque(maxlen=int(0.5 * self.rate / self.chunk))
-
         while self.is_listening:
             try:
-                # 从队列获取音频数据（阻塞，最多等待100ms）
-                data = self.audio_queue.get(timeout=0.1)
-
-                # 更新预触发缓冲区
-                pre_trigger_buffer.append(data)
-
-                # 计算能量
-                energy = self.calculate_energy(data)
-
-                if is_recording:
-                    # 录音状态
-                    self.current_recording.append(data)
-                    recording_frames += 1
-
-                    # 检查能量水平
-                    if energy <= self.silence_threshold:
-                        silence_frames += 1
-                    else:
-                        silence_frames = 0
-
-                    # 检查停止条件
-                    current_time = time.time()
-                    recording_duration = current_time - recording_start_time
-
-                    # 条件1: 持续静音超过阈值
-                    condition1 = silence_frames >= silence_frames_threshold
-                    # 条件2: 达到最大录音时长
-                    condition2 = recording_duration >= self.max_single_utterance
-                    # 条件3: 录音帧数过多
-                    condition3 = recording_frames >= max_recording_frames
-
-                    if condition1 or condition2 or condition3:
-                        # 停止录音，准备处理
-                        print(f"语音结束，录音时长: {recording_duration:.2f}秒")
-
-                        # 将完整的录音数据放入处理队列
-                        full_recording = list(pre_trigger_buffer) + self.current_recording
-                        self.processing_queue.put(full_recording)
-
-                        # 重置状态
-                        is_recording = False
-                        self.current_recording = []
-                        silence_frames = 0
-                        recording_frames = 0
-                        self.current_state = "processing"
-
-                    # 实时显示录音状态
-                    if recording_frames % 10 == 0:  # 每10帧显示一次
-                        print(f"录音中... {recording_duration:.1f}秒, 能量: {energy:.1f}")
-
-                else:
-                    # 检测状态 - 等待语音开始
-                    if energy > self.silence_threshold:
-                        # 检测到语音活动，开始录音
-                        print("检测到语音活动，开始录音...")
-                        is_recording = True
-                        recording_start_time = time.time()
-                        self.current_state = "recording"
-                        self.stats["total_detections"] += 1
+                # 从队列获取音频数据（阻塞，最多等待100ms），并顺带取走已积压的帧
+                frames = [self.audio_queue.get(timeout=0.1)]
+                while len(frames) < self.max_batch_frames:
+                    try:
+                        frames.append(self.audio_queue.get_nowait())
+                    except queue.Empty:
+                        break
 
-                        # 保存当前预触发缓冲区
-                        self.current_recording = list(pre_trigger_buffer)
-                        recording_frames = len(pre_trigger_buffer)
+                # 原始音频写入环形缓冲区（识别用），后续只通过采样序号引用这段音频；
+                # 回声抑制后的信号只用于检测打分，谱减的分帧痕迹不会进入识别
+                block = np.concatenate([np.frombuffer(data, dtype=np.int16) for data in frames])
+                block_start, _ = self.ring_buffer.write(block)
+                scored = None
+                if self.echo_suppressor is not None:
+                    scored = self.echo_suppressor.process(block, self.noise_tracker.state()["onset_threshold"])
+                    self.stats["echo"] = dict(self.echo_suppressor.stats)
+
+                # 整块向量化打分（同时更新噪声基底）并判定语音段起止
+                events = self.detector.process_block(self.ring_buffer, block_start, frames,
+                                                     self.current_partial_text, samples=scored)
+                self.stats["noise_floor"] = self.noise_tracker.state()
+                self.stats["input_overflows"] = self.audio_engine.stats["input_overflows"]
+                self._handle_detection_events(events)
+
+                # 持续安静（没有语音活动、也没有在处理 / 播放回复）时进入低功耗待机
+                active = self.detector.is_recording or bool(events) or self._reply_active()
+                if self.idle_monitor.observe(len(block), active):
+                    self._sleep_until_wake()
 
             except queue.Empty:
                 # 队列为空，继续循环
@@ -345,74 +510,191 @@ class RealTimeVoiceMonitor:
                 print(f"语音检测错误: {e}")
                 time.sleep(0.1)
 
+    def _sleep_until_wake(self):
+        """低功耗待机：检测线程阻塞到有声音为止，唤醒后补做唤醒前一段音频的检测"""
+        self.idle_monitor.enter(self.noise_tracker.state()["offset_threshold"], self._drain_capture_queue)
+        self._sleeping = True
+        self._set_state("sleeping")
+        woken = self.idle_monitor.wait()
+        self._sleeping = False
+        if woken is None or not self.is_listening:
+            return
+        self._set_state("idle")
+        # 唤醒前的音频同样先做回声抑制再打分，参考信号按它落后于最新采集的长度对齐
+        block_start, frames = woken
+        scored = None
+        if self.echo_suppressor is not None:
+            block = self.ring_buffer.view(block_start, block_start + len(frames) * self.chunk)
+            scored = self.echo_suppressor.process(
+                block, self.noise_tracker.state()["onset_threshold"],
+                lag_samples=self.ring_buffer.total_written - block_start - len(block))
+        events = self.detector.process_block(self.ring_buffer, block_start, frames, self.current_partial_text,
+                                             samples=scored)
+        self._handle_detection_events(events)
+
+    def _reply_active(self):
+        """正在处理回复，或播放输出里还有没播完的回复音频"""
+        if self.is_processing:
+            return True
+        sink = getattr(self.companion, 'playback_sink', None)
+        return sink is not None and sink.buffer_stats()["buffered_ms"] > 0
+
+    def capture_event_thread(self):
+        """进程模式：接收采集进程发来的事件，驱动流式识别与处理队列"""
+        print("采集事件线程启动 - 等待语音活动...")
+        sent_text = ""
+        sent_reply = False
+
+        while self.is_listening:
+            try:
+                events = []
+                # 流式识别进行中时频繁同步中间结果，其余时间只在有事件时醒来
+                if self._event_conn.poll(0.03 if self.current_recognizer is not None else 0.5):
+                    while self._event_conn.poll():
+                        message = self._event_conn.recv()
+                        if message["type"] == "stats":
+                            self.stats["noise_floor"] = message["noise_floor"]
+                            self.stats["input_overflows"] = message["input_overflows"]
+                            self.stats["echo"] = message["echo"]
+                            self.stats["idle"] = message["idle"]
+                            self.stats["noise_floor_history"].append({"time": time.time(), **message["noise_floor"]})
+                        elif message["type"] in ("sleep", "wake"):
+                            # 采集进程进入 / 退出低功耗待机
+                            self._sleeping = message["type"] == "sleep"
+                            if self.current_state in ("idle", "sleeping"):
+                                self._set_state(self._idle_state())
+                        else:
+                            events.append(message)
+                self._handle_detection_events(events)
+
+                # 把最新的识别中间结果（供端点检测使用）和回复状态（处理 / 播放期间不进入待机）同步给采集进程
+                if self.current_partial_text != sent_text:
+                    sent_text = self.current_partial_text
+                    self._text_conn.send({"type": "partial", "text": sent_text})
+                if self._reply_active() != sent_reply:
+                    sent_reply = not sent_reply
+                    self._text_conn.send({"type": "reply", "active": sent_reply})
+
+            except (EOFError, BrokenPipeError):
+                print("采集进程已退出")
+                break
+            except Exception as e:
+                print(f"采集事件处理错误: {e}")
+                time.sleep(0.1)
+
+    def _start_capture_process(self):
+        """创建共享内存环形缓冲区并启动采集进程"""
+        ctx = multiprocessing.get_context("spawn")
+        self.ring_buffer = SharedAudioRing(rate=self.rate, capacity_seconds=self.ring_capacity_seconds)
+        if self.reference_ring is not None:
+            self.reference_ring = SharedAudioRing(rate=self.rate, capacity_seconds=self.reference_capacity_seconds)
+        self._event_conn, child_event_conn = ctx.Pipe(duplex=False)
+        child_text_conn, self._text_conn = ctx.Pipe(duplex=False)
+        self._stop_event = ctx.Event()
+        self._capture_process = ctx.Process(
+            target=run_capture_process,
+            args=(self.ring_buffer.name, self.rate, self.chunk, self.ring_capacity_seconds,
+                  self._detector_kwargs, child_event_conn, child_text_conn, self._stop_event),
+            kwargs={"reference_name": self.reference_ring.name if self.reference_ring is not None else None,
+                    "reference_capacity_seconds": self.reference_capacity_seconds,
+                    "echo_max_delay_ms": Config.ECHO_MAX_DELAY_MS,
+                    "idle_after_seconds": Config.IDLE_AFTER_SECONDS,
+                    "idle_decimation": Config.IDLE_DECIMATION},
+            name="audio-capture",
+            daemon=True
+        )
+        self._capture_process.start()
+
+    def _stop_capture_process(self):
+        """停止采集进程并释放共享内存"""
+        if self._capture_process is None:
+            return
+        self._stop_event.set()
+        self._capture_process.join(timeout=2)
+        if self._capture_process.is_alive():
+            self._capture_process.terminate()
+        self._capture_process = None
+        self.ring_buffer.close()
+        if self.reference_ring is not None:
+            self.reference_ring.close()
+
     def processing_thread(self):
         """处理线程 - 处理检测到的语音"""
         print("处理线程启动 - 等待处理任务...")
 
-        temp_audio_dir = "temp_audio"
-        os.makedirs(temp_audio_dir, exist_ok=True)
-
         while self.is_listening:
             try:
                 # 从处理队列获取录音数据（阻塞）
-                audio_frames = self.processing_queue.get(timeout=1)
+                utterance = self.processing_queue.get(timeout=1)
 
-                if audio_frames is None:  # 退出信号
+                if utterance is None:  # 退出信号
                     break
 
                 print("开始处理检测到的语音...")
                 self.is_processing = True
-
-                # 保存临时音频文件
-                timestamp = int(time.time())
-                audio_filename = os.path.join(temp_audio_dir, f"utterance_{timestamp}.wav")
-
-                # 保存音频文件
-                p = pyaudio.PyAudio()
-                wf = wave.open(audio_filename, 'wb')
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(p.get_sample_size(self.format))
-                wf.setframerate(self.rate)
-                wf.writeframes(b''.join(audio_frames))
-                wf.close()
-                p.terminate()
-
-                # 语音转文本
+                # 拷贝一份：整段识别与调试落盘可能在很久之后才读，期间检测线程仍在写环形缓冲区；
+                # 拷贝后再确认一次拷贝期间没有被覆盖
+                audio_pcm = None
+                if not self._is_stale(utterance) and self.ring_buffer.is_available(utterance["start"]):
+                    audio_pcm = self.ring_buffer.view(utterance["start"], utterance["end"]).copy()
+                if audio_pcm is None or not self.ring_buffer.is_available(utterance["start"]):
+                    # 已被插话打断的旧轮次，或排队太久、音频已被新的采集数据覆盖
+                    print("语音段已过期，跳过处理")
+                    self._discard_transcript(utterance)
+                    self.stats["dropped_turns"] += 1
+                    self.is_processing = False
+                    self._set_state(self._idle_state())
+                    continue
+
+                if Config.DEBUG_AUDIO_DIR:
+                    # 调试用：在后台线程中把本段语音另存为 WAV
+                    recorder = AsyncWavRecorder(
+                        os.path.join(Config.DEBUG_AUDIO_DIR, f"utterance_{int(time.time())}.wav"),
+                        rate=self.rate, channels=self.channels)
+                    recorder.write(audio_pcm.tobytes())
+                    recorder.close()
+
+                # 语音转文本：流式识别在录音期间已完成大部分工作，最终结果在语音结束时就已开始获取
                 print("正在进行语音识别...")
-                user_text = self.companion.speech_to_text(audio_filename)
+                user_text = self._await_transcript(utterance)
+
+                if user_text is None:
+                    # 未启用流式识别或流式识别失败，直接用内存中的 PCM 整段识别
+                    user_text = self.companion.speech_to_text(audio_pcm, rate=self.rate)
 
-                if user_text and isinstance(user_text, str) and len(user_text.strip()) > 0:
+                if self._is_stale(utterance):
+                    # 识别期间用户又开口了，本段交给新的一轮
+                    print("识别期间用户插话，放弃本轮回复")
+                    self.stats["dropped_turns"] += 1
+                elif user_text and isinstance(user_text, str) and len(user_text.strip()) > 0:
                     print(f"识别结果: {user_text}")
 
-                    # 调用大模型生成回复
-                    print("生成回复...")
-                    if hasattr(self.companion, 'call_bailian_api_with_memory'):
-                        response_text = self.companion.call_bailian_api_with_memory(user_text)
+                    turn_engine = getattr(self.companion, 'turn_engine', None)
+                    if turn_engine is not None:
+                        # 流式对话：边生成、边合成、边播放
+                        print("生成回复（流式）...")
+                        response_text = turn_engine.run_turn(user_text)
+                        print(f"AI回复: {response_text}")
                     else:
-                        response_text = self.companion.call_bailian_api(user_text)
+                        # 调用大模型生成回复
+                        print("生成回复...")
+                        if hasattr(self.companion, 'call_bailian_api_with_memory'):
+                            response_text = self.companion.call_bailian_api_with_memory(user_text)
+                        else:
+                            response_text = self.companion.call_bailian_api(user_text)
 
-                    print(f"AI回复: {response_text}")
+                        print(f"AI回复: {response_text}")
 
-                    # 文本转语音并播放
-                    # print("合成语音...")
-                    response_audio = self.companion.text_to_speech(response_text)
-
-                    if response_audio:
+                        # 文本转语音，边合成边播放
                         print("播放回复...")
-                        self.companion.play_audio(response_audio)
+                        self.companion.text_to_speech(response_text)
 
                     self.stats["processed_utterances"] += 1
                 else:
                     print("未识别到有效语音")
 
-                # 清理临时文件
-                try:
-                    os.remove(audio_filename)
-                except:
-                    pass
-
                 self.is_processing = False
-                self.current_state = "idle"
+                self._set_state(self._idle_state())
                 print("处理完成，返回监听状态...")
 
             except queue.Empty:
@@ -420,33 +702,48 @@ class RealTimeVoiceMonitor:
             except Exception as e:
                 print(f"处理线程错误: {e}")
                 self.is_processing = False
-                self.current_state = "idle"
+                self._set_state(self._idle_state())
 
     def start_realtime_listening(self):
         """启动实时监听"""
         print("启动实时语音监听系统...")
         print("机器人现在处于持续监听状态，可以随时说话")
         print("按下 Ctrl+C 停止监听")
-        # 自动校准环境噪音
-        self.auto_calibrate_threshold()
-
         self.is_listening = True
-        self.current_state = "idle"
+        self._sleeping = False
+        self.current_state = None  # 保证开始监听时通知一次
+        self._set_state("idle")
 
         # 启动各个线程
         threads = []
 
-        # 音频捕获线程
-        capture_thread = threading.Thread(target=self.audio_capture_thread)
-        capture_thread.daemon = True
-        capture_thread.start()
-        threads.append(capture_thread)
-
-        # 语音检测线程
-        detection_thread = threading.Thread(target=self.voice_detection_thread)
-        detection_thread.daemon = True
-        detection_thread.start()
-        threads.append(detection_thread)
+        if self.capture_mode == "process":
+            # 采集与检测在独立进程中运行，本进程只接收语音段事件，音频引擎只需要输出
+            self.audio_engine = self.audio_engine or get_audio_engine(enable_input=False)
+            self.audio_engine.set_directions(enable_input=False)
+            self._start_capture_process()
+            event_thread = threading.Thread(target=self.capture_event_thread)
+            event_thread.daemon = True
+            event_thread.start()
+            threads.append(event_thread)
+        else:
+            # 订阅常开的输入流，采集数据由音频引擎回调直接放入采集队列
+            self.audio_engine = self.audio_engine or get_audio_engine(enable_input=True)
+            self.audio_engine.set_directions(enable_input=True)
+            if self.audio_engine.input_rate != self.rate or self.audio_engine.chunk != self.chunk:
+                print(f"警告: 音频引擎的采样率/帧长（{self.audio_engine.input_rate}Hz/{self.audio_engine.chunk}）"
+                      f"与监听器设置（{self.rate}Hz/{self.chunk}）不一致")
+            self.audio_engine.subscribe(self._on_capture_frame)
+
+            # 语音检测线程
+            detection_thread = threading.Thread(target=self.voice_detection_thread)
+            detection_thread.daemon = True
+            detection_thread.start()
+            threads.append(detection_thread)
+
+        # 回声参考：实际播放的音频
+        if self.reference_ring is not None:
+            self.audio_engine.subscribe_playback(self._on_playback_frame)
 
         # 处理线程
         processing_thread = threading.Thread(target=self.processing_thread)
@@ -454,12 +751,6 @@ class RealTimeVoiceMonitor:
         processing_thread.start()
         threads.append(processing_thread)
 
-        # 状态显示线程
-        status_thread = threading.Thread(target=self.status_monitor_thread)
-        status_thread.daemon = True
-        status_thread.start()
-        threads.append(status_thread)
-
         try:
             # 主线程保持运行
             while self.is_listening:
@@ -469,32 +760,26 @@ class RealTimeVoiceMonitor:
             self.stop_realtime_listening()
 
         # 等待线程结束
+        if self.audio_engine is not None:
+            self.audio_engine.unsubscribe(self._on_capture_frame)
+            self.audio_engine.unsubscribe_playback(self._on_playback_frame)
         for thread in threads:
             thread.join(timeout=2)
+        self._stop_capture_process()
 
         print("实时监听系统已关闭")
 
-    def status_monitor_thread(self):
-        """状态监控线程 - 定期显示系统状态"""
-        tmp_print = ""
-        while self.is_listening:
-            status_info = {
-                "idle": "🟢 监听中 - 等待语音",
-                "detecting": "🟡 检测中 - 分析音频",
-                "recording": "🔴 录音中 - 请继续说话",
-                "processing": "🟣 处理中 - 生成回复"
-            }
-
-            status_emoji = status_info.get(self.current_state, "⚪ 未知状态")
-            stats_text = f"检测: {self.stats['total_detections']}次, 处理: {self.stats['processed_utterances']}次"
-            now_print = f"\r{status_emoji} | {stats_text} | 按Ctrl+C退出"
-            if now_print != tmp_print:
-                tmp_print = now_print
-                print(tmp_print, end="\n", flush=True)
-            time.sleep(0.5)
-
     def stop_realtime_listening(self):
         """停止实时监听"""
         self.is_listening = False
+        self.idle_monitor.interrupt()
+        # 录音中途停止，放弃正在进行的流式识别
+        self._cancel_recognizer(self.current_recognizer)
+        self.current_recognizer = None
         # 发送退出信号到处理队列
-        self.processing_queue.put(None)
\ No newline at end of file
+        self.processing_queue.put(None)
+        print(f"各阶段队列统计: {self.stage_stats()}")
+        if self.echo_suppressor is not None:
+            print(f"回声抑制统计: {self.stats['echo']}")
+        print(f"语音段过滤统计: {self.speech_gate.stats}")
+        print(f"低功耗待机统计: {self.stats['idle']}")
\ No newline at end of file